@@ -0,0 +1,157 @@
+import collections
+import pathlib
+
+from transmission_delete_unwanted.planning import (
+    RemoveFile,
+    TrimFile,
+    TorrentPlan,
+    plan_torrent,
+)
+from transmission_delete_unwanted.delete_unwanted import (
+    CorruptTorrentException,
+    DeleteUnwantedException,
+    OperationExecutor,
+    Summary,
+    TorrentProcessor,
+    VerificationTimeoutException,
+)
+
+# An API for driving transmission-delete-unwanted from a long-lived Python process,
+# as an alternative to running the command and parsing its output. It consists of:
+#
+#  - plan_torrent(), which works out which files to remove or trim given the
+#    torrent metadata and which pieces are present, without touching anything;
+#  - execute_operations(), which applies these operations to the files on disk;
+#  - run(), which does everything transmission-delete-unwanted does to each torrent,
+#    using the given transmission_rpc client, and yields a TorrentResult for each.
+
+# What execute_operations() did (or would have done, in dry run mode). `freed_bytes`
+# is the change in allocated disk space, which can be negative.
+ExecutionResult = collections.namedtuple(
+    "ExecutionResult",
+    [
+        "removed_file_count",
+        "trimmed_file_count",
+        "freed_bytes",
+        "hardlinked_file_count",
+        "sparse_file_count",
+    ],
+)
+
+# `execution` is None if the torrent did not need any processing.
+TorrentResult = collections.namedtuple(
+    "TorrentResult", ["info_hash", "name", "plan", "execution"]
+)
+
+
+def _discard(_message):
+    pass
+
+
+def _get_execution_result(summary):
+    return ExecutionResult(
+        removed_file_count=summary.removed_file_count,
+        trimmed_file_count=summary.trimmed_file_count,
+        freed_bytes=summary.freed_bytes,
+        hardlinked_file_count=summary.hardlinked_file_count,
+        sparse_file_count=summary.sparse_file_count,
+    )
+
+
+def execute_operations(
+    download_dir,
+    operations,
+    dry_run=False,
+    log=_discard,
+    trim_mmap=False,
+    durable=False,
+):
+    # Applies the operations from a TorrentPlan to the files in `download_dir`. The
+    # torrent must be stopped beforehand, and verified by Transmission afterwards,
+    # which is left to the caller. Returns an ExecutionResult.
+    executor = OperationExecutor(
+        pathlib.Path(download_dir),
+        operations,
+        log=log,
+        dry_run=dry_run,
+        trim_mmap=trim_mmap,
+        durable=durable,
+    )
+    try:
+        executor.execute()
+    finally:
+        executor.remove_temporary_files()
+    return _get_execution_result(executor.summary)
+
+
+def run(
+    transmission_client,
+    transmission_url,
+    torrent_ids=None,
+    dry_run=False,
+    log=_discard,
+    verify_timeout=None,
+    local_verify_threads=None,
+    metainfo_layout=False,
+    trim_mmap=False,
+    durable=False,
+    prestage=False,
+):
+    # Processes the given torrents (IDs or info hashes; default: all torrents) one
+    # after the other, as transmission-delete-unwanted would, and yields a
+    # TorrentResult as soon as each torrent is done. Messages are passed to `log`
+    # instead of being printed. Raises DeleteUnwantedException (or one of its
+    # subclasses, CorruptTorrentException and VerificationTimeoutException) if
+    # something goes wrong, in which case the current torrent is left as is.
+    # `transmission_url` is only used in messages.
+    if torrent_ids is None:
+        torrent_ids = [
+            torrent.info_hash
+            for torrent in transmission_client.get_torrents(arguments=["infohash"])
+        ]
+    download_dir = pathlib.Path(transmission_client.get_session().download_dir)
+    for torrent_id in torrent_ids:
+        summary = Summary()
+        processor = TorrentProcessor(
+            transmission_client=transmission_client,
+            torrent_info_hash=torrent_id,
+            download_dir=download_dir,
+            transmission_url=transmission_url,
+            summary=summary,
+            log=log,
+            dry_run=dry_run,
+            delete_rate_limiter=None,
+            delete_step_size=None,
+            trim_rate_limiter=None,
+            trim_mmap=trim_mmap,
+            durable=durable,
+            prestage=prestage,
+            verify_timeout=verify_timeout,
+            local_verify_threads=local_verify_threads,
+            metainfo_layout=metainfo_layout,
+        )
+        if processor.needs_processing:
+            processor.process(run_before_check=lambda: None)
+        yield TorrentResult(
+            info_hash=processor.info_hash,
+            name=processor.name,
+            plan=processor.plan,
+            execution=(
+                _get_execution_result(summary) if processor.needs_processing else None
+            ),
+        )
+
+
+__all__ = [
+    "CorruptTorrentException",
+    "DeleteUnwantedException",
+    "ExecutionResult",
+    "RemoveFile",
+    "TorrentPlan",
+    "TorrentResult",
+    "TrimFile",
+    "VerificationTimeoutException",
+    "execute_operations",
+    "plan_torrent",
+    "run",
+]
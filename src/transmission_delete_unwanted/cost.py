@@ -0,0 +1,63 @@
+import threading
+import time
+
+# Hashing throughput to assume until we have measured it, in bytes per second.
+DEFAULT_HASH_RATE = 100 * 1000 * 1000
+# Rough fixed cost of processing a torrent regardless of its size: stopping it,
+# removing and trimming files, waiting for Transmission to pick up the verification
+# request and restarting the torrent.
+TORRENT_OVERHEAD_SECONDS = 10
+# Small verifications are dominated by polling and queueing delays, so don't trust
+# measurements until enough data has been verified.
+_MIN_MEASURED_SIZE = 1024 * 1024 * 1024
+
+
+class CostModel:
+    # Estimates how long processing a torrent takes, so that we can tell which
+    # torrents are worth it. Most of the time goes into Transmission hashing the data
+    # that is left once we're done with the torrent, so the estimate is based on that.
+    # Shared across concurrently processed Transmission instances.
+    def __init__(self, hash_rate=None, time_budget=None, clock=time.monotonic):
+        assert hash_rate is None or hash_rate > 0
+        self._hash_rate = hash_rate
+        self._clock = clock
+        self._deadline = None if time_budget is None else clock() + time_budget
+        self._lock = threading.Lock()
+        self._measured_size = 0
+        self._measured_seconds = 0
+
+    @property
+    def hash_rate(self):
+        # The configured hashing throughput, or else the measured one.
+        if self._hash_rate is not None:
+            return self._hash_rate
+        with self._lock:
+            if self._measured_size >= _MIN_MEASURED_SIZE and self._measured_seconds > 0:
+                return self._measured_size / self._measured_seconds
+        return DEFAULT_HASH_RATE
+
+    @property
+    def has_time_budget(self):
+        return self._deadline is not None
+
+    def estimate_seconds(self, verify_size):
+        return TORRENT_OVERHEAD_SECONDS + verify_size / self.hash_rate
+
+    def reclaim_ratio(self, unwanted_bytes, verify_size):
+        # How much data we get rid of, relative to the cost of doing so expressed as
+        # the amount of data that could have been hashed in the same time.
+        return unwanted_bytes / (self.estimate_seconds(verify_size) * self.hash_rate)
+
+    def value(self, unwanted_bytes, verify_size):
+        # Bytes reclaimed per second of processing.
+        return unwanted_bytes / self.estimate_seconds(verify_size)
+
+    def remaining_seconds(self):
+        # None if there is no time budget.
+        return None if self._deadline is None else self._deadline - self._clock()
+
+    def observe(self, verify_size, seconds):
+        # Records how long it actually took to verify a torrent.
+        with self._lock:
+            self._measured_size += verify_size
+            self._measured_seconds += seconds
@@ -1,10 +1,58 @@
 import argparse
+import collections
+import contextlib
+import functools
+import itertools
+import os
 import pathlib
+import re
 import sys
-import backoff
-import humanize
-import transmission_rpc
-from transmission_delete_unwanted import file, pieces
+import time
+from transmission_delete_unwanted import (
+    cost,
+    file,
+    journal,
+    pieces,
+    planning,
+    recording,
+    throttle,
+)
+
+
+def positive(value_type):
+    def parse(string):
+        value = value_type(string)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(f"must be positive: {value}")
+        return value
+
+    return parse
+
+
+def _regex(string):
+    try:
+        return re.compile(string)
+    except re.error as exception:
+        raise argparse.ArgumentTypeError(
+            f"invalid regular expression: {exception}"
+        ) from exception
+
+
+DEFAULT_TRANSMISSION_URL = "http://127.0.0.1:9091"
+
+# Sort orders, as (key, reverse) arguments to sorted(), to apply on the estimated
+# verification cost of each torrent.
+_SCHEDULES = {
+    "shortest-first": (lambda verify_size: verify_size, False),
+    "longest-first": (lambda verify_size: verify_size, True),
+    "given": (lambda verify_size: 0, False),
+}
+
+
+def _schedule(items, verify_size, schedule):
+    key, reverse = _SCHEDULES[schedule]
+    # Note sorted() is stable, which is what makes the "given" schedule work.
+    return sorted(items, key=lambda item: key(verify_size(item)), reverse=reverse)
 
 
 def _parse_arguments(args):
@@ -14,8 +62,13 @@ def _parse_arguments(args):
     )
     argument_parser.add_argument(
         "--transmission-url",
-        help="URL of the Transmission instance to connect to",
-        default="http://127.0.0.1:9091",
+        help=(
+            "URL of the Transmission instance to connect to; can be specified multiple"
+            " times to process multiple instances concurrently (default:"
+            f" {DEFAULT_TRANSMISSION_URL})"
+        ),
+        action="append",
+        default=argparse.SUPPRESS,
     )
     argument_parser.add_argument(
         "--torrent-id",
@@ -26,6 +79,53 @@ def _parse_arguments(args):
         action="append",
         default=argparse.SUPPRESS,
     )
+    argument_parser.add_argument(
+        "--label",
+        help=(
+            "Only process torrents that have this label; can be specified multiple"
+            " times to process torrents that have any of the labels"
+        ),
+        action="append",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--name-regex",
+        help="Only process torrents whose name matches this regular expression",
+        type=_regex,
+        metavar="REGEX",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--download-dir-prefix",
+        help="Only process torrents whose download directory is within this directory",
+        type=pathlib.PurePath,
+        metavar="DIRECTORY",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--min-size",
+        help="Only process torrents whose total size is at least this many GB",
+        type=positive(float),
+        metavar="GB",
+        default=argparse.SUPPRESS,
+    )
+    recording.add_arguments(argument_parser)
+    add_processing_arguments(argument_parser)
+    parsed_args = argument_parser.parse_args(args)
+    recording.check_arguments(argument_parser, parsed_args)
+    if (
+        hasattr(parsed_args, "torrent_id")
+        and len(getattr(parsed_args, "transmission_url", [])) > 1
+    ):
+        argument_parser.error(
+            "--torrent-id cannot be used with multiple --transmission-url"
+        )
+    return parsed_args
+
+
+def add_processing_arguments(argument_parser):
+    # Adds the arguments that control how torrents are processed. These are shared
+    # with other commands that feed torrents into the same pipeline.
     argument_parser.add_argument(
         "--dry-run",
         help=(
@@ -35,7 +135,212 @@ def _parse_arguments(args):
         action="store_true",
         default=argparse.SUPPRESS,
     )
-    return argument_parser.parse_args(args)
+    argument_parser.add_argument(
+        "--delete-throttle-rate",
+        help=(
+            "Remove large files gradually by truncating them step by step, freeing at"
+            " most this many GB per second (default: remove files in one go)"
+        ),
+        type=positive(float),
+        metavar="GB_PER_SECOND",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--delete-throttle-step",
+        help=(
+            "When --delete-throttle-rate is used, how many MiB to truncate off a file"
+            " in each step"
+        ),
+        type=positive(int),
+        metavar="MIB",
+        default=1024,
+    )
+    argument_parser.add_argument(
+        "--trim-throttle-rate",
+        help=(
+            "Limit the rate at which data is copied when trimming files to this many"
+            " MB per second (default: unlimited)"
+        ),
+        type=positive(float),
+        metavar="MB_PER_SECOND",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--trim-mmap",
+        help=(
+            "Read the data to keep from files to be trimmed through a memory mapping"
+            " instead of regular reads, which avoids copying it through an"
+            " intermediate buffer"
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--schedule",
+        help=(
+            "Order in which torrents are processed and verified, based on how long"
+            " they are expected to take to verify. The default minimizes the total"
+            " amount of time torrents spend stopped. `given` uses the order in which"
+            " torrents are listed by --torrent-id or by Transmission."
+        ),
+        choices=list(_SCHEDULES.keys()),
+        default="shortest-first",
+    )
+    argument_parser.add_argument(
+        "--min-reclaim-ratio",
+        help=(
+            "Skip torrents where the amount of unwanted data is less than this"
+            " fraction of the amount of data Transmission will have to verify"
+            " afterwards (plus an allowance for the time the torrent spends stopped)."
+            " For example, 0.01 skips torrents where less than 1 GB would be freed for"
+            " every 100 GB to verify."
+        ),
+        type=positive(float),
+        metavar="RATIO",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--time-budget",
+        help=(
+            "Only process torrents that are expected to be done within this many"
+            " seconds from the start of the run, based on how long verification is"
+            " expected to take. Torrents are planned up front and processed in order"
+            " of space freed per second, and torrents that don't fit in the remaining"
+            " time are skipped. Torrents already being processed are not interrupted;"
+            " use --verify-timeout for that."
+        ),
+        type=positive(float),
+        metavar="SECONDS",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--hash-rate",
+        help=(
+            "How many MB per second Transmission verifies torrents at, for the purpose"
+            " of --min-reclaim-ratio and --time-budget (default: measured on the"
+            " torrents verified so far, assuming"
+            f" {cost.DEFAULT_HASH_RATE // (1000 * 1000)} MB/s until then)"
+        ),
+        type=positive(float),
+        metavar="MB_PER_SECOND",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--batch",
+        help=(
+            "Instead of processing torrents one at a time, stop all the torrents that"
+            " need processing at once, process them all, then verify and restart them"
+            " all at once. This reduces the number of RPC calls and overall processing"
+            " time, at the cost of keeping all torrents stopped for longer."
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--verify-timeout",
+        help=(
+            "Give up waiting for Transmission to finish verifying torrents after this"
+            " many seconds; the torrents are then left stopped (default: wait forever)"
+        ),
+        type=positive(float),
+        metavar="SECONDS",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--local-verify",
+        help=(
+            "Before asking Transmission to verify a torrent, hash the pieces that are"
+            " expected to still be there locally, using multiple threads, and report"
+            " any lost pieces early. Requires the .torrent file to be readable from"
+            " here."
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--local-verify-threads",
+        help="Number of threads to use for --local-verify (default: number of CPUs)",
+        type=positive(int),
+        metavar="COUNT",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--metainfo-layout",
+        help=(
+            "Read the list of files from the .torrent file instead of asking"
+            " Transmission for it, which is much cheaper for torrents with many files."
+            " Falls back to asking Transmission if the .torrent file can't be read"
+            " from here. Don't use this if files were renamed in Transmission."
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--prestage",
+        help=(
+            "Copy the data to keep from files to be trimmed before stopping the"
+            " torrent, so that the torrent only needs to be stopped for a short time"
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--durable",
+        help=(
+            "Make sure changes are safely persisted to stable storage before"
+            " proceeding, so that data is not lost or corrupted in case of a power"
+            " failure. Flushes are batched per torrent to keep the cost low."
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--journal",
+        help=(
+            "Record the progress of each torrent in this file, so that an interrupted"
+            " run can be picked up where it left off using --resume"
+        ),
+        metavar="FILE",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--resume",
+        help=(
+            "Resume the run recorded in the --journal file: skip torrents that were"
+            " already processed (unless their wanted files changed since), and finish"
+            " processing torrents that were interrupted"
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--idle-io-priority",
+        help=(
+            "Run with idle I/O priority, so that disk access from other processes"
+            " (e.g. Transmission seeding) takes precedence (Linux only)"
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+
+
+def _print(message, prefix=""):
+    # Note we write the whole line in one go, so that lines from concurrently
+    # processed Transmission instances do not get mixed up.
+    sys.stderr.write(f"{prefix}{message}\n")
+
+
+def _format_piece_ranges(piece_indices):
+    # Formats sorted piece indices compactly, e.g. "1-3, 7".
+    ranges = []
+    for piece_index in piece_indices:
+        if len(ranges) > 0 and ranges[-1][1] == piece_index - 1:
+            ranges[-1][1] = piece_index
+        else:
+            ranges.append([piece_index, piece_index])
+    return ", ".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
 
 
 def _is_dir_empty(path):
@@ -44,6 +349,53 @@ def _is_dir_empty(path):
     return True
 
 
+def _scan_files(root, file_names):
+    # Takes a snapshot of which files exist on disk, so that we don't have to probe
+    # the filesystem for every single file (which can be slow on network
+    # filesystems). Returns the set of names (relative to `root`) of the files found
+    # in the top-level directories the given torrent files live in.
+    present_file_names = set()
+    # Like Path.exists(), we follow symbolic links to directories. This keeps track
+    # of the directories we've been through, so that we don't get stuck in loops.
+    scanned_directories = set()
+
+    def scan_directory(directory_name):
+        try:
+            directory_stat = os.stat(root / directory_name)
+            directory_id = (directory_stat.st_dev, directory_stat.st_ino)
+            if directory_id in scanned_directories:
+                return
+            scanned_directories.add(directory_id)
+            with os.scandir(root / directory_name) as entries:
+                for entry in entries:
+                    entry_name = f"{directory_name}/{entry.name}"
+                    if entry.is_dir():
+                        scan_directory(entry_name)
+                    else:
+                        present_file_names.add(entry_name)
+        except FileNotFoundError:
+            pass
+
+    top_level_names = {}
+    for file_name in file_names:
+        top_level_name, separator, _ = file_name.partition("/")
+        top_level_names[top_level_name] = (
+            top_level_names.get(top_level_name, False) or separator != ""
+        )
+    for top_level_name, is_directory in top_level_names.items():
+        if is_directory:
+            scan_directory(top_level_name)
+        else:
+            # Single-file torrent. We don't want to list the entire download
+            # directory just for that, so look for the file directly.
+            present_file_names.update(
+                name
+                for name in (top_level_name, f"{top_level_name}.part")
+                if (root / name).exists()
+            )
+    return present_file_names
+
+
 class DeleteUnwantedException(Exception):
     pass
 
@@ -52,228 +404,513 @@ class CorruptTorrentException(DeleteUnwantedException):
     pass
 
 
-class _TorrentProcessor:
+class VerificationTimeoutException(DeleteUnwantedException):
+    pass
+
+
+def _set_idle_io_priority():
+    import subprocess
+
+    # Sadly Python does not expose ioprio_set(), so shell out to ionice(1) (from
+    # util-linux) instead.
+    try:
+        subprocess.run(
+            ["ionice", "--class", "idle", "--pid", str(os.getpid())], check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as exception:
+        raise DeleteUnwantedException(
+            f"Unable to set idle I/O priority: {exception}"
+        ) from exception
+
+
+def _naturalsize(size):
+    import humanize
+
+    return humanize.naturalsize(size, binary=True)
+
+
+def _poll(predicate):
+    # Retries the decorated function with exponential backoff for as long as its
+    # result satisfies the predicate. backoff is only imported on first call, so
+    # that it doesn't slow down startup.
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            import backoff
+
+            return backoff.on_predicate(
+                backoff.expo, predicate, factor=0.050, max_value=1.0
+            )(function)(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@_poll(lambda statuses: statuses is None)
+def _wait_for_status(transmission_client, torrent_ids, status_predicate):
+    statuses = [
+        torrent.status
+        for torrent in transmission_client.get_torrents(
+            torrent_ids, arguments=["status"]
+        )
+    ]
+    return statuses if all(status_predicate(status) for status in statuses) else None
+
+
+def _stop_torrents(transmission_client, torrent_ids):
+    import transmission_rpc
+
+    # Stop the torrents before we make any changes. We don't want to risk
+    # Transmission serving deleted pieces that it thinks are still there. It is only
+    # safe to resume the torrents after a completed verification (hash check).
+    transmission_client.stop_torrent(torrent_ids)
+    # Transmission does not stop torrents synchronously, so wait for the torrents to
+    # transition to the stopped state. Hopefully Transmission will not attempt to
+    # read from the torrent files after that point.
+    _wait_for_status(
+        transmission_client,
+        torrent_ids,
+        lambda status: status == transmission_rpc.Status.STOPPED,
+    )
+
+
+def _is_verifying(status):
+    import transmission_rpc
+
+    return status in (
+        transmission_rpc.Status.CHECKING,
+        transmission_rpc.Status.CHECK_PENDING,
+    )
+
+
+class _VerificationMonitor:
+    # Waits for Transmission to verify torrents, periodically reporting on progress.
+    _REPORT_INTERVAL_SECONDS = 10
+
     def __init__(
         self,
         transmission_client,
-        torrent_info_hash,
-        download_dir,
-        run_before_check,
-        transmission_url,
-        dry_run,
+        total_size_by_info_hash,
+        timeout,
+        log,
+        clock=time.monotonic,
     ):
         self._transmission_client = transmission_client
-        self._download_dir = download_dir
-        self._transmission_url = transmission_url
-        self._dry_run = dry_run
+        self._total_size_by_info_hash = total_size_by_info_hash
+        self._timeout = timeout
+        self._print = log
+        self._clock = clock
+        self._start_time = clock()
+        self._last_report_time = self._start_time
+        self._verified_size = 0
+        # Time and checked size when we first saw Transmission actually hashing, to
+        # compute the hashing rate.
+        self._rate_start = None
 
-        torrent = transmission_client.get_torrent(
-            torrent_info_hash,
-            arguments=[
-                "id",
-                "infohash",
-                "name",
-                "files",
-                "pieces",
-                "pieceCount",
-                "pieceSize",
-                "wanted",
-                "status",
-            ],
-        )
-        self._info_hash = torrent.info_hash
-        self._piece_size = torrent.piece_size
-        self._initially_stopped = torrent.status == transmission_rpc.Status.STOPPED
-        print(
-            f'>>> PROCESSING TORRENT: "{torrent.name}" (hash: {torrent.info_hash} id:'
-            f" {self._info_hash})",
-            file=sys.stderr,
-        )
+    @_poll(lambda verified_info_hashes: len(verified_info_hashes) == 0)
+    def wait_for_any(self, info_hashes):
+        # Returns the info hashes of the torrents that are done verifying.
+        import transmission_rpc
+
+        verified_info_hashes = []
+        checked_size = self._verified_size
+        checking = False
+        for torrent in self._transmission_client.get_torrents(
+            info_hashes, arguments=["infohash", "status", "recheckProgress"]
+        ):
+            total_size = self._total_size_by_info_hash[torrent.info_hash]
+            if _is_verifying(torrent.status):
+                checking = checking or (
+                    torrent.status == transmission_rpc.Status.CHECKING
+                )
+                checked_size += int(torrent.recheck_progress * total_size)
+                continue
+            assert torrent.status == transmission_rpc.Status.STOPPED
+            verified_info_hashes.append(torrent.info_hash)
+            self._verified_size += total_size
+        if len(verified_info_hashes) > 0:
+            return verified_info_hashes
+
+        now = self._clock()
+        if checking and self._rate_start is None:
+            self._rate_start = (now, checked_size)
+        if now - self._last_report_time >= self._REPORT_INTERVAL_SECONDS:
+            self._last_report_time = now
+            self._report(now, checked_size, checking)
+        if self._timeout is not None and now - self._start_time >= self._timeout:
+            raise VerificationTimeoutException(
+                "Timed out waiting for Transmission to verify torrents"
+                f" {', '.join(info_hashes)}. They have been left stopped; Transmission"
+                " will keep verifying them in the background. Make sure to restart"
+                " them manually once verification is complete (if they were running"
+                " before)."
+            )
+        return verified_info_hashes
+
+    def _report(self, now, checked_size, checking):
+        import humanize
 
-        total_piece_count = torrent.piece_count
-        self._pieces_wanted = pieces.pieces_wanted_from_files(
-            # Note we use torrent.fields["files"], not torrent.get_files(), to work around
-            # https://github.com/trim21/transmission-rpc/issues/455
-            [file["length"] for file in torrent.fields["files"]],
-            torrent.wanted,
-            torrent.piece_size,
+        if not checking:
+            self._print(
+                "Waiting for Transmission to start verification (other torrents may"
+                " be ahead in the queue)..."
+            )
+            return
+        total_size = sum(self._total_size_by_info_hash.values())
+        message = (
+            "Verification progress:"
+            f" {checked_size / total_size if total_size > 0 else 1:.0%}"
+            f" ({_naturalsize(checked_size)} of {_naturalsize(total_size)})"
         )
-        assert len(self._pieces_wanted) == total_piece_count
-        pieces_present = pieces.to_array(torrent.pieces, total_piece_count)
-        assert len(pieces_present) == total_piece_count
+        rate_start_time, rate_start_size = self._rate_start
+        if now > rate_start_time and checked_size > rate_start_size:
+            rate = (checked_size - rate_start_size) / (now - rate_start_time)
+            message += (
+                f" at {_naturalsize(rate)}/s; ETA:"
+                f" {humanize.naturaldelta((total_size - checked_size) / rate)}"
+            )
+        self._print(message)
 
-        pieces_wanted_present = list(zip(self._pieces_wanted, pieces_present))
-        self._pieces_present_wanted = [
-            present and wanted for wanted, present in pieces_wanted_present
-        ]
-        self._pieces_present_unwanted = [
-            present and not wanted for wanted, present in pieces_wanted_present
-        ]
 
-        pieces_present_unwanted_count = self._pieces_present_unwanted.count(True)
-        print(
-            f"Wanted: {self._format_piece_count(self._pieces_wanted.count(True))};"
-            f" present: {self._format_piece_count(pieces_present.count(True))}; present"
-            " and wanted:"
-            f" {self._format_piece_count(self._pieces_present_wanted.count(True))};"
+class Summary:
+    # Counters accumulated over a run. Also used by the api module.
+    def __init__(self):
+        self.torrent_count = 0
+        self.processed_torrent_count = 0
+        self.removed_file_count = 0
+        self.trimmed_file_count = 0
+        self.unwanted_bytes = 0
+        # Actual change in allocated disk space; may be negative.
+        self.freed_bytes = 0
+        self.hardlinked_file_count = 0
+        self.sparse_file_count = 0
+        # Torrents with unwanted pieces that were deemed not worth processing.
+        self.skipped_torrent_count = 0
+        self.skipped_unwanted_bytes = 0
+
+    def add(self, other):
+        self.torrent_count += other.torrent_count
+        self.processed_torrent_count += other.processed_torrent_count
+        self.removed_file_count += other.removed_file_count
+        self.trimmed_file_count += other.trimmed_file_count
+        self.unwanted_bytes += other.unwanted_bytes
+        self.freed_bytes += other.freed_bytes
+        self.hardlinked_file_count += other.hardlinked_file_count
+        self.sparse_file_count += other.sparse_file_count
+        self.skipped_torrent_count += other.skipped_torrent_count
+        self.skipped_unwanted_bytes += other.skipped_unwanted_bytes
+
+    def format(self, dry_run):
+        return (
+            f"{self.torrent_count} torrents examined;"
+            f" {self.processed_torrent_count} with unwanted pieces;"
+            f" {self.removed_file_count} files"
+            f" {'would have been removed' if dry_run else 'removed'};"
+            f" {self.trimmed_file_count} files"
+            f" {'would have been trimmed' if dry_run else 'trimmed'};"
             " present and not wanted:"
-            f" {self._format_piece_count(pieces_present_unwanted_count)}",
-            file=sys.stderr,
+            f" {_naturalsize(self.unwanted_bytes)};"
+            f" {'space that would have been freed' if dry_run else 'space freed'}:"
+            f" {_naturalsize(self.freed_bytes)}"
+            + (
+                f"; {self.skipped_torrent_count} torrents skipped"
+                f" ({_naturalsize(self.skipped_unwanted_bytes)} not wanted)"
+                if self.skipped_torrent_count > 0
+                else ""
+            )
+            + (
+                f"; {self.hardlinked_file_count} hardlinked files (space not freed)"
+                if self.hardlinked_file_count > 0
+                else ""
+            )
+            + (
+                f"; {self.sparse_file_count} sparse files"
+                if self.sparse_file_count > 0
+                else ""
+            )
         )
 
-        if pieces_present_unwanted_count == 0:
-            print("Every downloaded piece is wanted. Nothing to do.", file=sys.stderr)
-            return
 
-        self._stop_torrent()
+def _split_files(torrent_files):
+    # Turns the file list from Transmission into separate lists of names, lengths and
+    # completed bytes.
+    return (
+        [torrent_file["name"] for torrent_file in torrent_files],
+        [torrent_file["length"] for torrent_file in torrent_files],
+        [torrent_file["bytesCompleted"] for torrent_file in torrent_files],
+    )
 
-        try:
-            current_offset = 0
-            for torrent_file, file_wanted in zip(
-                torrent.fields["files"], torrent.wanted
-            ):
-                file_length = torrent_file["length"]
-                self._process_file(
-                    torrent_file["name"], file_length, current_offset, file_wanted
-                )
-                current_offset += file_length
 
-            run_before_check()
-        except:
-            # If we are interrupted while touching torrent data, before we bail at least try
-            # to kick off a verification so that Transmission is aware that data may have
-            # changed. Otherwise the risk is the user may just resume the torrent and start
-            # serving corrupt pieces.
-            if not dry_run:
-                transmission_client.verify_torrent(torrent_info_hash)
-            raise
+# Torrent metadata that the caller already fetched from Transmission. `files` is in
+# the same format as the "files" torrent field; `wanted` lists whether each file is
+# wanted.
+PrefetchedTorrent = collections.namedtuple(
+    "PrefetchedTorrent", ["info_hash", "files", "wanted"]
+)
 
-        if not dry_run:
-            self._check_torrent()
-            if not self._initially_stopped:
-                transmission_client.start_torrent(self._info_hash)
+_PendingTrim = collections.namedtuple(
+    "_PendingTrim", ["original_file_path", "part_file_path", "new_file_path"]
+)
+_StagedTrim = collections.namedtuple(
+    "_StagedTrim", ["pending_trim", "source_file_path", "source_file_stat"]
+)
 
-    def _stop_torrent(self):
-        if self._initially_stopped or self._dry_run:
-            return
 
-        # Stop the torrent before we make any changes. We don't want to risk
-        # Transmission serving deleted pieces that it thinks are still there. It is only
-        # safe to resume the torrent after a completed verification (hash check).
-        self._transmission_client.stop_torrent(self._info_hash)
-        # Transmission does not stop torrents synchronously, so wait for the torrent to
-        # transition to the stopped state. Hopefully Transmission will not attempt to
-        # read from the torrent files after that point.
-        self._wait_for_status(lambda status: status == transmission_rpc.Status.STOPPED)
-
-    def _process_file(self, file_name, file_length, current_offset, file_wanted):
-        begin_piece = current_offset // self._piece_size
-        end_piece = -(-(current_offset + file_length) // self._piece_size)
-        next_offset = current_offset + file_length
-
-        if not any(self._pieces_present_unwanted[begin_piece:end_piece]):
+def _is_same_file_state(stat_before, stat_after):
+    return (
+        stat_before.st_dev,
+        stat_before.st_ino,
+        stat_before.st_size,
+        stat_before.st_mtime_ns,
+    ) == (
+        stat_after.st_dev,
+        stat_after.st_ino,
+        stat_after.st_size,
+        stat_after.st_mtime_ns,
+    )
+
+
+class OperationExecutor:
+    # Applies the operations planned by planning.plan_torrent() to the files in
+    # `download_dir`. The torrent must be stopped while execute() runs, but
+    # stage_trims() can be called beforehand, while it is still running. Call
+    # remove_temporary_files() when done, whatever happens. Messages are passed to
+    # `log`, and statistics are added to `summary` (a fresh one by default).
+    def __init__(
+        self,
+        download_dir,
+        operations,
+        log,
+        summary=None,
+        dry_run=False,
+        delete_rate_limiter=None,
+        delete_step_size=None,
+        trim_rate_limiter=None,
+        trim_mmap=False,
+        durable=False,
+    ):
+        self._download_dir = download_dir
+        self._operations = operations
+        self._print = log
+        self.summary = Summary() if summary is None else summary
+        self._dry_run = dry_run
+        self._delete_rate_limiter = delete_rate_limiter
+        self._delete_step_size = delete_step_size
+        self._trim_rate_limiter = trim_rate_limiter
+        self._trim_mmap = trim_mmap
+        self._durable = durable
+        self.freed_bytes = 0
+        self._present_file_names = set()
+        self._staged_trims = {}
+        self._pending_trims = []
+        self._temporary_file_paths = set()
+        self._changed_directories = set()
+
+    def stage_trims(self):
+        # Copies the data to keep from files to be trimmed while the torrent is still
+        # running. This data belongs to valid wanted pieces, so it is not expected to
+        # change under us, and doing this ahead of time means the torrent only needs
+        # to be stopped for the renames and deletions. We still double-check the
+        # source file hasn't been touched before we use the result, though.
+        if self._dry_run:
             return
-        assert not file_wanted
-
-        if any(self._pieces_present_wanted[begin_piece:end_piece]):
-            # The file is not wanted, but it contains valid pieces that are wanted.
-            # In practice this means the file contains pieces that overlap with
-            # wanted, adjacent files. We can't get rid of the file without
-            # corrupting these pieces; best we can do is turn it into a partial
-            # file.
-
-            # Sanity check that the wanted pieces are where we expect them to be.
-            assert (
-                current_offset % self._piece_size != 0
-                or not self._pieces_wanted[begin_piece]
-            )
-            assert (
-                next_offset % self._piece_size != 0
-                or not self._pieces_wanted[end_piece - 1]
-            )
-            assert not any(self._pieces_wanted[begin_piece + 1 : end_piece - 1])
-
-            keep_first_bytes = (
-                (begin_piece + 1) * self._piece_size - current_offset
-                if self._pieces_present_wanted[begin_piece]
-                else 0
-            )
-            assert 0 <= keep_first_bytes < self._piece_size
-            keep_last_bytes = (
-                self._piece_size
-                - (end_piece * self._piece_size - current_offset - file_length)
-                if self._pieces_present_wanted[end_piece - 1]
-                else self._piece_size
-            )
-            assert 0 < keep_last_bytes <= self._piece_size
-            keep_last_bytes %= self._piece_size
-            assert keep_first_bytes > 0 or keep_last_bytes > 0
-            assert (keep_first_bytes + keep_last_bytes) < file_length
-            self._trim_file(
-                file_name,
-                keep_first_bytes=keep_first_bytes,
-                keep_last_bytes=keep_last_bytes,
-            )
-        else:
-            # The file does not contain any data from wanted, valid pieces; we can
-            # safely get rid of it.
-            self._remove_file(file_name)
+        trims = [
+            operation
+            for operation in self._operations
+            if isinstance(operation, planning.TrimFile)
+        ]
+        if len(trims) == 0:
+            return
+        self._present_file_names = _scan_files(
+            self._download_dir, (trim.file_name for trim in trims)
+        )
+        for trim in trims:
+            self._print(f"Pre-staging trim: {trim.file_name}")
+            self._staged_trims[trim.file_name] = self._copy_kept_data(trim)
+
+    def execute(self):
+        self._present_file_names = _scan_files(
+            self._download_dir,
+            (operation.file_name for operation in self._operations),
+        )
+        for operation in self._operations:
+            if isinstance(operation, planning.TrimFile):
+                self._trim_file(operation)
+            else:
+                self._remove_file(operation.file_name)
+        self._commit()
+        self._print(
+            f"{'Space that would have been freed' if self._dry_run else 'Space freed'}:"
+            f" {_naturalsize(self.freed_bytes)}"
+        )
 
-    def _trim_file(self, file_name, keep_first_bytes, keep_last_bytes):
-        print(
-            f"{'Would have trimmed' if self._dry_run else 'Trimming'}: {file_name}",
-            file=sys.stderr,
+    def remove_temporary_files(self):
+        for temporary_file_path in self._temporary_file_paths:
+            temporary_file_path.unlink(missing_ok=True)
+        self._temporary_file_paths.clear()
+        self._staged_trims.clear()
+        self._pending_trims.clear()
+
+    def _trim_file(self, trim):
+        self._print(
+            f"{'Would have trimmed' if self._dry_run else 'Trimming'}: {trim.file_name}"
         )
+        self.summary.trimmed_file_count += 1
         if self._dry_run:
+            try:
+                source_file = open(  # pylint: disable=consider-using-with
+                    self._get_trim_source_file_path(trim), "rb"
+                )
+            except FileNotFoundError:
+                # Can happen when replaying a recording from another machine.
+                self._print(f"WARNING: could not find {trim.file_name} to trim")
+                return
+            with source_file:
+                source_file_stat = os.fstat(source_file.fileno())
+                # Only the data extents of the kept ranges will be written out, in
+                # whole blocks.
+                block_size = source_file_stat.st_blksize
+                allocated_after = sum(
+                    (
+                        -(-(extent_offset + extent_length) // block_size)
+                        - extent_offset // block_size
+                    )
+                    * block_size
+                    for range_offset, range_length in (
+                        (0, trim.keep_first_bytes),
+                        (
+                            source_file_stat.st_size - trim.keep_last_bytes,
+                            trim.keep_last_bytes,
+                        ),
+                    )
+                    for extent_offset, extent_length in file.data_extents(
+                        source_file, range_offset, range_length
+                    )
+                )
+            self._account(
+                trim.file_name, source_file_stat, allocated_after=allocated_after
+            )
             return
 
+        staged_trim = self._staged_trims.pop(trim.file_name, None)
+        if staged_trim is not None and (
+            staged_trim.source_file_path != self._get_trim_source_file_path(trim)
+            or not _is_same_file_state(
+                staged_trim.source_file_stat, staged_trim.source_file_path.stat()
+            )
+        ):
+            self._print(
+                f"WARNING: {trim.file_name} changed since the trim was pre-staged;"
+                " trimming again"
+            )
+            staged_trim = None
+        if staged_trim is None:
+            staged_trim = self._copy_kept_data(trim)
+        self._account(
+            trim.file_name,
+            staged_trim.source_file_stat,
+            allocated_after=file.allocated_size(
+                staged_trim.pending_trim.new_file_path.stat()
+            ),
+        )
+        self._pending_trims.append(staged_trim.pending_trim)
+
+        # In durable mode, we defer the rest of the work so that we can flush all the
+        # new files in one go (see _commit()).
+        if not self._durable:
+            self._commit()
+
+    def _get_trim_source_file_path(self, trim):
+        return self._download_dir / (
+            trim.file_name
+            if trim.file_name in self._present_file_names
+            else f"{trim.file_name}.part"
+        )
+
+    def _copy_kept_data(self, trim):
         # Note: on some operating systems there are ways to do this in-place without any
         # copies ("hole punching"), e.g. fallocate(FALLOC_FL_PUNCH_HOLE) on Linux. This
         # doesn't seem to be worth the extra complexity though, given the amount of data
         # being copied should be relatively small.
-        original_file_path = self._download_dir / file_name
-        part_file_path = self._download_dir / f"{file_name}.part"
-        new_file_path = (
-            self._download_dir / f"{file_name}.transmission-delete-unwanted-tmp"
+        pending_trim = _PendingTrim(
+            original_file_path=self._download_dir / trim.file_name,
+            part_file_path=self._download_dir / f"{trim.file_name}.part",
+            new_file_path=(
+                self._download_dir
+                / f"{trim.file_name}.transmission-delete-unwanted-tmp"
+            ),
         )
-        try:
-            with (
-                open(
-                    (
-                        original_file_path
-                        if original_file_path.exists()
-                        else part_file_path
-                    ),
-                    "rb",
-                ) as original_file,
-                open(new_file_path, "wb") as new_file,
-            ):
-                if keep_first_bytes > 0:
-                    file.copy(original_file, new_file, keep_first_bytes)
-                if keep_last_bytes > 0:
-                    original_file.seek(
-                        -keep_last_bytes,
-                        2,  # Seek from the end
-                    )
-                    new_file.seek(original_file.tell())
-                    file.copy(original_file, new_file, keep_last_bytes)
+        source_file_path = self._get_trim_source_file_path(trim)
+        # Register the new file before we create it, so that it gets cleaned up if
+        # anything goes wrong.
+        self._temporary_file_paths.add(pending_trim.new_file_path)
+        with (
+            open(source_file_path, "rb") as original_file,
+            open(pending_trim.new_file_path, "wb") as new_file,
+        ):
+            source_file_stat = os.fstat(original_file.fileno())
+            if trim.keep_first_bytes > 0:
+                file.copy_sparse(
+                    original_file,
+                    new_file,
+                    trim.keep_first_bytes,
+                    rate_limiter=self._trim_rate_limiter,
+                    use_mmap=self._trim_mmap,
+                )
+            if trim.keep_last_bytes > 0:
+                original_file.seek(
+                    -trim.keep_last_bytes,
+                    2,  # Seek from the end
+                )
+                new_file.seek(original_file.tell())
+                file.copy_sparse(
+                    original_file,
+                    new_file,
+                    trim.keep_last_bytes,
+                    rate_limiter=self._trim_rate_limiter,
+                    use_mmap=self._trim_mmap,
+                )
+        return _StagedTrim(
+            pending_trim=pending_trim,
+            source_file_path=source_file_path,
+            source_file_stat=source_file_stat,
+        )
+
+    def _commit(self):
+        if self._durable and len(self._pending_trims) > 0:
+            # The new files need to be safely on disk *before* we rename them over the
+            # old ones, otherwise a power failure could leave us with truncated files.
+            file.sync(
+                [pending_trim.new_file_path for pending_trim in self._pending_trims]
+            )
+        for pending_trim in self._pending_trims:
+            pending_trim.new_file_path.replace(pending_trim.part_file_path)
+            self._temporary_file_paths.discard(pending_trim.new_file_path)
+            pending_trim.original_file_path.unlink(missing_ok=True)
+            self._changed_directories.add(pending_trim.part_file_path.parent)
+        self._pending_trims.clear()
 
-            new_file_path.replace(part_file_path)
-            original_file_path.unlink(missing_ok=True)
-        finally:
-            new_file_path.unlink(missing_ok=True)
+        if self._durable:
+            for directory_path in self._changed_directories:
+                file.sync_directory(directory_path)
+        self._changed_directories.clear()
 
     def _remove_file(self, file_name):
         def delete(file_name_to_delete):
-            file_path = self._download_dir / file_name_to_delete
-            if not file_path.exists():
+            if file_name_to_delete not in self._present_file_names:
                 return False
-            print(
+            file_path = self._download_dir / file_name_to_delete
+            self._print(
                 f"{'Would have removed' if self._dry_run else 'Removing'}:"
-                f" {file_name_to_delete}",
-                file=sys.stderr,
+                f" {file_name_to_delete}"
             )
+            self._account(file_name_to_delete, file_path.stat(), allocated_after=0)
             if not self._dry_run:
+                if self._delete_rate_limiter is not None:
+                    file.truncate_gradually(
+                        file_path, self._delete_step_size, self._delete_rate_limiter
+                    )
                 file_path.unlink()
             return True
 
@@ -281,100 +918,1109 @@ class _TorrentProcessor:
         # "xxx" *and* another file named "xxx.part", this may end up deleting the
         # wrong file. For now we just accept the risk.
         if not any([delete(file_name), delete(f"{file_name}.part")]):
-            print(f"WARNING: could not find {file_name} to delete", file=sys.stderr)
+            self._print(f"WARNING: could not find {file_name} to delete")
             return
+        self.summary.removed_file_count += 1
 
         if not self._dry_run:
             parent_dir = (self._download_dir / file_name).parent
             while _is_dir_empty(parent_dir):
                 parent_dir.rmdir()
+                self._changed_directories.discard(parent_dir)
                 parent_dir = parent_dir.parent
+            self._changed_directories.add(parent_dir)
 
-    def _check_torrent(self):
-        print(
-            "All done, kicking off torrent verification. This may take a while...",
-            file=sys.stderr,
-        )
-        self._transmission_client.verify_torrent(self._info_hash)
-        status = self._wait_for_status(
-            lambda status: status
-            not in (
-                transmission_rpc.Status.CHECKING,
-                transmission_rpc.Status.CHECK_PENDING,
-            ),
+    def _account(self, file_name, file_stat, allocated_after):
+        # Keeps track of how much disk space we actually free up, given the state of
+        # the file before we touch it and how much space will be allocated for what
+        # replaces it.
+        allocated_before = file.allocated_size(file_stat)
+        if file_stat.st_nlink > 1:
+            # The data stays around for the other links, so we free nothing (and
+            # trimming even uses up more space).
+            self._print(
+                f"NOTE: {file_name} has {file_stat.st_nlink - 1} other hard links; its"
+                " space is not freed"
+            )
+            self.summary.hardlinked_file_count += 1
+            allocated_before = 0
+        if file.is_sparse(file_stat):
+            self._print(
+                f"NOTE: {file_name} is sparse; only"
+                f" {_naturalsize(file.allocated_size(file_stat))} out of"
+                f" {_naturalsize(file_stat.st_size)} are allocated"
+            )
+            self.summary.sparse_file_count += 1
+        freed_bytes = allocated_before - allocated_after
+        self.freed_bytes += freed_bytes
+        self.summary.freed_bytes += freed_bytes
+
+
+class TorrentProcessor:
+    # Plans and processes a single torrent: the constructor fetches the torrent and
+    # plans it, and process() does the rest if `needs_processing`. Also used by the
+    # api module.
+    def __init__(
+        self,
+        transmission_client,
+        torrent_info_hash,
+        download_dir,
+        transmission_url,
+        summary,
+        log,
+        dry_run,
+        delete_rate_limiter,
+        delete_step_size,
+        trim_rate_limiter,
+        trim_mmap,
+        durable,
+        prestage,
+        verify_timeout,
+        local_verify_threads=None,
+        metainfo_layout=False,
+        prefetched_torrent=None,
+        torrent_journal=None,
+    ):
+        self._transmission_client = transmission_client
+        self._download_dir = download_dir
+        self._transmission_url = transmission_url
+        self._print = log
+        self._dry_run = dry_run
+        self._prestage = prestage
+        self._verify_timeout = verify_timeout
+        self._local_verify_threads = local_verify_threads
+        self._metainfo_layout = metainfo_layout
+        self._journal = torrent_journal
+        # Where we left off last time, if we are resuming a torrent.
+        self._resume_phase = None
+        # How long Transmission took to verify the torrent, if it did.
+        self.verify_seconds = None
+
+        from transmission_rpc import Status
+
+        torrent = self._fetch_torrent(torrent_info_hash, prefetched_torrent)
+        self.info_hash = torrent.info_hash
+        self.name = torrent.name
+        self.initially_stopped = torrent.status == Status.STOPPED
+        self._piece_size = torrent.piece_size
+        self._print(
+            f'>>> PROCESSING TORRENT: "{torrent.name}" (hash: {torrent.info_hash} id:'
+            f" {self.info_hash})"
         )
-        assert status == transmission_rpc.Status.STOPPED
+        (
+            self._file_names,
+            self._file_lengths,
+            self._files_bytes_completed,
+            files_padding,
+        ) = self._get_file_table(torrent, prefetched_torrent)
+        self.total_size = sum(self._file_lengths)
+
+        self.plan = planning.plan_torrent(
+            self._file_names,
+            self._file_lengths,
+            self._files_wanted,
+            self._piece_size,
+            pieces.to_array(torrent.pieces, torrent.piece_count),
+            files_bytes_completed=self._files_bytes_completed,
+            files_padding=files_padding,
+        )
+        # How much data Transmission will have to hash when verifying the torrent
+        # after we're done with it.
+        self.verify_size = self.plan.verify_size
+        summary.torrent_count += 1
+        self._print(
+            f"Wanted: {self._format_piece_count(self.plan.pieces_wanted.count(True))};"
+            " present:"
+            f" {self._format_piece_count(self.plan.pieces_present.count(True))};"
+            " present and wanted:"
+            f" {self._format_piece_count(self.plan.pieces_present_wanted.count(True))};"
+            " present and not wanted:"
+            f" {self._format_piece_count(self.plan.pieces_present_unwanted.count(True))}"
+        )
+
+        self.needs_processing = self._plan_journal(self.plan.unwanted_bytes)
+        if not self.needs_processing:
+            return
+        summary.processed_torrent_count += 1
+        summary.unwanted_bytes += self.plan.unwanted_bytes
+        self._executor = OperationExecutor(
+            download_dir,
+            self.plan.operations,
+            log=self._print,
+            summary=summary,
+            dry_run=dry_run,
+            delete_rate_limiter=delete_rate_limiter,
+            delete_step_size=delete_step_size,
+            trim_rate_limiter=trim_rate_limiter,
+            trim_mmap=trim_mmap,
+            durable=durable,
+        )
+
+    def _fetch_torrent(self, torrent_info_hash, prefetched_torrent):
         torrent = self._transmission_client.get_torrent(
-            self._info_hash, arguments=["pieces"]
+            torrent_info_hash,
+            arguments=[
+                "id",
+                "infohash",
+                "name",
+                "pieces",
+                "pieceCount",
+                "pieceSize",
+                "status",
+                # Cheap enough to always fetch, and needed to tell pad files apart.
+                "torrentFile",
+            ]
+            # The file list can be huge, so don't fetch it again if the caller already
+            # has it, nor at all if we can get it from the metainfo.
+            + (
+                []
+                if prefetched_torrent is not None
+                else ["wanted"] if self._metainfo_layout else ["files", "wanted"]
+            ),
+        )
+        self._metainfo_path = torrent.fields.get("torrentFile")
+        # Note we make a copy, as unmark_padding_files() updates it.
+        self._files_wanted = list(
+            torrent.wanted if prefetched_torrent is None else prefetched_torrent.wanted
+        )
+        return torrent
+
+    def _get_file_table(self, torrent, prefetched_torrent):
+        # Returns the file names, lengths, completed bytes and which files are pad
+        # files (the last two being None if unknown).
+        if prefetched_torrent is not None:
+            return self._find_padding(*_split_files(prefetched_torrent.files))
+        if not self._metainfo_layout:
+            # Note we use torrent.fields["files"], not torrent.get_files(), to work
+            # around https://github.com/trim21/transmission-rpc/issues/455
+            return self._find_padding(*_split_files(torrent.fields["files"]))
+
+        torrent_metainfo = self._metainfo
+        if torrent_metainfo is not None and (
+            torrent_metainfo.file_names is None
+            or len(torrent_metainfo.file_lengths) != len(self._files_wanted)
+            or -(-sum(torrent_metainfo.file_lengths) // self._piece_size)
+            != torrent.piece_count
+        ):
+            self._print(
+                f"WARNING: unable to use the file list from {self._metainfo_path}"
+            )
+            torrent_metainfo = None
+        if torrent_metainfo is None:
+            self._print("Falling back to fetching the file list from Transmission")
+            return (
+                *_split_files(
+                    self._transmission_client.get_torrent(
+                        self.info_hash, arguments=["files"]
+                    ).fields["files"]
+                ),
+                None,
+            )
+        # Transmission would tell us which files have data, but we don't need to know
+        # that: files without data can't contain any present pieces, so we won't plan
+        # any operations for them anyway.
+        return (
+            torrent_metainfo.file_names,
+            torrent_metainfo.file_lengths,
+            None,
+            torrent_metainfo.file_padding,
+        )
+
+    def _find_padding(self, file_names, file_lengths, files_bytes_completed):
+        # Transmission doesn't tell us which files are pad files; only the metainfo
+        # can. Names are merely a hint that the torrent may have some, so that we
+        # don't read the metainfo of every torrent for nothing.
+        files_padding = None
+        if self._metainfo_path is not None and any(
+            planning.is_padding_file(file_name, file_length, self._piece_size)
+            for file_name, file_length in zip(file_names, file_lengths)
+        ):
+            torrent_metainfo = self._metainfo
+            if torrent_metainfo is not None and (
+                list(torrent_metainfo.file_lengths) == file_lengths
+            ):
+                files_padding = torrent_metainfo.file_padding
+        return file_names, file_lengths, files_bytes_completed, files_padding
+
+    @functools.cached_property
+    def _metainfo(self):
+        # The metainfo read from the .torrent file, or None if it can't be used.
+        from transmission_delete_unwanted import metainfo
+
+        try:
+            torrent_metainfo = metainfo.read(self._metainfo_path)
+        except (OSError, metainfo.MetainfoException) as exception:
+            self._print(f"WARNING: unable to read {self._metainfo_path}: {exception}")
+            return None
+        if (
+            torrent_metainfo.info_hash != self.info_hash
+            or torrent_metainfo.piece_size != self._piece_size
+        ):
+            self._print(f"WARNING: {self._metainfo_path} does not match the torrent")
+            return None
+        return torrent_metainfo
+
+    def _plan_journal(self, unwanted_bytes):
+        # Returns whether the torrent needs processing. Note that even if there is
+        # nothing left to delete, we may still need to get the torrent verified and/or
+        # restarted after an interrupted run.
+        stopped_by_us = self._resume_from_journal()
+        # Such torrents have to be seen through, even if they are not worth it.
+        self.interrupted = stopped_by_us
+        if unwanted_bytes == 0 and not stopped_by_us:
+            self._print("Every downloaded piece is wanted. Nothing to do.")
+            self.record(journal.RESTARTED)
+            return False
+        # Don't overwrite the information that we stopped the torrent.
+        if not stopped_by_us:
+            self.record(journal.PLANNED)
+        return True
+
+    def _resume_from_journal(self):
+        # Returns whether the torrent may have been stopped by us in a previous run.
+        journal_entry = (
+            None
+            if self._journal is None
+            else self._journal.get(self._transmission_url, self.info_hash)
+        )
+        if journal_entry is None or journal_entry["phase"] not in (
+            journal.STOPPED_PHASES
+        ):
+            return False
+        # Transmission will now report the torrent as stopped, but that may be our
+        # doing.
+        self.initially_stopped = journal_entry["initially_stopped"]
+        if journal_entry["wanted"] == journal.fingerprint(self._files_wanted):
+            self._resume_phase = journal_entry["phase"]
+            self._print(
+                f"Resuming from journal; last completed phase: {self._resume_phase}"
+            )
+        else:
+            self._print(
+                "Wanted files changed since the torrent was journaled; starting over."
+            )
+        return True
+
+    def process(self, run_before_check):
+        if not self.files_done:
+            self.unmark_padding_files()
+            try:
+                self.stage_trims()
+                self._stop_torrent()
+
+                try:
+                    self.process_files()
+                    run_before_check()
+                except:
+                    # If we are interrupted while touching torrent data, before we
+                    # bail at least try to kick off a verification so that
+                    # Transmission is aware that data may have changed. Otherwise the
+                    # risk is the user may just resume the torrent and start serving
+                    # corrupt pieces.
+                    if not self._dry_run:
+                        self._transmission_client.verify_torrent(self.info_hash)
+                    raise
+            finally:
+                self.remove_temporary_files()
+            self.record(journal.FILES_DONE)
+
+        if not self._dry_run:
+            if self._resume_phase != journal.VERIFIED:
+                verify_start_time = time.monotonic()
+                self._check_torrent()
+                self.verify_seconds = time.monotonic() - verify_start_time
+            if not self.initially_stopped:
+                self._transmission_client.start_torrent(self.info_hash)
+            self.record(journal.RESTARTED)
+
+    @property
+    def files_done(self):
+        # Whether a previous run already got done with the files, so that all that's
+        # left is verifying and restarting the torrent.
+        return self._resume_phase in (
+            journal.FILES_DONE,
+            journal.VERIFY_REQUESTED,
+            journal.VERIFIED,
+        )
+
+    @property
+    def verified(self):
+        return self._resume_phase == journal.VERIFIED
+
+    def record(self, phase):
+        if self._journal is None or self._dry_run:
+            return
+        self._journal.record(
+            self._transmission_url,
+            self.info_hash,
+            phase,
+            files_wanted=self._files_wanted,
+            initially_stopped=self.initially_stopped,
+        )
+
+    def unmark_padding_files(self):
+        # The plan treats pad files as unwanted, but Transmission doesn't know that.
+        # If we didn't tell it, it would try to download the pieces they share with
+        # the files we remove all over again.
+        padding_file_ids = [
+            file_index
+            for file_index, (file_wanted, file_padding) in enumerate(
+                zip(self._files_wanted, self.plan.files_padding)
+            )
+            if file_wanted and file_padding
+        ]
+        if len(padding_file_ids) == 0:
+            return
+        self._print(f"Marking {len(padding_file_ids)} pad files as unwanted")
+        if self._dry_run:
+            return
+        self._transmission_client.change_torrent(
+            self.info_hash, files_unwanted=padding_file_ids
+        )
+        # Keep the journal consistent with what Transmission now reports.
+        for file_index in padding_file_ids:
+            self._files_wanted[file_index] = False
+
+    def stage_trims(self):
+        if self._prestage:
+            self._executor.stage_trims()
+
+    def process_files(self):
+        self._executor.execute()
+
+    def remove_temporary_files(self):
+        self._executor.remove_temporary_files()
+
+    def _stop_torrent(self):
+        if self.initially_stopped or self._dry_run:
+            return
+        # Record this before asking Transmission, so that if we get interrupted while
+        # the torrent is being stopped, a resumed run knows to restart it.
+        self.record(journal.STOPPED)
+        _stop_torrents(self._transmission_client, [self.info_hash])
+
+    def _check_torrent(self):
+        try:
+            self.verify_locally()
+        except CorruptTorrentException:
+            # Make sure Transmission finds out about the damage too.
+            self._transmission_client.verify_torrent(self.info_hash)
+            raise
+        self._print(
+            "All done, kicking off torrent verification. This may take a while..."
+        )
+        self._transmission_client.verify_torrent(self.info_hash)
+        self.record(journal.VERIFY_REQUESTED)
+        _VerificationMonitor(
+            self._transmission_client,
+            {self.info_hash: self.total_size},
+            timeout=self._verify_timeout,
+            log=self._print,
+        ).wait_for_any([self.info_hash])
+        self.check_pieces(
+            self._transmission_client.get_torrent(
+                self.info_hash, arguments=["pieces"]
+            ).pieces
+        )
+        self.record(journal.VERIFIED)
+
+    def verify_locally(self):
+        # Hashes the pieces we expect to still be there ourselves, which is much
+        # faster than waiting for Transmission to do it on a single thread. This
+        # doesn't replace Transmission's check (Transmission still needs to find out
+        # which pieces are gone), but it reports any damage early.
+        if self._local_verify_threads is None:
+            return
+        from transmission_delete_unwanted import metainfo, verify
+
+        torrent_metainfo = self._metainfo
+        if (
+            torrent_metainfo is None
+            or torrent_metainfo.piece_hashes is None
+            or len(torrent_metainfo.piece_hashes)
+            != len(self.plan.pieces_wanted) * metainfo.PIECE_HASH_SIZE
+        ):
+            self._print(
+                "WARNING: piece hashes are not available, skipping local verification"
+            )
+            return
+
+        piece_indices = [
+            piece_index
+            for piece_index, piece_present_wanted in enumerate(
+                self.plan.pieces_present_wanted
+            )
+            if piece_present_wanted
+        ]
+        self._print(
+            f"Verifying {self._format_piece_count(len(piece_indices))} locally using"
+            f" {self._local_verify_threads} threads..."
+        )
+        lost_pieces = verify.find_lost_pieces(
+            self._download_dir,
+            list(zip(self._file_names, self._file_lengths)),
+            piece_size=self._piece_size,
+            piece_hashes=torrent_metainfo.piece_hashes,
+            piece_indices=piece_indices,
+            thread_count=self._local_verify_threads,
+            files_padding=self.plan.files_padding,
         )
+        if len(lost_pieces) > 0:
+            self._print(f"Lost pieces: {_format_piece_ranges(lost_pieces)}")
+            self._raise_lost_pieces(len(lost_pieces))
+        self._print("Local verification successful.")
+
+    def check_pieces(self, pieces_b64bitfield):
         lost_pieces_count = sum(
             piece_present_wanted_previously and not piece_present_now
             for piece_present_wanted_previously, piece_present_now in zip(
-                self._pieces_present_wanted,
-                pieces.to_array(torrent.pieces, len(self._pieces_present_wanted)),
+                self.plan.pieces_present_wanted,
+                pieces.to_array(
+                    pieces_b64bitfield, len(self.plan.pieces_present_wanted)
+                ),
             )
         )
         if lost_pieces_count > 0:
-            raise CorruptTorrentException(
-                "Oh no, looks like we corrupted"
-                f" {self._format_piece_count(lost_pieces_count)} that were previously"
-                " valid and wanted :( This should never happen, please report this as"
-                " a bug (make sure to attach the output of `transmission-remote"
-                f" {self._transmission_url} --torrent {self._info_hash} --info"
-                " --info-files --info-pieces`)"
-            )
-        print("Torrent verification successful.", file=sys.stderr)
-
-    @backoff.on_predicate(
-        backoff.expo,
-        lambda status: status is None,
-        factor=0.050,
-        max_value=1.0,
-    )
-    def _wait_for_status(self, status_predicate):
-        status = self._transmission_client.get_torrent(
-            self._info_hash, arguments=["status"]
-        ).status
-        return status if status_predicate(status) else None
+            self._raise_lost_pieces(lost_pieces_count)
+        self._print("Torrent verification successful.")
+
+    def _raise_lost_pieces(self, lost_pieces_count):
+        raise CorruptTorrentException(
+            "Oh no, looks like we corrupted"
+            f" {self._format_piece_count(lost_pieces_count)} that were previously"
+            " valid and wanted :( This should never happen, please report this as"
+            " a bug (make sure to attach the output of `transmission-remote"
+            f" {self._transmission_url} --torrent {self.info_hash} --info"
+            " --info-files --info-pieces`)"
+        )
 
     def _format_piece_count(self, piece_count):
         return f"{piece_count} pieces" + (
             ""
             if piece_count == 0
-            else (
-                f" ({humanize.naturalsize(piece_count * self._piece_size, binary=True)})"
-            )
+            else (f" ({_naturalsize(piece_count * self._piece_size)})")
         )
 
 
-def run(args, run_before_check=lambda: None):
-    args = _parse_arguments(args)
-    transmission_url = args.transmission_url
-    with transmission_rpc.from_url(transmission_url) as transmission_client:
-        download_dir = pathlib.Path(transmission_client.get_session().download_dir)
+class _TorrentFilter:
+    # Selects torrents based on the filtering arguments, using fields that are cheap
+    # to fetch for the whole library.
+    def __init__(self, args):
+        self._labels = getattr(args, "label", None)
+        self._name_regex = getattr(args, "name_regex", None)
+        self._download_dir_prefix = getattr(args, "download_dir_prefix", None)
+        min_size = getattr(args, "min_size", None)
+        self._min_size = None if min_size is None else min_size * 1000 * 1000 * 1000
+        self.fields = (
+            (["labels"] if self._labels is not None else [])
+            + (["name"] if self._name_regex is not None else [])
+            + (["downloadDir"] if self._download_dir_prefix is not None else [])
+            + (["totalSize"] if self._min_size is not None else [])
+        )
 
-        torrent_ids = getattr(args, "torrent_id", [])
-        for torrent_info_hash in (
+    def matches(self, torrent):
+        return (
             (
-                torrent_info.info_hash
-                for torrent_info in transmission_client.get_torrents(
-                    arguments=["infohash"]
+                self._labels is None
+                or any(label in self._labels for label in torrent.labels)
+            )
+            and (self._name_regex is None or self._name_regex.search(torrent.name))
+            and (
+                self._download_dir_prefix is None
+                or pathlib.PurePath(torrent.download_dir).is_relative_to(
+                    self._download_dir_prefix
                 )
             )
-            if len(torrent_ids) == 0
-            else (
-                torrent_id if len(torrent_id) == 40 else int(torrent_id)
-                for torrent_id in torrent_ids
+            and (self._min_size is None or torrent.total_size >= self._min_size)
+        )
+
+
+def _get_torrents_to_process(
+    transmission_client, torrent_ids, schedule, torrent_filter, log_prefix
+):
+    torrent_ids = [
+        torrent_id if len(torrent_id) == 40 else int(torrent_id)
+        for torrent_id in torrent_ids
+    ]
+    torrents = transmission_client.get_torrents(
+        torrent_ids if len(torrent_ids) > 0 else None,
+        arguments=["id", "infohash", "haveValid"] + torrent_filter.fields,
+    )
+    if len(torrent_ids) > 0:
+        torrents_by_id = {
+            **{torrent.id: torrent for torrent in torrents},
+            **{torrent.info_hash: torrent for torrent in torrents},
+        }
+        missing_torrent_ids = [
+            torrent_id for torrent_id in torrent_ids if torrent_id not in torrents_by_id
+        ]
+        if len(missing_torrent_ids) > 0:
+            raise DeleteUnwantedException(
+                f"Torrents not found: {', '.join(map(str, missing_torrent_ids))}"
             )
+        torrents = [torrents_by_id[torrent_id] for torrent_id in torrent_ids]
+    if len(torrent_filter.fields) > 0:
+        torrent_count = len(torrents)
+        torrents = [torrent for torrent in torrents if torrent_filter.matches(torrent)]
+        _print(
+            f"Selected {len(torrents)} out of {torrent_count} torrents",
+            prefix=log_prefix,
+        )
+    # At this point we don't know yet how much data will be left after we're done
+    # with each torrent, so just go with how much there is now.
+    return [
+        torrent.info_hash
+        for torrent in _schedule(torrents, lambda torrent: torrent.have_valid, schedule)
+    ]
+
+
+def _process_batch(
+    transmission_client,
+    processors,
+    run_before_check,
+    schedule,
+    verify_timeout,
+    log_prefix,
+    dry_run,
+):
+    _print(f">>> PROCESSING BATCH OF {len(processors)} TORRENTS", prefix=log_prefix)
+    # Torrents resumed from the journal may already be past this point.
+    file_processors = [
+        processor for processor in processors if not processor.files_done
+    ]
+    info_hashes = [processor.info_hash for processor in file_processors]
+    running_processors = [
+        processor for processor in file_processors if not processor.initially_stopped
+    ]
+    for processor in file_processors:
+        processor.unmark_padding_files()
+    try:
+        for processor in file_processors:
+            processor.stage_trims()
+        if not dry_run and len(running_processors) > 0:
+            # See TorrentProcessor._stop_torrent().
+            for processor in running_processors:
+                processor.record(journal.STOPPED)
+            _stop_torrents(
+                transmission_client,
+                [processor.info_hash for processor in running_processors],
+            )
+
+        try:
+            for processor in file_processors:
+                processor.process_files()
+            run_before_check()
+        except:
+            # See TorrentProcessor.process().
+            if not dry_run:
+                transmission_client.verify_torrent(info_hashes)
+            raise
+    finally:
+        for processor in file_processors:
+            processor.remove_temporary_files()
+    for processor in file_processors:
+        processor.record(journal.FILES_DONE)
+
+    if not dry_run:
+        _verify_batch(
+            transmission_client, processors, schedule, verify_timeout, log_prefix
+        )
+
+
+def _verify_batch(
+    transmission_client, processors, schedule, verify_timeout, log_prefix
+):
+    # Torrents resumed from the journal may have been verified already; all they need
+    # is a restart.
+    verified_processors = [processor for processor in processors if processor.verified]
+    _restart_batch(transmission_client, verified_processors)
+    processors = [processor for processor in processors if not processor.verified]
+    if len(processors) == 0:
+        return
+
+    corrupt_torrent_exceptions = []
+    locally_corrupt_info_hashes = []
+    for processor in processors:
+        try:
+            processor.verify_locally()
+        except CorruptTorrentException as exception:
+            _print(f"ERROR: {exception.args[0]}", prefix=log_prefix)
+            corrupt_torrent_exceptions.append(exception)
+            locally_corrupt_info_hashes.append(processor.info_hash)
+
+    _print(
+        "All done, kicking off torrent verification. This may take a while...",
+        prefix=log_prefix,
+    )
+    # Transmission verifies torrents one at a time, in the order they were requested.
+    # Since we restart each torrent as soon as it is verified, ordering matters.
+    processors_by_info_hash = {
+        processor.info_hash: processor
+        for processor in _schedule(
+            processors, lambda processor: processor.verify_size, schedule
+        )
+    }
+    transmission_client.verify_torrent(list(processors_by_info_hash.keys()))
+    for processor in processors:
+        processor.record(journal.VERIFY_REQUESTED)
+    # We already know these are corrupt; we only asked Transmission to verify them so
+    # that it finds out about the damage too.
+    for info_hash in locally_corrupt_info_hashes:
+        del processors_by_info_hash[info_hash]
+    verification_monitor = _VerificationMonitor(
+        transmission_client,
+        {processor.info_hash: processor.total_size for processor in processors},
+        timeout=verify_timeout,
+        log=functools.partial(_print, prefix=log_prefix),
+    )
+    while len(processors_by_info_hash) > 0:
+        verified_info_hashes = verification_monitor.wait_for_any(
+            list(processors_by_info_hash.keys())
+        )
+        verified_processors = []
+        for torrent in transmission_client.get_torrents(
+            verified_info_hashes, arguments=["infohash", "pieces"]
         ):
-            _TorrentProcessor(
+            processor = processors_by_info_hash.pop(torrent.info_hash)
+            try:
+                processor.check_pieces(torrent.pieces)
+            except CorruptTorrentException as exception:
+                _print(f"ERROR: {exception.args[0]}", prefix=log_prefix)
+                corrupt_torrent_exceptions.append(exception)
+                continue
+            processor.record(journal.VERIFIED)
+            verified_processors.append(processor)
+        _restart_batch(transmission_client, verified_processors)
+
+    if len(corrupt_torrent_exceptions) > 0:
+        raise corrupt_torrent_exceptions[0]
+
+
+def _restart_batch(transmission_client, processors):
+    restart_info_hashes = [
+        processor.info_hash
+        for processor in processors
+        if not processor.initially_stopped
+    ]
+    if len(restart_info_hashes) > 0:
+        transmission_client.start_torrent(restart_info_hashes)
+    for processor in processors:
+        processor.record(journal.RESTARTED)
+
+
+# What processing a torrent is expected to involve, according to its statistics.
+# `torrent` is an (info hash, PrefetchedTorrent or None) pair.
+_TorrentEstimate = collections.namedtuple(
+    "_TorrentEstimate",
+    ["torrent", "name", "unwanted_bytes", "verify_size", "interrupted"],
+)
+
+
+class _Pipeline:
+    # Processes torrents according to the arguments added by
+    # add_processing_arguments().
+    def __init__(self, args, run_before_check):
+        self._args = args
+        self._run_before_check = run_before_check
+        self._dry_run = getattr(args, "dry_run", False)
+        self._batch = getattr(args, "batch", False)
+        self._verify_timeout = getattr(args, "verify_timeout", None)
+        self._local_verify_threads = (
+            getattr(args, "local_verify_threads", os.cpu_count())
+            if getattr(args, "local_verify", False)
+            else None
+        )
+        self._delete_step_size = args.delete_throttle_step * 1024 * 1024
+        delete_throttle_rate = getattr(args, "delete_throttle_rate", None)
+        # Note the rate limiters are shared across all torrents, so that the rates
+        # apply to the run as a whole.
+        self._delete_rate_limiter = (
+            None
+            if delete_throttle_rate is None
+            else throttle.TokenBucket(
+                rate=delete_throttle_rate * 1000 * 1000 * 1000,
+                capacity=self._delete_step_size,
+            )
+        )
+        trim_throttle_rate = getattr(args, "trim_throttle_rate", None)
+        self._trim_rate_limiter = (
+            None
+            if trim_throttle_rate is None
+            else throttle.TokenBucket(
+                rate=trim_throttle_rate * 1000 * 1000,
+                # Allow one copy buffer's worth of burst, so that the time spent doing
+                # the I/O itself is accounted for.
+                capacity=1024 * 1024,
+            )
+        )
+        if getattr(args, "idle_io_priority", False):
+            _set_idle_io_priority()
+        self._min_reclaim_ratio = getattr(args, "min_reclaim_ratio", None)
+        hash_rate = getattr(args, "hash_rate", None)
+        self._cost_model = cost.CostModel(
+            hash_rate=None if hash_rate is None else hash_rate * 1000 * 1000,
+            time_budget=getattr(args, "time_budget", None),
+        )
+
+        journal_path = getattr(args, "journal", None)
+        resume = getattr(args, "resume", False)
+        if resume and journal_path is None:
+            raise DeleteUnwantedException("--resume requires --journal")
+        try:
+            self._journal = (
+                None
+                if journal_path is None
+                else journal.Journal(
+                    journal_path, resume=resume, read_only=self._dry_run
+                )
+            )
+        except (OSError, journal.JournalException) as exception:
+            raise DeleteUnwantedException(
+                f"Unable to read journal: {exception}"
+            ) from exception
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+
+    def _skip_finished(
+        self, transmission_client, transmission_url, torrents, log_prefix
+    ):
+        # Skips torrents that the journal says we are done with, unless the wanted files
+        # changed since.
+        if self._journal is None:
+            return torrents
+        journal_entries = {}
+        files_wanted_by_info_hash = {}
+        for torrent_info_hash, prefetched_torrent in torrents:
+            journal_entry = self._journal.get(transmission_url, torrent_info_hash)
+            if journal_entry is None or journal_entry["phase"] != journal.RESTARTED:
+                continue
+            journal_entries[torrent_info_hash] = journal_entry
+            if prefetched_torrent is not None:
+                files_wanted_by_info_hash[torrent_info_hash] = prefetched_torrent.wanted
+        if len(journal_entries) == 0:
+            return torrents
+        missing_info_hashes = [
+            torrent_info_hash
+            for torrent_info_hash in journal_entries
+            if torrent_info_hash not in files_wanted_by_info_hash
+        ]
+        if len(missing_info_hashes) > 0:
+            for torrent in transmission_client.get_torrents(
+                missing_info_hashes, arguments=["infohash", "wanted"]
+            ):
+                files_wanted_by_info_hash[torrent.info_hash] = torrent.wanted
+        finished_info_hashes = {
+            torrent_info_hash
+            for torrent_info_hash, journal_entry in journal_entries.items()
+            if journal.fingerprint(files_wanted_by_info_hash[torrent_info_hash])
+            == journal_entry["wanted"]
+        }
+        _print(
+            f"Skipping {len(finished_info_hashes)} torrents that were already processed"
+            " according to the journal",
+            prefix=log_prefix,
+        )
+        return [
+            (torrent_info_hash, prefetched_torrent)
+            for torrent_info_hash, prefetched_torrent in torrents
+            if torrent_info_hash not in finished_info_hashes
+        ]
+
+    def process(self, transmission_client, transmission_url, torrents, log_prefix):
+        # `torrents` is a list of (info hash, PrefetchedTorrent or None), in the order
+        # in which they should be processed.
+        summary = Summary()
+        log = functools.partial(_print, prefix=log_prefix)
+        torrents = self._skip_finished(
+            transmission_client, transmission_url, torrents, log_prefix
+        )
+        if self._cost_model.has_time_budget:
+            torrents = self._select_within_time_budget(
+                transmission_client, transmission_url, torrents, summary, log
+            )
+        download_dir = pathlib.Path(transmission_client.get_session().download_dir)
+
+        def get_processor(torrent_info_hash, prefetched_torrent):
+            # Fetches and plans the torrent. Returns None if there is nothing to do.
+            processor = TorrentProcessor(
                 transmission_client=transmission_client,
                 torrent_info_hash=torrent_info_hash,
                 download_dir=download_dir,
-                run_before_check=run_before_check,
                 transmission_url=transmission_url,
-                dry_run=getattr(args, "dry_run", False),
+                summary=summary,
+                log=log,
+                dry_run=self._dry_run,
+                delete_rate_limiter=self._delete_rate_limiter,
+                delete_step_size=self._delete_step_size,
+                trim_rate_limiter=self._trim_rate_limiter,
+                trim_mmap=getattr(self._args, "trim_mmap", False),
+                durable=getattr(self._args, "durable", False),
+                prestage=getattr(self._args, "prestage", False),
+                verify_timeout=self._verify_timeout,
+                local_verify_threads=self._local_verify_threads,
+                metainfo_layout=getattr(self._args, "metainfo_layout", False),
+                prefetched_torrent=prefetched_torrent,
+                torrent_journal=self._journal,
             )
+            if not processor.needs_processing or not self._is_worth_processing(
+                processor, summary, log
+            ):
+                return None
+            return processor
+
+        if self._batch:
+            processors = [
+                processor
+                for processor in itertools.starmap(get_processor, torrents)
+                if processor is not None
+            ]
+            if len(processors) > 0:
+                _process_batch(
+                    transmission_client,
+                    processors,
+                    run_before_check=self._run_before_check,
+                    schedule=self._args.schedule,
+                    verify_timeout=self._verify_timeout,
+                    log_prefix=log_prefix,
+                    dry_run=self._dry_run,
+                )
+        else:
+            # Note each torrent is only fetched and planned right before it gets
+            # processed, so that the plan reflects the latest state of the torrent.
+            for torrent_info_hash, prefetched_torrent in torrents:
+                processor = get_processor(torrent_info_hash, prefetched_torrent)
+                if processor is not None and self._fits_in_time_budget(
+                    processor, summary, log
+                ):
+                    self._process_one(processor)
+        return summary
+
+    def _process_one(self, processor):
+        processor.process(self._run_before_check)
+        if processor.verify_seconds is not None:
+            self._cost_model.observe(processor.verify_size, processor.verify_seconds)
+
+    def _is_worth_processing(self, processor, summary, log):
+        if self._min_reclaim_ratio is None or processor.interrupted:
+            return True
+        reclaim_ratio = self._cost_model.reclaim_ratio(
+            processor.plan.unwanted_bytes, processor.verify_size
+        )
+        if reclaim_ratio >= self._min_reclaim_ratio:
+            return True
+        log(
+            f"Not worth it: the unwanted data is only {reclaim_ratio:.2%} of the"
+            " estimated cost of verifying the torrent (see --min-reclaim-ratio)."
+            " Skipping."
+        )
+        _skip(summary, processor.plan.unwanted_bytes)
+        return False
+
+    def _select_within_time_budget(
+        self, transmission_client, transmission_url, torrents, summary, log
+    ):
+        # Returns the torrents that are expected to fit in the remaining time, best
+        # value first. Planning needs the file list, which can be huge, so this goes
+        # by the torrent statistics instead: the wanted data that is present is what
+        # Transmission will have to verify, and the rest is unwanted. Interrupted
+        # torrents always come first so that they don't get left stopped. Torrents
+        # without any unwanted data don't count against the budget, as there is
+        # likely nothing to do.
+        if len(torrents) == 0:
+            return torrents
+        statistics_by_info_hash = {
+            torrent.info_hash: torrent
+            for torrent in transmission_client.get_torrents(
+                [torrent_info_hash for torrent_info_hash, _ in torrents],
+                arguments=[
+                    "infohash",
+                    "name",
+                    "haveValid",
+                    "sizeWhenDone",
+                    "leftUntilDone",
+                ],
+            )
+        }
+        estimates = []
+        for torrent_info_hash, prefetched_torrent in torrents:
+            statistics = statistics_by_info_hash.get(torrent_info_hash)
+            # If the torrent is gone, let processing deal with it.
+            verify_size = (
+                0
+                if statistics is None
+                else statistics.size_when_done - statistics.left_until_done
+            )
+            journal_entry = (
+                None
+                if self._journal is None
+                else self._journal.get(transmission_url, torrent_info_hash)
+            )
+            estimates.append(
+                _TorrentEstimate(
+                    torrent=(torrent_info_hash, prefetched_torrent),
+                    name=None if statistics is None else statistics.name,
+                    unwanted_bytes=(
+                        0
+                        if statistics is None
+                        else max(0, statistics.have_valid - verify_size)
+                    ),
+                    verify_size=verify_size,
+                    interrupted=journal_entry is not None
+                    and journal_entry["phase"] in journal.STOPPED_PHASES,
+                )
+            )
+
+        remaining_seconds = self._cost_model.remaining_seconds()
+        selected_torrents = []
+        for estimate in sorted(
+            estimates,
+            key=lambda estimate: (
+                not estimate.interrupted,
+                -self._cost_model.value(estimate.unwanted_bytes, estimate.verify_size),
+            ),
+        ):
+            if estimate.interrupted or estimate.unwanted_bytes == 0:
+                selected_torrents.append(estimate.torrent)
+                continue
+            estimated_seconds = self._cost_model.estimate_seconds(estimate.verify_size)
+            if estimated_seconds <= remaining_seconds:
+                selected_torrents.append(estimate.torrent)
+                remaining_seconds -= estimated_seconds
+                continue
+            _log_over_time_budget(
+                estimate.name, estimate.torrent[0], estimated_seconds, log
+            )
+            summary.torrent_count += 1
+            summary.processed_torrent_count += 1
+            summary.unwanted_bytes += estimate.unwanted_bytes
+            _skip(summary, estimate.unwanted_bytes)
+        return selected_torrents
+
+    def _fits_in_time_budget(self, processor, summary, log):
+        if not self._cost_model.has_time_budget or processor.interrupted:
+            return True
+        estimated_seconds = self._cost_model.estimate_seconds(processor.verify_size)
+        if estimated_seconds <= self._cost_model.remaining_seconds():
+            return True
+        _log_over_time_budget(
+            processor.name, processor.info_hash, estimated_seconds, log
+        )
+        _skip(summary, processor.plan.unwanted_bytes)
+        return False
+
+
+def _skip(summary, unwanted_bytes):
+    summary.skipped_torrent_count += 1
+    summary.skipped_unwanted_bytes += unwanted_bytes
+
+
+def _log_over_time_budget(name, info_hash, estimated_seconds, log):
+    import humanize
+
+    log(
+        f'Skipping "{name}" (hash: {info_hash}): expected to take'
+        f" {humanize.naturaldelta(estimated_seconds)}, which does not fit in the"
+        " remaining time budget"
+    )
+
+
+def process_prefetched_torrents(
+    transmission_client,
+    transmission_url,
+    prefetched_torrents,
+    args,
+    run_before_check=lambda: None,
+):
+    # Runs the given torrents through the same pipeline as
+    # transmission-delete-unwanted, reusing metadata the caller already fetched.
+    # `args` must contain the arguments added by add_processing_arguments().
+    #
+    # Note bytesCompleted is a good enough estimate of how much data is present for
+    # scheduling purposes.
+    prefetched_torrents = _schedule(
+        prefetched_torrents,
+        lambda prefetched_torrent: sum(
+            torrent_file["bytesCompleted"] for torrent_file in prefetched_torrent.files
+        ),
+        args.schedule,
+    )
+    with contextlib.closing(_Pipeline(args, run_before_check)) as pipeline:
+        summary = pipeline.process(
+            transmission_client,
+            transmission_url,
+            [
+                (prefetched_torrent.info_hash, prefetched_torrent)
+                for prefetched_torrent in prefetched_torrents
+            ],
+            log_prefix="",
+        )
+    _print(f">>> SUMMARY: {summary.format(getattr(args, 'dry_run', False))}")
+
+
+def run(args, run_before_check=lambda: None):
+    args = _parse_arguments(args)
+    try:
+        with contextlib.closing(recording.ClientFactory(args)) as client_factory:
+            _run(args, run_before_check, client_factory)
+    except recording.RecordingException as exception:
+        raise DeleteUnwantedException(exception.args[0]) from exception
+
+
+def _run(args, run_before_check, client_factory):
+    pipeline = _Pipeline(args, run_before_check)
+    dry_run = getattr(args, "dry_run", False)
+    transmission_urls = client_factory.get_transmission_urls(
+        getattr(args, "transmission_url", [DEFAULT_TRANSMISSION_URL])
+    )
+    torrent_ids = getattr(args, "torrent_id", [])
+    torrent_filter = _TorrentFilter(args)
+
+    def run_instance(transmission_url):
+        log_prefix = "" if len(transmission_urls) == 1 else f"[{transmission_url}] "
+        with client_factory.open(transmission_url) as transmission_client:
+            summary = pipeline.process(
+                transmission_client,
+                transmission_url,
+                [
+                    (torrent_info_hash, None)
+                    for torrent_info_hash in _get_torrents_to_process(
+                        transmission_client,
+                        torrent_ids,
+                        args.schedule,
+                        torrent_filter,
+                        log_prefix,
+                    )
+                ],
+                log_prefix=log_prefix,
+            )
+        if len(transmission_urls) > 1:
+            _print(f">>> SUMMARY: {summary.format(dry_run)}", prefix=log_prefix)
+        return summary
+
+    with contextlib.closing(pipeline):
+        if len(transmission_urls) == 1:
+            summaries = [run_instance(transmission_urls[0])]
+        else:
+            import concurrent.futures
+
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(transmission_urls)
+            ) as executor:
+                futures = [
+                    executor.submit(run_instance, transmission_url)
+                    for transmission_url in transmission_urls
+                ]
+            # Note we only get here once all instances are done, so that a failure in
+            # one instance does not leave the others in the middle of processing a
+            # torrent.
+            summaries = [future.result() for future in futures]
+
+    total_summary = Summary()
+    for summary in summaries:
+        total_summary.add(summary)
+    _print(f">>> SUMMARY: {total_summary.format(dry_run)}")
 
 
 def main():
@@ -1,3 +1,9 @@
+import errno
+import functools
+import os
+import threading
+
+
 class CopyException(Exception):
     pass
 
@@ -6,13 +12,240 @@ class EOFException(CopyException):
     pass
 
 
-def copy(from_file, to_file, length, buffer_size=1024 * 1024):
+# Copy buffers are reused across calls (one per thread, as copies can run
+# concurrently), so that copying many ranges doesn't allocate a new buffer for every
+# read.
+_copy_buffers = threading.local()
+
+
+def _get_copy_buffer(size):
+    copy_buffer = getattr(_copy_buffers, "buffer", None)
+    if copy_buffer is None or len(copy_buffer) < size:
+        copy_buffer = memoryview(bytearray(size))
+        _copy_buffers.buffer = copy_buffer
+    return copy_buffer[:size]
+
+
+def copy(
+    from_file,
+    to_file,
+    length,
+    buffer_size=1024 * 1024,
+    rate_limiter=None,
+    use_mmap=False,
+):
+    if use_mmap:
+        _copy_mmap(from_file, to_file, length, buffer_size, rate_limiter)
+        return
+    if length <= 0:
+        return
+    # Note: `os.copy_file_range()` or `os.sendfile()` would be more efficient, but
+    # that may not be worth it given the platform-specific quirks they would
+    # introduce.
+    #
+    # Don't use a larger buffer than we need, so that small copies stay cheap.
+    copy_buffer = _get_copy_buffer(min(length, buffer_size))
     while length > 0:
-        # Note: `os.copy_file_range()` or `os.sendfile()` would be more efficient, but
-        # that may not be worth it given the platform-specific quirks they would
-        # introduce.
-        buffer = from_file.read(min(length, buffer_size))
-        if len(buffer) == 0:
+        read_size = min(length, len(copy_buffer))
+        if rate_limiter is not None:
+            rate_limiter.consume(read_size)
+        read_length = from_file.readinto(copy_buffer[:read_size])
+        if read_length == 0:
             raise EOFException
-        to_file.write(buffer)
-        length -= len(buffer)
+        to_file.write(copy_buffer[:read_length])
+        length -= read_length
+
+
+def _copy_mmap(from_file, to_file, length, buffer_size, rate_limiter):
+    # Writes straight from the page cache, without copying the data into a userspace
+    # buffer first.
+    import mmap
+
+    from_offset = from_file.tell()
+    if from_offset + length > os.fstat(from_file.fileno()).st_size:
+        raise EOFException
+    if length <= 0:
+        return
+    # The mapping has to start on an allocation granularity boundary.
+    map_offset = from_offset - from_offset % mmap.ALLOCATIONGRANULARITY
+    with (
+        mmap.mmap(
+            from_file.fileno(),
+            from_offset + length - map_offset,
+            access=mmap.ACCESS_READ,
+            offset=map_offset,
+        ) as from_map,
+        memoryview(from_map) as from_view,
+    ):
+        position = from_offset - map_offset
+        while position < len(from_view):
+            write_size = min(len(from_view) - position, buffer_size)
+            if rate_limiter is not None:
+                rate_limiter.consume(write_size)
+            to_file.write(from_view[position : position + write_size])
+            position += write_size
+    from_file.seek(from_offset + length)
+
+
+def data_extents(from_file, offset, length):
+    # Returns the (offset, length) ranges within the given range of the file that
+    # contain data, i.e. skipping holes. Where holes can't be detected, the whole range
+    # is returned as data.
+    #
+    # Note this moves the file descriptor offset around, so it is restored afterwards
+    # to avoid confusing Python's buffered I/O.
+    end = offset + length
+    if length <= 0:
+        return []
+    seek_data = getattr(os, "SEEK_DATA", None)
+    seek_hole = getattr(os, "SEEK_HOLE", None)
+    if seek_data is None or seek_hole is None:
+        return [(offset, length)]
+    fd = from_file.fileno()
+    original_position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        extents = []
+        current_offset = offset
+        while current_offset < end:
+            try:
+                data_begin = os.lseek(fd, current_offset, seek_data)
+            except OSError as exception:
+                if exception.errno == errno.ENXIO:
+                    # Nothing but holes until the end of the file.
+                    break
+                if exception.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+                    # The filesystem doesn't support hole detection.
+                    return [(offset, length)]
+                raise
+            if data_begin >= end:
+                break
+            data_end = min(os.lseek(fd, data_begin, seek_hole), end)
+            extents.append((data_begin, data_end - data_begin))
+            current_offset = data_end
+        return extents
+    finally:
+        os.lseek(fd, original_position, os.SEEK_SET)
+
+
+def copy_sparse(
+    from_file,
+    to_file,
+    length,
+    buffer_size=1024 * 1024,
+    rate_limiter=None,
+    use_mmap=False,
+):
+    # Like copy(), but only copies the ranges that contain data, leaving holes in the
+    # destination where the source has holes. This makes copying from mostly empty
+    # files (e.g. partially downloaded ones) much cheaper, both in I/O and in space.
+    from_offset = from_file.tell()
+    to_offset = to_file.tell()
+    if from_offset + length > os.fstat(from_file.fileno()).st_size:
+        raise EOFException
+    for extent_offset, extent_length in data_extents(from_file, from_offset, length):
+        from_file.seek(extent_offset)
+        to_file.seek(to_offset + extent_offset - from_offset)
+        copy(
+            from_file,
+            to_file,
+            extent_length,
+            buffer_size=buffer_size,
+            rate_limiter=rate_limiter,
+            use_mmap=use_mmap,
+        )
+    from_file.seek(from_offset + length)
+    to_file.seek(to_offset + length)
+    # If the range ends with a hole, the destination may need to be extended.
+    to_file.flush()
+    if os.fstat(to_file.fileno()).st_size < to_offset + length:
+        to_file.truncate(to_offset + length)
+
+
+def truncate_gradually(file_path, step_size, rate_limiter):
+    # Shrinks the file a bit at a time so that the filesystem doesn't have to free
+    # all the extents at once when the file is unlinked, which on some filesystems
+    # can stall all I/O for a while if the file is large.
+    try:
+        file_to_truncate = open(file_path, "r+b")  # pylint: disable=consider-using-with
+    except PermissionError:
+        # The file is read-only, but that doesn't prevent the caller from unlinking
+        # it; we'll just have to free it all at once.
+        rate_limiter.consume(os.stat(file_path).st_size)
+        return
+    with file_to_truncate:
+        file_stat = os.fstat(file_to_truncate.fileno())
+        if file_stat.st_nlink > 1:
+            # The data is still referenced from elsewhere; truncating the file would
+            # destroy it. Unlinking it will not free anything anyway.
+            return
+        size = file_stat.st_size
+        while size > step_size:
+            rate_limiter.consume(step_size)
+            size -= step_size
+            os.ftruncate(file_to_truncate.fileno(), size)
+    # The rest will be freed when the caller unlinks the file.
+    rate_limiter.consume(size)
+
+
+def allocated_size(file_stat):
+    # How much space the file actually takes up on disk, which can be less than its
+    # size if it is sparse. Note st_blocks is always in units of 512 bytes,
+    # regardless of the filesystem block size.
+    return file_stat.st_blocks * 512
+
+
+def is_sparse(file_stat):
+    return allocated_size(file_stat) < file_stat.st_size
+
+
+@functools.lru_cache(maxsize=None)
+def _get_syncfs():
+    import ctypes
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except (OSError, TypeError):
+        return None
+    return getattr(libc, "syncfs", None)
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync(file_paths):
+    # Makes sure the contents of the given files have reached stable storage. Where
+    # possible (i.e. on Linux), this is done by flushing each underlying filesystem
+    # once using syncfs(), which is much faster than calling fsync() on a large
+    # number of files one by one.
+    syncfs = _get_syncfs()
+    if syncfs is None:
+        for file_path in file_paths:
+            _fsync_path(file_path)
+        return
+
+    import ctypes
+
+    synced_devices = set()
+    for directory_path in {file_path.parent for file_path in file_paths}:
+        fd = os.open(directory_path, os.O_RDONLY)
+        try:
+            device = os.fstat(fd).st_dev
+            if device in synced_devices:
+                continue
+            if syncfs(fd) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), str(directory_path))
+            synced_devices.add(device)
+        finally:
+            os.close(fd)
+
+
+def sync_directory(directory_path):
+    # Makes sure changes to directory entries (e.g. renames and deletions) have reached
+    # stable storage.
+    _fsync_path(directory_path)
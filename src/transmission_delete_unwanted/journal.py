@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+# The phases a torrent goes through, in order. A torrent that did not need any
+# processing goes straight from PLANNED to RESTARTED, i.e. RESTARTED means the
+# torrent is done and back in the state we found it in (which is not necessarily
+# running).
+PLANNED = "planned"
+STOPPED = "stopped"
+FILES_DONE = "files_done"
+VERIFY_REQUESTED = "verify_requested"
+VERIFIED = "verified"
+RESTARTED = "restarted"
+
+# Phases in which the torrent may have been stopped by us, and therefore needs to be
+# restarted if it was running initially.
+STOPPED_PHASES = (STOPPED, FILES_DONE, VERIFY_REQUESTED, VERIFIED)
+
+
+class JournalException(Exception):
+    pass
+
+
+def fingerprint(files_wanted):
+    # Used to detect that the set of wanted files changed since a torrent was
+    # journaled, in which case any journaled progress is void.
+    return hashlib.sha256(
+        bytes(1 if file_wanted else 0 for file_wanted in files_wanted)
+    ).hexdigest()
+
+
+class Journal:
+    # Records, in a JSON lines file, how far along each torrent is, so that an
+    # interrupted run can be resumed. Entries are keyed by Transmission URL and info
+    # hash; the last entry for a given torrent wins.
+    def __init__(self, path, resume, read_only):
+        self._lock = threading.Lock()
+        self._entries = {}
+        if resume:
+            try:
+                self._load(path, truncate=not read_only)
+            except FileNotFoundError:
+                pass
+        self._file = (
+            None
+            if read_only
+            else open(  # pylint: disable=consider-using-with
+                path, "a" if resume else "w", encoding="utf-8"
+            )
+        )
+
+    def _load(self, path, truncate):
+        with open(path, "rb") as journal_file:
+            contents = journal_file.read()
+        # A partially written last line is expected if we were interrupted while
+        # writing it. Drop it, so that new entries don't get appended to it.
+        complete_length = contents.rfind(b"\n") + 1
+        if truncate and complete_length < len(contents):
+            os.truncate(path, complete_length)
+        for line_number, line in enumerate(
+            contents[:complete_length].splitlines(), start=1
+        ):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as exception:
+                raise JournalException(
+                    f"Corrupt journal {path} at line {line_number}: {exception}"
+                ) from exception
+            self._entries[(entry["url"], entry["info_hash"])] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def get(self, transmission_url, info_hash):
+        with self._lock:
+            return self._entries.get((transmission_url, info_hash))
+
+    def record(
+        self, transmission_url, info_hash, phase, files_wanted, initially_stopped
+    ):
+        entry = {
+            "url": transmission_url,
+            "info_hash": info_hash,
+            "phase": phase,
+            "wanted": fingerprint(files_wanted),
+            "initially_stopped": initially_stopped,
+        }
+        with self._lock:
+            self._entries[(transmission_url, info_hash)] = entry
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            # Losing track of a torrent we stopped would mean never restarting it,
+            # so make sure these entries survive a crash. Other entries are not
+            # worth the cost of a flush to stable storage, as there can be one for
+            # every torrent in the library.
+            if phase in STOPPED_PHASES:
+                os.fsync(self._file.fileno())
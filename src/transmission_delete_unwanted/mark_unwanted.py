@@ -1,27 +1,190 @@
 import argparse
+import contextlib
+import io
 import sys
-import transmission_rpc
+from transmission_delete_unwanted import delete_unwanted, recording
+
+# How much of standard input to read at a time. Input lists can be very large (e.g.
+# millions of file names), so we parse them in large blocks instead of line by line.
+_READ_BLOCK_SIZE = 1024 * 1024
 
 
 def _parse_arguments(args):
     argument_parser = argparse.ArgumentParser(
         description=(
-            "Given a list of torrent file names (one per line, including the torrent"
-            " name) on standard input, mark the files as unwanted (do not download) in"
-            " the corresponding Transmission torrent."
+            "Given a list of torrent file names (one per line, or NUL-separated with"
+            " --null, including the torrent name) on standard input, mark the files as"
+            " unwanted (do not download) in the corresponding Transmission torrent."
         ),
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     argument_parser.add_argument(
         "--transmission-url",
-        help="URL of the Transmission instance to connect to",
-        default="http://127.0.0.1:9091",
+        help=(
+            "URL of the Transmission instance to connect to (default:"
+            f" {delete_unwanted.DEFAULT_TRANSMISSION_URL})"
+        ),
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "-0",
+        "--null",
+        help=(
+            "File names on standard input are separated by NUL characters instead of"
+            " newlines (e.g. as produced by `find -print0`). Use this for file names"
+            " that contain newlines."
+        ),
+        action="store_true",
+    )
+    argument_parser.add_argument(
+        "--max-concurrent-requests",
+        help=(
+            "Maximum number of requests to have in flight at the same time when"
+            " marking files as unwanted"
+        ),
+        type=delete_unwanted.positive(int),
+        default=4,
+    )
+    argument_parser.add_argument(
+        "--files-per-request",
+        help=(
+            "Maximum number of files to mark as unwanted in a single request. Larger"
+            " sets are split across multiple requests, so that Transmission is not"
+            " blocked for too long processing a single huge request."
+        ),
+        type=delete_unwanted.positive(int),
+        default=10000,
+    )
+    argument_parser.add_argument(
+        "--delete",
+        help=(
+            "After marking files as unwanted, delete/trim unwanted files from the"
+            " affected torrents, as transmission-delete-unwanted would. Only the"
+            " torrents that were just modified are processed."
+        ),
+        action="store_true",
     )
-    return argument_parser.parse_args(args)
+    recording.add_arguments(argument_parser)
+    delete_unwanted.add_processing_arguments(
+        argument_parser.add_argument_group(
+            "deletion options",
+            "Options that control how torrents are processed when --delete is used."
+            " --dry-run also prevents files from being marked as unwanted.",
+        )
+    )
+    parsed_args = argument_parser.parse_args(args)
+    recording.check_arguments(argument_parser, parsed_args)
+    return parsed_args
+
+
+def _read_record_blocks(stream, separator):
+    remainder = ""
+    while True:
+        block = stream.read(_READ_BLOCK_SIZE)
+        if len(block) == 0:
+            break
+        block = remainder + block
+        if separator == "\n":
+            # Accept any line ending, as in universal newlines mode, in case the
+            # stream doesn't translate them already. Note a "\r\n" split across
+            # blocks results in an extra empty record, which the caller ignores.
+            block = block.replace("\r\n", "\n").replace("\r", "\n")
+        records = block.split(separator)
+        remainder = records.pop()
+        yield records
+    yield [remainder]
 
 
-def _mark_unwanted(transmission_client):
-    torrents = transmission_client.get_torrents(arguments=["infohash", "name", "files"])
+def _read_file_name_blocks(null):
+    separator = "\0" if null else "\n"
+    stdin = sys.stdin
+    buffer = getattr(stdin, "buffer", None)
+    if buffer is None:
+        yield from _read_record_blocks(stdin, separator)
+        return
+
+    # Read through our own text wrapper so that newline translation is disabled
+    # for NUL-separated file names; otherwise "\r" characters in them would get
+    # mangled.
+    stream = io.TextIOWrapper(
+        buffer,
+        encoding=stdin.encoding,
+        errors=stdin.errors,
+        newline="" if null else None,
+    )
+    try:
+        yield from _read_record_blocks(stream, separator)
+    finally:
+        # Make sure the wrapper does not close standard input when it goes away.
+        stream.detach()
+
+
+def _set_files_unwanted(
+    transmission_client,
+    transmission_url,
+    client_factory,
+    unwanted_file_ids_by_torrent_info_hash,
+    max_concurrent_requests,
+    files_per_request,
+):
+    requests = []
+    for torrent_info_hash, file_ids in unwanted_file_ids_by_torrent_info_hash.items():
+        file_ids = sorted(file_ids)
+        requests.extend(
+            (torrent_info_hash, file_ids[index : index + files_per_request])
+            for index in range(0, len(file_ids), files_per_request)
+        )
+    if max_concurrent_requests == 1 or len(requests) <= 1:
+        for torrent_info_hash, file_ids in requests:
+            transmission_client.change_torrent(
+                torrent_info_hash, files_unwanted=file_ids
+            )
+        return
+
+    import concurrent.futures
+    import threading
+
+    # transmission_rpc clients are not thread-safe, so each thread gets its own
+    # client (and therefore its own connection).
+    thread_local = threading.local()
+    thread_clients_lock = threading.Lock()
+
+    with contextlib.ExitStack() as thread_clients:
+
+        def change_torrent(torrent_info_hash, file_ids):
+            thread_client = getattr(thread_local, "transmission_client", None)
+            if thread_client is None:
+                with thread_clients_lock:
+                    thread_client = thread_clients.enter_context(
+                        client_factory.open(transmission_url)
+                    )
+                thread_local.transmission_client = thread_client
+            thread_client.change_torrent(torrent_info_hash, files_unwanted=file_ids)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_concurrent_requests, len(requests))
+        ) as executor:
+            futures = [
+                executor.submit(change_torrent, torrent_info_hash, file_ids)
+                for torrent_info_hash, file_ids in requests
+            ]
+        for future in futures:
+            future.result()
+
+
+def _read_file_names(null):
+    # Lists of file names can be very large and contain lots of duplicates; only look
+    # up each file name once.
+    file_names = {}
+    for file_name_block in _read_file_name_blocks(null):
+        file_names.update(dict.fromkeys(file_name_block))
+    return file_names
+
+
+def _mark_unwanted(transmission_client, transmission_url, client_factory, args):
+    torrents = transmission_client.get_torrents(
+        arguments=["infohash", "name", "files"] + (["wanted"] if args.delete else [])
+    )
     # Note we use torrent.fields["files"], not torrent.get_files(), to work around
     # https://github.com/trim21/transmission-rpc/issues/455
     #
@@ -35,7 +198,7 @@ def _mark_unwanted(transmission_client):
 
     missing = False
     unwanted_file_ids_by_torrent_info_hash = {}
-    for file_name in (line.rstrip("\r\n") for line in sys.stdin):
+    for file_name in client_factory.read_input(lambda: _read_file_names(args.null)):
         if len(file_name) == 0:
             continue
 
@@ -48,16 +211,43 @@ def _mark_unwanted(transmission_client):
             continue
 
         torrent_info_hash, file_id = torrent_info_hash_and_file_id
-        unwanted_file_ids_by_torrent_info_hash.setdefault(torrent_info_hash, []).append(
+        unwanted_file_ids_by_torrent_info_hash.setdefault(torrent_info_hash, set()).add(
             file_id
         )
 
-    for (
-        torrent_info_hash,
-        unwanted_file_ids,
-    ) in unwanted_file_ids_by_torrent_info_hash.items():
-        transmission_client.change_torrent(
-            torrent_info_hash, files_unwanted=unwanted_file_ids
+    if not getattr(args, "dry_run", False):
+        _set_files_unwanted(
+            transmission_client,
+            transmission_url,
+            client_factory,
+            unwanted_file_ids_by_torrent_info_hash,
+            max_concurrent_requests=args.max_concurrent_requests,
+            files_per_request=args.files_per_request,
+        )
+
+    if args.delete:
+        # Rather than having Transmission send us the whole file list again, work
+        # out which files are now wanted from what we already have. This also makes
+        # --dry-run show what would happen if the files had been marked.
+        prefetched_torrents = []
+        for torrent in torrents:
+            unwanted_file_ids = unwanted_file_ids_by_torrent_info_hash.get(
+                torrent.info_hash
+            )
+            if unwanted_file_ids is None:
+                continue
+            prefetched_torrents.append(
+                delete_unwanted.PrefetchedTorrent(
+                    info_hash=torrent.info_hash,
+                    files=torrent.fields["files"],
+                    wanted=[
+                        wanted and file_id not in unwanted_file_ids
+                        for file_id, wanted in enumerate(torrent.wanted)
+                    ],
+                )
+            )
+        delete_unwanted.process_prefetched_torrents(
+            transmission_client, transmission_url, prefetched_torrents, args
         )
 
     return not missing
@@ -65,10 +255,31 @@ def _mark_unwanted(transmission_client):
 
 def run(args):
     args = _parse_arguments(args)
-    transmission_url = args.transmission_url
-    with transmission_rpc.from_url(transmission_url) as transmission_client:
-        return _mark_unwanted(transmission_client)
+    try:
+        with contextlib.closing(recording.ClientFactory(args)) as client_factory:
+            transmission_urls = client_factory.get_transmission_urls([
+                getattr(
+                    args,
+                    "transmission_url",
+                    delete_unwanted.DEFAULT_TRANSMISSION_URL,
+                )
+            ])
+            if len(transmission_urls) != 1:
+                raise delete_unwanted.DeleteUnwantedException(
+                    "Recording contains more than one Transmission instance"
+                )
+            transmission_url = transmission_urls[0]
+            with client_factory.open(transmission_url) as transmission_client:
+                return _mark_unwanted(
+                    transmission_client, transmission_url, client_factory, args
+                )
+    except recording.RecordingException as exception:
+        raise delete_unwanted.DeleteUnwantedException(exception.args[0]) from exception
 
 
 def main():
-    return 0 if run(args=None) else 1
+    try:
+        return 0 if run(args=None) else 1
+    except delete_unwanted.DeleteUnwantedException as exception:
+        print(f"FATAL ERROR: {exception.args[0]}", file=sys.stderr)
+        return 1
@@ -0,0 +1,268 @@
+import array
+import collections
+import hashlib
+import re
+
+# SHA-1 digest size, as used for v1 piece hashes.
+PIECE_HASH_SIZE = 20
+
+# `piece_hashes` is None for v2-only torrents (BEP 52), which don't have v1 piece
+# hashes. `file_names` is None if the file names can't be used as is (see
+# _get_file_names()). `file_lengths` is an array of integers. `file_padding` says
+# which files are pad files, according to their "attr" key (BEP 47).
+Metainfo = collections.namedtuple(
+    "Metainfo",
+    [
+        "info_hash",
+        "piece_size",
+        "piece_hashes",
+        "file_names",
+        "file_lengths",
+        "file_padding",
+    ],
+)
+
+
+class MetainfoException(Exception):
+    pass
+
+
+# Bencoding tokens, as they appear when indexing into bytes.
+_INTEGER = ord("i")
+_LIST = ord("l")
+_DICTIONARY = ord("d")
+_END = ord("e")
+
+# The start of a file entry that has a length and a path, in that order. Note keys
+# are sorted in bencoded dictionaries.
+_SIMPLE_FILE_ENTRY = re.compile(rb"d6:lengthi(0|[1-9][0-9]*)e4:pathl")
+
+# Matches empty, "." and ".." path components, as well as backslashes and NUL
+# characters.
+_UNSAFE_FILE_NAME = re.compile(rb"(?:^|/)\.{0,2}(?:/|$)|[\\\0]")
+
+
+def decode(data):
+    value, offset = _decode(data, 0)
+    if offset != len(data):
+        raise MetainfoException(f"Trailing data at offset {offset}")
+    return value
+
+
+def _decode(data, offset):
+    # Returns the decoded value and the offset right after it.
+    try:
+        token = data[offset]
+        if token == _INTEGER:
+            end = data.index(b"e", offset)
+            return int(data[offset + 1 : end]), end + 1
+        if token == _LIST:
+            values = []
+            offset += 1
+            while data[offset] != _END:
+                value, offset = _decode(data, offset)
+                values.append(value)
+            return values, offset + 1
+        if token == _DICTIONARY:
+            values = {}
+            offset += 1
+            while data[offset] != _END:
+                key, offset = _decode_string(data, offset)
+                values[key], offset = _decode(data, offset)
+            return values, offset + 1
+        return _decode_string(data, offset)
+    except (ValueError, IndexError) as exception:
+        raise MetainfoException(
+            f"Invalid bencoded data at offset {offset}: {exception}"
+        ) from exception
+
+
+def _decode_string(data, offset):
+    colon = data.index(b":", offset)
+    length = int(data[offset:colon])
+    end = colon + 1 + length
+    if length < 0 or end > len(data):
+        raise MetainfoException(f"Invalid string length at offset {offset}")
+    return data[colon + 1 : end], end
+
+
+def _skip(data, offset):
+    # Returns the offset right after the value at the given offset, without decoding
+    # it.
+    token = data[offset]
+    if token == _INTEGER:
+        return data.index(b"e", offset) + 1
+    if token in (_LIST, _DICTIONARY):
+        offset += 1
+        while data[offset] != _END:
+            offset = _skip(data, offset)
+        return offset + 1
+    colon = data.index(b":", offset)
+    end = colon + 1 + int(data[offset:colon])
+    if end > len(data):
+        raise MetainfoException(f"Invalid string length at offset {offset}")
+    return end
+
+
+def _scan_dictionary(data, offset, parsers):
+    # Parses the dictionary at the given offset in a single pass, only looking at the
+    # keys in `parsers`, which map to functions that take the data and value offset
+    # and return the parsed value and the offset right after it. Everything else is
+    # skipped over without being decoded, which is what makes this cheap even for
+    # huge metainfo files. Returns the parsed values and the offset right after the
+    # dictionary.
+    if data[offset] != _DICTIONARY:
+        raise MetainfoException(f"Expected a dictionary at offset {offset}")
+    values = {}
+    offset += 1
+    while data[offset] != _END:
+        key, offset = _decode_string(data, offset)
+        parser = parsers.get(key)
+        if parser is None:
+            offset = _skip(data, offset)
+        else:
+            values[key], offset = parser(data, offset)
+    return values, offset + 1
+
+
+def _get(values, key, value_type):
+    value = values.get(key)
+    if value is not None and not isinstance(value, value_type):
+        raise MetainfoException(f"Invalid {key!r}")
+    return value
+
+
+def read(metainfo_path):
+    with open(metainfo_path, "rb") as metainfo_file:
+        data = metainfo_file.read()
+    try:
+        values, end = _scan_dictionary(data, 0, {b"info": _parse_info})
+    except (ValueError, IndexError) as exception:
+        raise MetainfoException(f"Invalid metainfo: {exception}") from exception
+    if end != len(data):
+        raise MetainfoException(f"Trailing data at offset {end}")
+    if b"info" not in values:
+        raise MetainfoException("Metainfo does not have an info dictionary")
+    return values[b"info"]
+
+
+def _parse_info(data, offset):
+    values, end = _scan_dictionary(
+        data,
+        offset,
+        {
+            b"piece length": _decode,
+            b"pieces": _decode,
+            b"name": _decode,
+            b"name.utf-8": _decode,
+            b"length": _decode,
+            b"files": _parse_files,
+        },
+    )
+
+    piece_size = _get(values, b"piece length", int)
+    if piece_size is None or piece_size <= 0:
+        raise MetainfoException("Metainfo does not have a valid piece length")
+    piece_hashes = _get(values, b"pieces", bytes)
+    if piece_hashes is not None and len(piece_hashes) % PIECE_HASH_SIZE != 0:
+        raise MetainfoException("Invalid piece hashes length")
+    name = _get(values, b"name.utf-8", bytes)
+    if name is None:
+        name = _get(values, b"name", bytes)
+
+    if b"files" in values:
+        file_lengths, file_paths, file_padding = values[b"files"]
+    else:
+        file_length = _get(values, b"length", int)
+        if file_length is None or file_length < 0:
+            # Most likely a v2-only torrent (BEP 52), which lists files in a "file
+            # tree" instead.
+            raise MetainfoException("Metainfo does not have a v1 file list")
+        file_lengths = array.array("q", [file_length])
+        # None for single-file torrents.
+        file_paths = None
+        file_padding = [False]
+
+    return (
+        Metainfo(
+            info_hash=hashlib.sha1(memoryview(data)[offset:end]).hexdigest(),
+            piece_size=piece_size,
+            piece_hashes=piece_hashes,
+            file_names=_get_file_names(name, file_paths),
+            file_lengths=file_lengths,
+            file_padding=file_padding,
+        ),
+        end,
+    )
+
+
+def _parse_files(data, offset):
+    if data[offset] != _LIST:
+        raise MetainfoException(f"Expected a file list at offset {offset}")
+    file_parsers = {
+        b"attr": _decode,
+        b"length": _decode,
+        b"path": _decode,
+        b"path.utf-8": _decode,
+    }
+    file_lengths = array.array("q")
+    file_paths = []
+    file_padding = []
+    offset += 1
+    while data[offset] != _END:
+        # Fast path for the most common case, where the file entry only has a length
+        # and a path.
+        match = _SIMPLE_FILE_ENTRY.match(data, offset)
+        if match is not None:
+            file_path = []
+            path_offset = match.end()
+            while data[path_offset] != _END:
+                component, path_offset = _decode_string(data, path_offset)
+                file_path.append(component)
+            if data[path_offset + 1] == _END:
+                file_lengths.append(int(match.group(1)))
+                file_paths.append(file_path)
+                file_padding.append(False)
+                offset = path_offset + 2
+                continue
+
+        values, offset = _scan_dictionary(data, offset, file_parsers)
+        file_length = _get(values, b"length", int)
+        file_path = _get(values, b"path.utf-8", list)
+        if file_path is None:
+            file_path = _get(values, b"path", list)
+        if file_length is None or file_length < 0 or file_path is None:
+            raise MetainfoException(f"Invalid file entry at offset {offset}")
+        file_attributes = _get(values, b"attr", bytes)
+        file_lengths.append(file_length)
+        file_paths.append(file_path)
+        file_padding.append(file_attributes is not None and b"p" in file_attributes)
+    return (file_lengths, file_paths, file_padding), offset + 1
+
+
+def _get_file_names(name, file_paths):
+    # Returns the file names the way Transmission reports them, i.e. relative to the
+    # download directory. Transmission sanitizes names that are not valid UTF-8 or
+    # that could escape the download directory; we don't try to replicate that, and
+    # return None instead if we come across any such name.
+    if name is None:
+        return None
+    file_names = []
+    for file_path in [[]] if file_paths is None else file_paths:
+        try:
+            file_name = b"/".join([name, *file_path])
+        except TypeError:
+            return None
+        # Note a component containing a slash would be indistinguishable from two
+        # components once joined.
+        if (
+            (len(file_path) == 0 and file_paths is not None)
+            or file_name.count(b"/") != len(file_path)
+            or _UNSAFE_FILE_NAME.search(file_name)
+        ):
+            return None
+        try:
+            file_names.append(file_name.decode())
+        except UnicodeDecodeError:
+            return None
+    return file_names
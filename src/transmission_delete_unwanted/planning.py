@@ -0,0 +1,171 @@
+import collections
+import re
+from transmission_delete_unwanted import pieces
+
+# Names of pad files, as per BEP 47 (".pad/N", N being the length, as used by v2
+# hybrid torrents) or the older BitComet convention, directly under the torrent
+# directory. Pad files are only there to align the next file on a piece boundary and
+# only contain zeros, which clients usually don't even write to disk.
+_PADDING_FILE_NAME = re.compile(r"[^/]+/(?:\.pad/([0-9]+)|_____padding_file_[^/]*)")
+
+# The file is to be deleted altogether.
+RemoveFile = collections.namedtuple("RemoveFile", ["file_name"])
+# The file is to be turned into a partial (.part) file that only keeps the given
+# number of bytes at its beginning and end, which belong to wanted pieces shared
+# with adjacent files.
+TrimFile = collections.namedtuple(
+    "TrimFile", ["file_name", "keep_first_bytes", "keep_last_bytes"]
+)
+
+# What needs to be done to a torrent. The piece lists have one boolean per piece,
+# and `files_padding` one boolean per file.
+# `unwanted_bytes` is how much data is present but not wanted, and `verify_size`
+# how much data Transmission will have to hash when verifying the torrent afterwards
+# (both rounded to whole pieces).
+TorrentPlan = collections.namedtuple(
+    "TorrentPlan",
+    [
+        "operations",
+        "piece_size",
+        "files_padding",
+        "pieces_wanted",
+        "pieces_present",
+        "pieces_present_wanted",
+        "pieces_present_unwanted",
+        "unwanted_bytes",
+        "verify_size",
+    ],
+)
+
+
+def is_padding_file(file_name, file_length, piece_size):
+    # Whether the file looks like a pad file. This is only a hint: nothing prevents a
+    # torrent from having payload files with such names.
+    match = _PADDING_FILE_NAME.fullmatch(file_name)
+    return (
+        match is not None
+        and 0 < file_length < piece_size
+        and (match.group(1) is None or int(match.group(1)) == file_length)
+    )
+
+
+def plan_torrent(
+    file_names,
+    file_lengths,
+    files_wanted,
+    piece_size,
+    pieces_present,
+    files_bytes_completed=None,
+    files_padding=None,
+):
+    # Works out which files to remove or trim so that no present, unwanted pieces
+    # remain, without touching any valid, wanted piece. `pieces_present` is a list of
+    # booleans, e.g. as returned by pieces.to_array(). If `files_bytes_completed` is
+    # given, files that have no data are skipped without further ado.
+    # `files_padding` says which files are known to be pad files, i.e. flagged as such
+    # in the "attr" key of the metainfo. A name is not enough to go by, as we would
+    # end up throwing away payload that happens to be named like a pad file.
+    if files_padding is None:
+        files_padding = [False] * len(file_names)
+    # Pad files are never wanted, even if Transmission says they are. This is what
+    # makes it possible to get rid of a file that is followed by padding entirely,
+    # instead of having to trim it because its last piece overlaps with the next
+    # file.
+    pieces_wanted = pieces.pieces_wanted_from_files(
+        file_lengths,
+        [
+            file_wanted and not file_padding
+            for file_wanted, file_padding in zip(files_wanted, files_padding)
+        ],
+        piece_size,
+    )
+    if len(pieces_present) != len(pieces_wanted):
+        raise ValueError(
+            f"Number of pieces ({len(pieces_present)}) is not consistent with total"
+            f" file size ({sum(file_lengths)}) and piece size ({piece_size})"
+        )
+    pieces_present_wanted = [
+        present and wanted for wanted, present in zip(pieces_wanted, pieces_present)
+    ]
+    pieces_present_unwanted = [
+        present and not wanted for wanted, present in zip(pieces_wanted, pieces_present)
+    ]
+    plan = TorrentPlan(
+        operations=[],
+        piece_size=piece_size,
+        files_padding=files_padding,
+        pieces_wanted=pieces_wanted,
+        pieces_present=pieces_present,
+        pieces_present_wanted=pieces_present_wanted,
+        pieces_present_unwanted=pieces_present_unwanted,
+        unwanted_bytes=pieces_present_unwanted.count(True) * piece_size,
+        verify_size=pieces_present_wanted.count(True) * piece_size,
+    )
+    if plan.unwanted_bytes == 0:
+        return plan
+
+    current_offset = 0
+    for file_index, (file_name, file_length, file_wanted) in enumerate(
+        zip(file_names, file_lengths, files_wanted)
+    ):
+        # If Transmission says there is no data for this file, then there can't be
+        # any present pieces in it and there is nothing to do. Don't bother looking
+        # for it on disk. Pad files are less than a piece long and normally don't
+        # exist on disk either, so we leave them alone.
+        if not files_padding[file_index] and (
+            files_bytes_completed is None or files_bytes_completed[file_index] > 0
+        ):
+            operation = _plan_file(
+                plan, file_name, file_length, current_offset, file_wanted
+            )
+            if operation is not None:
+                plan.operations.append(operation)
+        current_offset += file_length
+    return plan
+
+
+def _plan_file(plan, file_name, file_length, current_offset, file_wanted):
+    piece_size = plan.piece_size
+    begin_piece = current_offset // piece_size
+    end_piece = -(-(current_offset + file_length) // piece_size)
+    next_offset = current_offset + file_length
+
+    if not any(plan.pieces_present_unwanted[begin_piece:end_piece]):
+        return None
+    assert not file_wanted
+
+    if any(plan.pieces_present_wanted[begin_piece:end_piece]):
+        # The file is not wanted, but it contains valid pieces that are wanted. In
+        # practice this means the file contains pieces that overlap with wanted,
+        # adjacent files. We can't get rid of the file without corrupting these
+        # pieces; best we can do is turn it into a partial file.
+
+        # Sanity check that the wanted pieces are where we expect them to be.
+        assert current_offset % piece_size != 0 or not plan.pieces_wanted[begin_piece]
+        assert next_offset % piece_size != 0 or not plan.pieces_wanted[end_piece - 1]
+        assert not any(plan.pieces_wanted[begin_piece + 1 : end_piece - 1])
+
+        keep_first_bytes = (
+            (begin_piece + 1) * piece_size - current_offset
+            if plan.pieces_present_wanted[begin_piece]
+            else 0
+        )
+        assert 0 <= keep_first_bytes < piece_size
+        keep_last_bytes = (
+            piece_size - (end_piece * piece_size - current_offset - file_length)
+            if plan.pieces_present_wanted[end_piece - 1]
+            else piece_size
+        )
+        assert 0 < keep_last_bytes <= piece_size
+        keep_last_bytes %= piece_size
+        assert keep_first_bytes > 0 or keep_last_bytes > 0
+        assert (keep_first_bytes + keep_last_bytes) < file_length
+        return TrimFile(
+            file_name,
+            keep_first_bytes=keep_first_bytes,
+            keep_last_bytes=keep_last_bytes,
+        )
+
+    # The file does not contain any data from wanted, valid pieces; we can safely get
+    # rid of it.
+    return RemoveFile(file_name)
@@ -0,0 +1,309 @@
+import argparse
+import collections
+import functools
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import threading
+import urllib.parse
+
+# Recordings are JSON lines files. The first line is a header, and each following
+# line is either an RPC exchange ({"url", "request", "response"}) or the list of
+# file names a command read from its input ({"input"}).
+_FORMAT = "transmission-delete-unwanted-recording"
+_VERSION = 1
+
+# Keys whose string values are kept as is when anonymizing. These don't say anything
+# about the library, and some of them are needed for the recording to replay at all.
+_PUBLIC_KEYS = frozenset(
+    ["method", "result", "fields", "format", "version", "rpc-version-semver", "pieces"]
+)
+
+_INFO_HASH = re.compile(r"[0-9a-fA-F]{40}")
+
+
+class RecordingException(Exception):
+    pass
+
+
+def add_arguments(argument_parser):
+    recording_group = argument_parser.add_mutually_exclusive_group()
+    recording_group.add_argument(
+        "--record",
+        help=(
+            "Record every RPC request sent to Transmission, along with its response,"
+            " to this file, so that the run can later be analyzed with --replay"
+        ),
+        metavar="FILE",
+        default=argparse.SUPPRESS,
+    )
+    recording_group.add_argument(
+        "--replay",
+        help=(
+            "Do not connect to Transmission; instead, replay the RPC responses from a"
+            " file written by --record. Implies --dry-run. The Transmission URLs are"
+            " taken from the recording, and the options should match the ones used"
+            " when recording, otherwise the requests will not match."
+        ),
+        metavar="FILE",
+        default=argparse.SUPPRESS,
+    )
+    argument_parser.add_argument(
+        "--record-anonymize",
+        help=(
+            "When recording, replace file and torrent names, paths, labels, info"
+            " hashes, the Transmission URL and any other free-form strings with opaque"
+            " tokens. The same string always maps to the same token within a"
+            " recording, so that it can still be replayed."
+        ),
+        action="store_true",
+        default=argparse.SUPPRESS,
+    )
+
+
+def check_arguments(argument_parser, args):
+    if getattr(args, "record_anonymize", False) and not hasattr(args, "record"):
+        argument_parser.error("--record-anonymize requires --record")
+    if hasattr(args, "replay"):
+        if hasattr(args, "transmission_url"):
+            argument_parser.error("--transmission-url cannot be used with --replay")
+        args.dry_run = True
+
+
+class _Anonymizer:
+    # Maps strings to opaque tokens using a keyed hash. The key is random and never
+    # stored, so the tokens can't be reversed, even by guessing likely names.
+    def __init__(self):
+        self._key = secrets.token_bytes(32)
+        self._tokens = {}
+
+    def _token(self, string):
+        token = self._tokens.get(string)
+        if token is None:
+            digest = hmac.new(self._key, string.encode(), hashlib.sha256).hexdigest()
+            # Info hashes still look like info hashes afterwards.
+            token = digest[:40] if _INFO_HASH.fullmatch(string) else digest[:12]
+            self._tokens[string] = token
+        return token
+
+    def anonymize_string(self, string):
+        # Path components are mapped separately, so that the structure of paths (e.g.
+        # the torrent name being the first component of its file names) is preserved.
+        return "/".join(
+            component if component == "" else self._token(component)
+            for component in string.split("/")
+        )
+
+    def anonymize(self, value, key=None):
+        if isinstance(value, str):
+            return value if key in _PUBLIC_KEYS else self.anonymize_string(value)
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if isinstance(value, dict):
+            return {
+                item_key: self.anonymize(item_value, item_key)
+                for item_key, item_value in value.items()
+            }
+        return value
+
+    def anonymize_url(self, url):
+        return f"{url.scheme}://{self._token(url.netloc)}"
+
+
+class _Recorder:
+    def __init__(self, path, anonymize):
+        self._lock = threading.Lock()
+        self._anonymizer = _Anonymizer() if anonymize else None
+        try:
+            # pylint: disable-next=consider-using-with
+            self._file = open(path, "w", encoding="utf-8")
+        except OSError as exception:
+            raise RecordingException(
+                f"Unable to create recording {path}: {exception}"
+            ) from exception
+        self._write({"format": _FORMAT, "version": _VERSION})
+
+    def close(self):
+        self._file.close()
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def get_url(self, transmission_url):
+        # Credentials are never recorded.
+        url = urllib.parse.urlsplit(transmission_url)
+        url = url._replace(netloc=url.netloc.rpartition("@")[2])
+        with self._lock:
+            if self._anonymizer is not None:
+                return self._anonymizer.anonymize_url(url)
+        return url.geturl()
+
+    def record_exchange(self, url, query, response):
+        try:
+            response = json.loads(response)
+            response_key = "response"
+        except json.JSONDecodeError:
+            response_key = "response_text"
+        with self._lock:
+            if self._anonymizer is not None:
+                query = self._anonymizer.anonymize(query)
+                response = (
+                    self._anonymizer.anonymize(response)
+                    if response_key == "response"
+                    # Can't tell what's in there.
+                    else ""
+                )
+            self._write({"url": url, "request": query, response_key: response})
+
+    def record_input(self, file_names):
+        with self._lock:
+            if self._anonymizer is not None:
+                file_names = [
+                    self._anonymizer.anonymize_string(file_name)
+                    for file_name in file_names
+                ]
+            self._write({"input": file_names})
+
+
+def _request_key(url, query):
+    # transmission_rpc builds the list of fields from a set, so their order changes
+    # from one run to the next.
+    arguments = query.get("arguments", {})
+    if "fields" in arguments:
+        query = {
+            **query,
+            "arguments": {**arguments, "fields": sorted(arguments["fields"])},
+        }
+    return url, json.dumps(query, sort_keys=True)
+
+
+class _Replayer:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        # Responses for each distinct request, in the order they were recorded.
+        self._responses = collections.defaultdict(collections.deque)
+        self.urls = []
+        self.input = None
+        try:
+            with open(path, "r", encoding="utf-8") as recording_file:
+                self._load(recording_file)
+        except (OSError, ValueError, KeyError, TypeError) as exception:
+            raise RecordingException(
+                f"Unable to read recording {path}: {exception}"
+            ) from exception
+
+    def _load(self, recording_file):
+        header = json.loads(next(recording_file, "null"))
+        if not isinstance(header, dict) or header.get("format") != _FORMAT:
+            raise ValueError("not a recording")
+        if header["version"] != _VERSION:
+            raise ValueError(f"unsupported version {header['version']}")
+        for line in recording_file:
+            entry = json.loads(line)
+            if "input" in entry:
+                self.input = entry["input"]
+                continue
+            url = entry["url"]
+            if url not in self.urls:
+                self.urls.append(url)
+            self._responses[_request_key(url, entry["request"])].append(
+                json.dumps(entry["response"])
+                if "response" in entry
+                else entry["response_text"]
+            )
+
+    def get_response(self, url, query):
+        with self._lock:
+            responses = self._responses.get(_request_key(url, query))
+            if responses is None:
+                raise RecordingException(
+                    f"Request not found in recording: {json.dumps(query)[:200]}"
+                )
+            # Identical requests get the recorded responses in turn; once we run out,
+            # the last one is repeated.
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+
+@functools.cache
+def _get_client_class():
+    import transmission_rpc
+
+    class Client(transmission_rpc.Client):
+        def __init__(self, recording_url, recorder, replayer, **kwargs):
+            self._recording_url = recording_url
+            self._recorder = recorder
+            self._replayer = replayer
+            super().__init__(**kwargs)
+
+        def _http_query(self, query, timeout=None):
+            if self._replayer is not None:
+                return self._replayer.get_response(self._recording_url, query)
+            response = super()._http_query(query, timeout)
+            self._recorder.record_exchange(self._recording_url, query, response)
+            return response
+
+    return Client
+
+
+class ClientFactory:
+    # Creates Transmission clients according to the arguments added by
+    # add_arguments(), recording or replaying their RPC traffic as requested.
+    def __init__(self, args):
+        record_path = getattr(args, "record", None)
+        replay_path = getattr(args, "replay", None)
+        self._recorder = (
+            None
+            if record_path is None
+            else _Recorder(record_path, getattr(args, "record_anonymize", False))
+        )
+        self._replayer = None if replay_path is None else _Replayer(replay_path)
+
+    def close(self):
+        if self._recorder is not None:
+            self._recorder.close()
+
+    def get_transmission_urls(self, transmission_urls):
+        # When replaying, the URLs come from the recording instead.
+        if self._replayer is None:
+            return transmission_urls
+        if len(self._replayer.urls) == 0:
+            raise RecordingException("Recording is empty")
+        return self._replayer.urls
+
+    def read_input(self, read):
+        # Returns the input file names, from the recording if we are replaying, or by
+        # calling `read` otherwise.
+        if self._replayer is not None:
+            if self._replayer.input is None:
+                raise RecordingException("Recording does not contain any input")
+            return self._replayer.input
+        file_names = read()
+        if self._recorder is not None:
+            self._recorder.record_input(file_names)
+        return file_names
+
+    def open(self, transmission_url):
+        import transmission_rpc
+
+        if self._recorder is None and self._replayer is None:
+            return transmission_rpc.from_url(transmission_url)
+        url = urllib.parse.urlsplit(transmission_url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"unknown url scheme {url.scheme}")
+        return _get_client_class()(
+            recording_url=(
+                transmission_url
+                if self._recorder is None
+                else self._recorder.get_url(transmission_url)
+            ),
+            recorder=self._recorder,
+            replayer=self._replayer,
+            protocol=url.scheme,
+            username=url.username,
+            password=url.password,
+            host=url.hostname or "127.0.0.1",
+            port=url.port or (443 if url.scheme == "https" else 80),
+            path=url.path or "/transmission/rpc",
+        )
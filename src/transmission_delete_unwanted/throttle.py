@@ -0,0 +1,30 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        assert rate > 0
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._last_refill_time = clock()
+
+    def consume(self, amount):
+        # Note: `amount` is allowed to exceed the bucket capacity, in which case the
+        # bucket goes into debt and the caller waits until it is paid back. This
+        # ensures the average rate is respected regardless of the amounts used.
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._last_refill_time) * self._rate,
+            )
+            self._last_refill_time = now
+            self._tokens -= amount
+            wait_time = -self._tokens / self._rate
+        if wait_time > 0:
+            self._sleep(wait_time)
@@ -0,0 +1,191 @@
+import bisect
+import concurrent.futures
+import hashlib
+import itertools
+import threading
+
+from transmission_delete_unwanted import metainfo
+
+# How much data each verification task reads, at least. Tasks cover consecutive
+# pieces so that reads stay large and sequential.
+_TASK_SIZE = 64 * 1024 * 1024
+
+
+def find_lost_pieces(
+    download_dir,
+    files,
+    piece_size,
+    piece_hashes,
+    piece_indices,
+    thread_count,
+    files_padding=None,
+):
+    # Hashes the given pieces from the files on disk and returns the indices of the
+    # ones that don't match their hash in the metainfo, including pieces that can't be
+    # read at all.
+    #
+    # `files` is the list of (name, length) pairs making up the torrent, in order.
+    # Like Transmission, we look for the data in "name.part" if "name" doesn't exist.
+    # `files_padding`, if given, says which files are pad files (BEP 47); these are
+    # not read from disk, as they are all zeros by definition and are usually not
+    # stored.
+    #
+    # hashlib releases the GIL while hashing large buffers, so plain threads are
+    # enough to keep all cores busy.
+    layout = _Layout(download_dir, files, files_padding)
+    buffers = threading.local()
+
+    def verify_task(task_piece_indices):
+        piece_buffer = getattr(buffers, "buffer", None)
+        if piece_buffer is None:
+            piece_buffer = memoryview(bytearray(piece_size))
+            buffers.buffer = piece_buffer
+        with _FileReader(layout) as reader:
+            return [
+                piece_index
+                for piece_index in task_piece_indices
+                if not _verify_piece(
+                    reader, piece_buffer, piece_index, piece_size, piece_hashes
+                )
+            ]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+        return sorted(
+            itertools.chain.from_iterable(
+                executor.map(
+                    verify_task, _split_tasks(sorted(piece_indices), piece_size)
+                )
+            )
+        )
+
+
+def _split_tasks(piece_indices, piece_size):
+    task_piece_count = max(1, _TASK_SIZE // piece_size)
+    task = []
+    for piece_index in piece_indices:
+        if len(task) > 0 and (
+            len(task) >= task_piece_count or piece_index != task[-1] + 1
+        ):
+            yield task
+            task = []
+        task.append(piece_index)
+    if len(task) > 0:
+        yield task
+
+
+def _verify_piece(reader, piece_buffer, piece_index, piece_size, piece_hashes):
+    piece_offset = piece_index * piece_size
+    piece_length = min(piece_size, reader.layout.total_size - piece_offset)
+    if piece_length <= 0:
+        return False
+    piece_view = piece_buffer[:piece_length]
+    if not reader.read(piece_offset, piece_view):
+        return False
+    return (
+        hashlib.sha1(piece_view).digest()
+        == piece_hashes[
+            piece_index
+            * metainfo.PIECE_HASH_SIZE : (piece_index + 1)
+            * metainfo.PIECE_HASH_SIZE
+        ]
+    )
+
+
+class _Layout:
+    def __init__(self, download_dir, files, files_padding=None):
+        self.download_dir = download_dir
+        self.padding = (
+            [False] * len(files) if files_padding is None else list(files_padding)
+        )
+        self.names = []
+        self.lengths = []
+        # Torrent offset at which each file begins.
+        self.offsets = []
+        self.total_size = 0
+        for name, length in files:
+            self.names.append(name)
+            self.lengths.append(length)
+            self.offsets.append(self.total_size)
+            self.total_size += length
+
+
+class _FileReader:
+    # Reads torrent data spanning files, keeping the last file open since consecutive
+    # reads are usually from the same file.
+    def __init__(self, layout):
+        self.layout = layout
+        self._file_index = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file_index = None
+        self._file = None
+
+    def _open(self, file_index):
+        if file_index == self._file_index:
+            return self._file
+        self._close()
+        file_path = self.layout.download_dir / self.layout.names[file_index]
+        for candidate_path in (
+            file_path,
+            file_path.with_name(f"{file_path.name}.part"),
+        ):
+            try:
+                # pylint: disable-next=consider-using-with
+                self._file = open(candidate_path, "rb", buffering=0)
+                break
+            except FileNotFoundError:
+                continue
+        self._file_index = file_index
+        return self._file
+
+    def read(self, offset, buffer):
+        # Fills the buffer with torrent data starting at the given offset. Returns
+        # False if the data is not there.
+        file_index = bisect.bisect_right(self.layout.offsets, offset) - 1
+        position = 0
+        while position < len(buffer):
+            # Skip over empty files.
+            while self.layout.lengths[file_index] == 0:
+                file_index += 1
+            file_offset = offset + position - self.layout.offsets[file_index]
+            read_length = min(
+                len(buffer) - position, self.layout.lengths[file_index] - file_offset
+            )
+            if self.layout.padding[file_index]:
+                buffer[position : position + read_length] = bytes(read_length)
+                position += read_length
+                file_index += 1
+                continue
+            torrent_file = self._open(file_index)
+            if torrent_file is None:
+                return False
+            try:
+                torrent_file.seek(file_offset)
+                if not _read_exactly(
+                    torrent_file, buffer[position : position + read_length]
+                ):
+                    return False
+            except OSError:
+                return False
+            position += read_length
+            file_index += 1
+        return True
+
+
+def _read_exactly(torrent_file, buffer):
+    position = 0
+    while position < len(buffer):
+        read_length = torrent_file.readinto(buffer[position:])
+        if read_length == 0:
+            return False
+        position += read_length
+    return True
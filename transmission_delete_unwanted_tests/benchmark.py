@@ -0,0 +1,151 @@
+import argparse
+import collections
+import io
+import random
+import resource
+import sys
+import tempfile
+import time
+from transmission_delete_unwanted import delete_unwanted, mark_unwanted
+from transmission_delete_unwanted_tests import fake_transmission
+
+# Measures how transmission-delete-unwanted and transmission-mark-unwanted behave at
+# scale, by running them in-process against a fake Transmission serving a synthetic
+# library. For example:
+#
+#   python -m transmission_delete_unwanted_tests.benchmark delete --torrents 10000
+#   python -m transmission_delete_unwanted_tests.benchmark delete --torrents 1 \
+#     --pieces-per-torrent 1000000
+#   python -m transmission_delete_unwanted_tests.benchmark mark --torrents 1 \
+#     --files-per-torrent 500000 -- --delete
+#
+# Any arguments after "--" are passed on to the command. The report is written to
+# stdout; the command output goes to stderr as usual.
+
+
+def _parse_arguments(args):
+    argument_parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark transmission-delete-unwanted or transmission-mark-unwanted"
+            " against a synthetic library"
+        )
+    )
+    argument_parser.add_argument("command", choices=["delete", "mark"])
+    argument_parser.add_argument(
+        "--torrents", help="Number of torrents", type=int, default=100
+    )
+    argument_parser.add_argument(
+        "--files-per-torrent", help="Number of files per torrent", type=int, default=10
+    )
+    argument_parser.add_argument(
+        "--pieces-per-torrent",
+        help="Number of pieces per torrent",
+        type=int,
+        default=1000,
+    )
+    argument_parser.add_argument(
+        "--piece-size", help="Piece size in bytes", type=int, default=16384
+    )
+    argument_parser.add_argument(
+        "--unwanted-ratio",
+        help="Proportion of files that are (to be marked) unwanted",
+        type=float,
+        default=0.5,
+    )
+    argument_parser.add_argument(
+        "--seed", help="Seed for generating the library", type=int, default=0
+    )
+    argument_parser.add_argument(
+        "--work-dir",
+        help=(
+            "Where to put the download directory (default: a temporary directory)."
+            " Note the files are sparse, so they don't take up much space."
+        ),
+        default=None,
+    )
+    separator_index = args.index("--") if "--" in args else len(args)
+    command_args = args[separator_index + 1 :]
+    args = argument_parser.parse_args(args[:separator_index])
+    args.command_args = command_args
+    return args
+
+
+def _get_file_lengths(total_size, file_count, rng):
+    # Splits the torrent into files of random lengths, so that file boundaries are
+    # not aligned with pieces.
+    boundaries = sorted(rng.randrange(total_size + 1) for _ in range(file_count - 1))
+    return [
+        end - begin for begin, end in zip([0, *boundaries], [*boundaries, total_size])
+    ]
+
+
+def _setup_library(fake, args):
+    # Returns the names of the files to be marked unwanted.
+    rng = random.Random(args.seed)
+    unwanted_file_names = []
+    for torrent_index in range(args.torrents):
+        file_lengths = _get_file_lengths(
+            args.pieces_per_torrent * args.piece_size, args.files_per_torrent, rng
+        )
+        wanted = [rng.random() >= args.unwanted_ratio for _ in file_lengths]
+        torrent = fake.add_torrent(
+            f"torrent{torrent_index}",
+            file_lengths,
+            args.piece_size,
+            wanted=None if args.command == "mark" else wanted,
+        )
+        unwanted_file_names.extend(
+            file_name
+            for file_name, file_wanted in zip(torrent.file_names, wanted)
+            if not file_wanted
+        )
+    return unwanted_file_names
+
+
+def _get_peak_rss():
+    # Note ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(args):
+    args = _parse_arguments(args)
+    with (
+        tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir,
+        fake_transmission.FakeTransmission(work_dir) as fake,
+    ):
+        setup_start_time = time.perf_counter()
+        unwanted_file_names = _setup_library(fake, args)
+        setup_time = time.perf_counter() - setup_start_time
+        setup_peak_rss = _get_peak_rss()
+
+        command_args = ["--transmission-url", fake.url, *args.command_args]
+        rpc_counts_before = collections.Counter(fake.rpc_counts)
+        start_time = time.perf_counter()
+        if args.command == "delete":
+            delete_unwanted.run(command_args)
+        else:
+            stdin = sys.stdin
+            sys.stdin = io.StringIO(
+                "".join(f"{name}\n" for name in unwanted_file_names)
+            )
+            try:
+                mark_unwanted.run(command_args)
+            finally:
+                sys.stdin = stdin
+        wall_time = time.perf_counter() - start_time
+        rpc_counts = fake.rpc_counts - rpc_counts_before
+
+    print(f"Setup time: {setup_time:.3f} s")
+    print(f"Wall time: {wall_time:.3f} s")
+    print(f"RPC calls: {sum(rpc_counts.values())}")
+    for method, count in sorted(rpc_counts.items()):
+        print(f"  {method}: {count}")
+    # Note this includes the fake Transmission, which lives in the same process.
+    print(
+        f"Peak RSS: {_get_peak_rss() / 1024 / 1024:.1f} MiB (after setup:"
+        f" {setup_peak_rss / 1024 / 1024:.1f} MiB)"
+    )
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -9,6 +9,7 @@ import backoff
 import torf
 import pytest
 import transmission_rpc
+from transmission_delete_unwanted_tests import fake_transmission
 
 
 def _removeprefix(string, prefix):
@@ -38,6 +39,13 @@ def poll_until(predicate):
     return predicate()
 
 
+@pytest.fixture(name="fake")
+def _fixture_fake(tmp_path):
+    # A fake Transmission instance, for tests that don't need the real thing.
+    with fake_transmission.FakeTransmission(tmp_path) as fake:
+        yield fake
+
+
 @pytest.fixture(name="transmission_url", scope="session")
 def _fixture_transmission_daemon(tmp_path_factory):
     tmp_path = tmp_path_factory.mktemp("transmission-")
@@ -119,7 +127,10 @@ def _fixture_setup_torrent(transmission_client, verify_torrent):
         files,
         piece_size=16384,
         before_add=None,
+        file_attributes=None,
     ):
+        # `file_attributes` maps file names to the value of their "attr" key in the
+        # metainfo (BEP 47).
         path = pathlib.Path(download_dir) / f"test_torrent_{uuid.uuid4()}"
         path.mkdir()
         paths.append(path)
@@ -131,6 +142,10 @@ def _fixture_setup_torrent(transmission_client, verify_torrent):
         torf_torrent = torf.Torrent(path=path, piece_size=piece_size, private=True)
         torf_torrent.generate()
         torf_torrent._path = None  # https://github.com/rndusr/torf/issues/46 pylint:disable=protected-access
+        for file_info in torf_torrent.metainfo["info"].get("files", ()):
+            file_attribute = (file_attributes or {}).get("/".join(file_info["path"]))
+            if file_attribute is not None:
+                file_info["attr"] = file_attribute
         info_hash = torf_torrent.infohash
 
         if before_add is not None:
@@ -0,0 +1,482 @@
+import base64
+import bisect
+import collections
+import contextlib
+import hashlib
+import http.server
+import json
+import pathlib
+import threading
+
+# A lightweight stand-in for a Transmission daemon, serving synthetic torrents over
+# the RPC protocol. Unlike a real daemon, it can hold libraries of the size seen in
+# production (tens of thousands of torrents, millions of pieces or hundreds of
+# thousands of files per torrent) without having to generate or hash real data.
+#
+# By default, the torrent data lives in a download directory of sparse files, i.e.
+# all zeros. Piece hashes are computed accordingly, so the generated .torrent files
+# are consistent with the data on disk. Since trimming a file leaves zeros behind,
+# torrents that need to catch lost data can be created with real (non-zero) data
+# instead, at the cost of writing it out. Either way, verification hashes whatever is
+# on disk: a piece is considered valid if it was valid before and its data still
+# matches.
+
+_SESSION_ID = "fake-transmission-session-id"
+
+# As in Transmission's RPC spec.
+STATUS_STOPPED = 0
+STATUS_SEEDING = 6
+
+
+def _bencode(value, output):
+    if isinstance(value, int):
+        output.append(b"i%de" % value)
+    elif isinstance(value, bytes):
+        output.append(b"%d:" % len(value))
+        output.append(value)
+    elif isinstance(value, str):
+        _bencode(value.encode(), output)
+    elif isinstance(value, list):
+        output.append(b"l")
+        for item in value:
+            _bencode(item, output)
+        output.append(b"e")
+    else:
+        output.append(b"d")
+        for key in sorted(value):
+            _bencode(key, output)
+            _bencode(value[key], output)
+        output.append(b"e")
+
+
+def bencode(value):
+    output = []
+    _bencode(value, output)
+    return b"".join(output)
+
+
+class FakeTorrent:
+    def __init__(
+        self,
+        torrent_id,
+        name,
+        file_lengths,
+        piece_size,
+        download_dir,
+        metainfo_dir,
+        wanted,
+        present,
+        status,
+        labels,
+        file_names=None,
+        sparse=True,
+        padding=None,
+    ):
+        self.torrent_id = torrent_id
+        self.name = name
+        self.file_lengths = file_lengths
+        if file_names is None:
+            file_names = (
+                [name]
+                if len(file_lengths) == 1
+                else [f"file{file_index}" for file_index in range(len(file_lengths))]
+            )
+        self.file_names = (
+            [name]
+            if len(file_lengths) == 1
+            else [f"{name}/{file_name}" for file_name in file_names]
+        )
+        self.piece_size = piece_size
+        self.total_size = sum(file_lengths)
+        self.piece_count = -(-self.total_size // piece_size)
+        self.download_dir = download_dir
+        self.wanted = [True] * len(file_lengths) if wanted is None else list(wanted)
+        self.present = (
+            bytearray(b"\1" * self.piece_count) if present is None else present
+        )
+        self.status = status
+        self.labels = labels
+        self.sparse = sparse
+        self.piece_hashes = self._piece_hashes()
+        self.torrent_file = metainfo_dir / f"{torrent_id}.torrent"
+        info = {
+            "name": name,
+            "piece length": piece_size,
+            "pieces": self.piece_hashes,
+        }
+        if len(file_lengths) == 1:
+            info["length"] = file_lengths[0]
+        else:
+            info["files"] = [
+                {"length": file_length, "path": file_name.split("/")}
+                for file_name, file_length in zip(file_names, file_lengths)
+            ]
+            for file_info, file_padding in zip(info["files"], padding or ()):
+                if file_padding:
+                    file_info["attr"] = "p"
+        encoded_info = bencode(info)
+        self.info_hash = hashlib.sha1(encoded_info).hexdigest()
+        self.torrent_file.write_bytes(b"d4:info" + encoded_info + b"e")
+        self._create_files()
+
+    def _piece_byte(self, piece_index):
+        # Every byte of a piece is the same, but differs from one piece to the next.
+        return 0 if self.sparse else piece_index % 255 + 1
+
+    def _piece_length(self, piece_index):
+        return min(self.piece_size, self.total_size - piece_index * self.piece_size)
+
+    def _piece_hashes(self):
+        # There are only a few distinct pieces, so hash each of them only once.
+        hashes = {}
+        piece_hashes = []
+        for piece_index in range(self.piece_count):
+            key = (self._piece_byte(piece_index), self._piece_length(piece_index))
+            if key not in hashes:
+                hashes[key] = hashlib.sha1(bytes([key[0]]) * key[1]).digest()
+            piece_hashes.append(hashes[key])
+        return b"".join(piece_hashes)
+
+    def _file_ranges(self):
+        # Yields the (begin piece, end piece, begin offset, end offset) of each file.
+        offset = 0
+        for file_length in self.file_lengths:
+            yield (
+                offset // self.piece_size,
+                -(-(offset + file_length) // self.piece_size),
+                offset,
+                offset + file_length,
+            )
+            offset += file_length
+
+    def _create_files(self):
+        piece_size = self.piece_size
+        for file_name, (begin_piece, end_piece, begin, end) in zip(
+            self.file_names, self._file_ranges()
+        ):
+            if begin == end or not any(self.present[begin_piece:end_piece]):
+                continue
+            file_path = self.download_dir / file_name
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(file_path, "wb") as torrent_file:
+                torrent_file.truncate(end - begin)
+                if self.sparse:
+                    continue
+                for piece_index in range(begin_piece, end_piece):
+                    if not self.present[piece_index]:
+                        continue
+                    piece_begin = max(begin, piece_index * piece_size)
+                    piece_end = min(end, (piece_index + 1) * piece_size)
+                    torrent_file.seek(piece_begin - begin)
+                    torrent_file.write(
+                        bytes([self._piece_byte(piece_index)])
+                        * (piece_end - piece_begin)
+                    )
+
+    def _bytes_completed(self):
+        # Computed from the pieces that are present, in time linear in the number of
+        # pieces and files.
+        piece_size = self.piece_size
+        present = self.present
+        present_count_before = [0]
+        for piece_present in present:
+            present_count_before.append(present_count_before[-1] + piece_present)
+        bytes_completed = []
+        for begin_piece, end_piece, begin, end in self._file_ranges():
+            if begin == end:
+                bytes_completed.append(0)
+                continue
+            completed = 0
+            for piece_index in (begin_piece, end_piece - 1):
+                if present[piece_index]:
+                    completed += min(end, (piece_index + 1) * piece_size) - max(
+                        begin, piece_index * piece_size
+                    )
+            if end_piece - begin_piece == 1 and present[begin_piece]:
+                # We counted the same piece twice.
+                completed //= 2
+            if end_piece - begin_piece > 2:
+                completed += (
+                    present_count_before[end_piece - 1]
+                    - present_count_before[begin_piece + 1]
+                ) * piece_size
+            bytes_completed.append(completed)
+        return bytes_completed
+
+    def _wanted_piece_sizes(self):
+        # Returns the total size of the wanted pieces, and of those that are missing.
+        pieces_wanted = bytearray(self.piece_count)
+        for file_wanted, (begin_piece, end_piece, begin, end) in zip(
+            self.wanted, self._file_ranges()
+        ):
+            if file_wanted and begin < end:
+                pieces_wanted[begin_piece:end_piece] = b"\1" * (end_piece - begin_piece)
+        size_when_done = 0
+        left_until_done = 0
+        for piece_index, piece_wanted in enumerate(pieces_wanted):
+            if piece_wanted:
+                size_when_done += self._piece_length(piece_index)
+                if not self.present[piece_index]:
+                    left_until_done += self._piece_length(piece_index)
+        return size_when_done, left_until_done
+
+    def _pieces_bitfield(self):
+        bitfield = bytearray(-(-self.piece_count // 8))
+        for piece_index, piece_present in enumerate(self.present):
+            if piece_present:
+                bitfield[piece_index >> 3] |= 0x80 >> (piece_index & 7)
+        return base64.b64encode(bitfield).decode()
+
+    def _open_file(self, file_name):
+        # Returns None if neither the file nor its .part counterpart exist.
+        file_path = self.download_dir / file_name
+        for candidate_path in (
+            file_path,
+            file_path.with_name(f"{file_path.name}.part"),
+        ):
+            try:
+                return open(candidate_path, "rb")
+            except FileNotFoundError:
+                continue
+        return None
+
+    def verify(self):
+        file_begins = [begin for _, _, begin, _ in self._file_ranges()]
+        with contextlib.ExitStack() as exit_stack:
+            open_files = {}
+
+            def read(file_index, offset, length):
+                # Returns None if the data is not there.
+                if file_index not in open_files:
+                    torrent_file = self._open_file(self.file_names[file_index])
+                    open_files[file_index] = (
+                        None
+                        if torrent_file is None
+                        else exit_stack.enter_context(torrent_file)
+                    )
+                torrent_file = open_files[file_index]
+                if torrent_file is None:
+                    return None
+                torrent_file.seek(offset)
+                data = torrent_file.read(length)
+                return data if len(data) == length else None
+
+            for piece_index in range(self.piece_count):
+                if not self.present[piece_index]:
+                    continue
+                begin = piece_index * self.piece_size
+                end = begin + self._piece_length(piece_index)
+                file_index = bisect.bisect_right(file_begins, begin) - 1
+                piece_data = []
+                while begin < end:
+                    file_end = file_begins[file_index] + self.file_lengths[file_index]
+                    if file_end > begin:
+                        data = read(
+                            file_index,
+                            begin - file_begins[file_index],
+                            min(end, file_end) - begin,
+                        )
+                        if data is None:
+                            break
+                        piece_data.append(data)
+                        begin = min(end, file_end)
+                    file_index += 1
+                if (
+                    begin < end
+                    or hashlib.sha1(b"".join(piece_data)).digest()
+                    != self.piece_hashes[piece_index * 20 : (piece_index + 1) * 20]
+                ):
+                    self.present[piece_index] = False
+
+    def get_fields(self, fields):
+        getters = {
+            "id": lambda: self.torrent_id,
+            "hashString": lambda: self.info_hash,
+            "name": lambda: self.name,
+            "status": lambda: self.status,
+            "pieceCount": lambda: self.piece_count,
+            "pieceSize": lambda: self.piece_size,
+            "pieces": self._pieces_bitfield,
+            "totalSize": lambda: self.total_size,
+            "haveValid": lambda: sum(self._bytes_completed()),
+            "sizeWhenDone": lambda: self._wanted_piece_sizes()[0],
+            "leftUntilDone": lambda: self._wanted_piece_sizes()[1],
+            "wanted": lambda: [1 if file_wanted else 0 for file_wanted in self.wanted],
+            "files": lambda: [
+                {"name": name, "length": length, "bytesCompleted": completed}
+                for name, length, completed in zip(
+                    self.file_names, self.file_lengths, self._bytes_completed()
+                )
+            ],
+            "labels": lambda: self.labels,
+            "downloadDir": lambda: str(self.download_dir),
+            "torrentFile": lambda: str(self.torrent_file),
+            "recheckProgress": lambda: 0.0,
+        }
+        return {field: getters[field]() for field in fields if field in getters}
+
+
+class FakeTransmission:
+    def __init__(self, root_dir):
+        self.download_dir = pathlib.Path(root_dir) / "download"
+        self.download_dir.mkdir()
+        self._metainfo_dir = pathlib.Path(root_dir) / "torrents"
+        self._metainfo_dir.mkdir()
+        self._torrents = []
+        self._lock = threading.Lock()
+        # How many times each RPC method was called.
+        self.rpc_counts = collections.Counter()
+        # The IDs passed to each torrent-verify call, in order.
+        self.verify_requests = []
+        fake_transmission = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):  # pylint: disable=invalid-name
+                fake_transmission.handle(self)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_torrent(
+        self,
+        name,
+        file_lengths,
+        piece_size,
+        wanted=None,
+        present=None,
+        status=STATUS_SEEDING,
+        labels=(),
+        file_names=None,
+        sparse=True,
+        padding=None,
+    ):
+        # `present` is a bytearray with one byte per piece (all present by default).
+        # `file_names` are relative to the torrent directory (default: file0, file1,
+        # etc.). If `sparse` is false, the data is written out for real. `padding` says
+        # which files are flagged as pad files in the metainfo.
+        with self._lock:
+            torrent = FakeTorrent(
+                torrent_id=len(self._torrents) + 1,
+                name=name,
+                file_lengths=file_lengths,
+                piece_size=piece_size,
+                download_dir=self.download_dir,
+                metainfo_dir=self._metainfo_dir,
+                wanted=wanted,
+                present=present,
+                status=status,
+                labels=list(labels),
+                file_names=file_names,
+                sparse=sparse,
+                padding=padding,
+            )
+            self._torrents.append(torrent)
+        return torrent
+
+    def get_torrent(self, torrent_id):
+        with self._lock:
+            return self._find_torrents([torrent_id])[0]
+
+    def _find_torrents(self, ids):
+        if ids is None:
+            return list(self._torrents)
+        if not isinstance(ids, list):
+            ids = [ids]
+        ids = set(ids)
+        return [
+            torrent
+            for torrent in self._torrents
+            if torrent.torrent_id in ids or torrent.info_hash in ids
+        ]
+
+    def handle(self, request_handler):
+        if request_handler.headers.get("X-Transmission-Session-Id") != _SESSION_ID:
+            request_handler.send_response(409)
+            request_handler.send_header("X-Transmission-Session-Id", _SESSION_ID)
+            request_handler.end_headers()
+            return
+        request = json.loads(
+            request_handler.rfile.read(int(request_handler.headers["Content-Length"]))
+        )
+        method = request["method"]
+        arguments = request.get("arguments", {})
+        with self._lock:
+            self.rpc_counts[method] += 1
+            handler = getattr(self, f"_rpc_{method.replace('-', '_')}", None)
+            response = (
+                {"result": "method name not recognized"}
+                if handler is None
+                else {"result": "success", "arguments": handler(arguments)}
+            )
+        body = json.dumps(response).encode()
+        request_handler.send_response(200)
+        request_handler.send_header("Content-Type", "application/json")
+        request_handler.send_header("Content-Length", str(len(body)))
+        request_handler.send_header("X-Transmission-Session-Id", _SESSION_ID)
+        request_handler.end_headers()
+        request_handler.wfile.write(body)
+
+    def _rpc_session_get(self, _):
+        return {
+            "version": "4.0.6 (fake)",
+            "rpc-version": 17,
+            "rpc-version-semver": "5.3.0",
+            "rpc-version-minimum": 14,
+            "download-dir": str(self.download_dir),
+        }
+
+    def _rpc_torrent_get(self, arguments):
+        return {
+            "torrents": [
+                torrent.get_fields(arguments["fields"])
+                for torrent in self._find_torrents(arguments.get("ids"))
+            ]
+        }
+
+    def _rpc_torrent_set(self, arguments):
+        for torrent in self._find_torrents(arguments.get("ids")):
+            for file_index in arguments.get("files-unwanted", []):
+                torrent.wanted[file_index] = False
+            for file_index in arguments.get("files-wanted", []):
+                torrent.wanted[file_index] = True
+        return {}
+
+    def _rpc_torrent_start(self, arguments):
+        for torrent in self._find_torrents(arguments.get("ids")):
+            torrent.status = STATUS_SEEDING
+        return {}
+
+    _rpc_torrent_start_now = _rpc_torrent_start
+
+    def _rpc_torrent_stop(self, arguments):
+        for torrent in self._find_torrents(arguments.get("ids")):
+            torrent.status = STATUS_STOPPED
+        return {}
+
+    def _rpc_torrent_verify(self, arguments):
+        # Verification completes instantly, leaving the torrent stopped.
+        ids = arguments.get("ids")
+        self.verify_requests.append(ids if isinstance(ids, list) else [ids])
+        for torrent in self._find_torrents(arguments.get("ids")):
+            torrent.verify()
+            torrent.status = STATUS_STOPPED
+        return {}
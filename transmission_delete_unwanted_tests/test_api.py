@@ -0,0 +1,181 @@
+import pytest
+import transmission_rpc
+from transmission_delete_unwanted import api, planning
+
+_PIECE_SIZE = 16384
+
+
+def test_plan_torrent_nothing_to_do():
+    plan = api.plan_torrent(
+        ["t/file0", "t/file1"],
+        [_PIECE_SIZE, _PIECE_SIZE],
+        [True, True],
+        _PIECE_SIZE,
+        [True, True],
+    )
+    assert plan.operations == []
+    assert plan.unwanted_bytes == 0
+    assert plan.verify_size == 2 * _PIECE_SIZE
+
+
+def test_plan_torrent_remove():
+    plan = api.plan_torrent(
+        ["t/file0", "t/file1", "t/file2", "t/file3"],
+        [_PIECE_SIZE, _PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        [True, False, False, True],
+        _PIECE_SIZE,
+        [True, True, True, True],
+    )
+    assert plan.operations == [api.RemoveFile("t/file1"), api.RemoveFile("t/file2")]
+    assert plan.pieces_wanted == [True, False, False, True]
+    assert plan.unwanted_bytes == 2 * _PIECE_SIZE
+    assert plan.verify_size == 2 * _PIECE_SIZE
+
+
+def test_plan_torrent_trim():
+    plan = api.plan_torrent(
+        ["t/file0", "t/file1", "t/file2"],
+        [_PIECE_SIZE + 1, 2 * _PIECE_SIZE, _PIECE_SIZE - 1],
+        [True, False, True],
+        _PIECE_SIZE,
+        [True, True, True, True],
+    )
+    assert plan.operations == [
+        api.TrimFile("t/file1", keep_first_bytes=_PIECE_SIZE - 1, keep_last_bytes=1)
+    ]
+    assert plan.unwanted_bytes == _PIECE_SIZE
+    assert plan.verify_size == 3 * _PIECE_SIZE
+
+
+def test_plan_torrent_bytes_completed():
+    plan = api.plan_torrent(
+        ["t/file0", "t/file1"],
+        [_PIECE_SIZE, _PIECE_SIZE],
+        [True, False],
+        _PIECE_SIZE,
+        [True, True],
+        files_bytes_completed=[_PIECE_SIZE, 0],
+    )
+    assert plan.operations == []
+    assert plan.unwanted_bytes == _PIECE_SIZE
+
+
+@pytest.mark.parametrize(
+    "file_name,file_length,expected",
+    [
+        ("t/.pad/16383", _PIECE_SIZE - 1, True),
+        ("t/_____padding_file_0_", _PIECE_SIZE - 1, True),
+        # BEP 47 pad files are named after their length.
+        ("t/.pad/16383", _PIECE_SIZE - 2, False),
+        ("t/.pad/pad", _PIECE_SIZE - 1, False),
+        # Pad files are always shorter than a piece.
+        ("t/.pad/16384", _PIECE_SIZE, False),
+        ("t/_____padding_file_0_", _PIECE_SIZE, False),
+        # Pad files live directly under the torrent directory.
+        (".pad/16383", _PIECE_SIZE - 1, False),
+        ("t/d/.pad/16383", _PIECE_SIZE - 1, False),
+        ("t/d/_____padding_file_0_", _PIECE_SIZE - 1, False),
+        ("t/_____padding_file_0_/file", _PIECE_SIZE - 1, False),
+    ],
+)
+def test_is_padding_file(file_name, file_length, expected):
+    assert planning.is_padding_file(file_name, file_length, _PIECE_SIZE) == expected
+
+
+def test_plan_torrent_padding():
+    # Without the pad file being recognized as such, file0 would have to be trimmed
+    # as its last piece would be shared with a wanted file.
+    plan = api.plan_torrent(
+        ["t/file0", "t/.pad/16383", "t/file1"],
+        [_PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        [False, True, True],
+        _PIECE_SIZE,
+        [True, True, True],
+        files_padding=[False, True, False],
+    )
+    assert plan.operations == [api.RemoveFile("t/file0")]
+    assert plan.pieces_wanted == [False, False, True]
+    assert plan.files_padding == [False, True, False]
+
+
+def test_plan_torrent_padding_name_only():
+    # Going by the name alone, the file could just as well be payload.
+    plan = api.plan_torrent(
+        ["t/file0", "t/.pad/16383", "t/file1"],
+        [_PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        [False, True, True],
+        _PIECE_SIZE,
+        [True, True, True],
+    )
+    assert plan.operations == [api.TrimFile("t/file0", 0, 1)]
+    assert plan.pieces_wanted == [False, True, True]
+    assert plan.files_padding == [False, False, False]
+
+
+def test_plan_torrent_inconsistent():
+    with pytest.raises(ValueError):
+        api.plan_torrent(["t"], [_PIECE_SIZE], [True], _PIECE_SIZE, [True, True])
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_execute_operations(tmp_path, dry_run):
+    (tmp_path / "t").mkdir()
+    (tmp_path / "t" / "file0").write_bytes(b"0" * 65536)
+    (tmp_path / "t" / "file1").write_bytes(b"1" * 65536)
+    messages = []
+    result = api.execute_operations(
+        tmp_path,
+        [
+            api.RemoveFile("t/file0"),
+            api.TrimFile("t/file1", keep_first_bytes=1, keep_last_bytes=1),
+        ],
+        dry_run=dry_run,
+        log=messages.append,
+    )
+    assert result.removed_file_count == 1
+    assert result.trimmed_file_count == 1
+    assert result.freed_bytes > 0
+    assert len(messages) > 0
+    assert (tmp_path / "t" / "file0").exists() == dry_run
+    assert (tmp_path / "t" / "file1").exists() == dry_run
+    if not dry_run:
+        assert (tmp_path / "t" / "file1.part").read_bytes() == (
+            b"1" + bytes(65534) + b"1"
+        )
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_run(fake, capsys, dry_run):
+    unwanted_torrent = fake.add_torrent(
+        "unwanted",
+        [_PIECE_SIZE, _PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[True, False, False, True],
+    )
+    wanted_torrent = fake.add_torrent("wanted", [_PIECE_SIZE], _PIECE_SIZE)
+    messages = []
+    with transmission_rpc.from_url(fake.url) as transmission_client:
+        results = list(
+            api.run(
+                transmission_client,
+                fake.url,
+                dry_run=dry_run,
+                log=messages.append,
+            )
+        )
+
+    assert [result.info_hash for result in results] == [
+        unwanted_torrent.info_hash,
+        wanted_torrent.info_hash,
+    ]
+    assert results[0].name == "unwanted"
+    assert results[0].plan.operations == [
+        api.RemoveFile("unwanted/file1"),
+        api.RemoveFile("unwanted/file2"),
+    ]
+    assert results[0].execution.removed_file_count == 2
+    assert results[1].execution is None
+    assert len(messages) > 0
+    assert capsys.readouterr().err == ""
+    assert (fake.download_dir / "unwanted" / "file1").exists() == dry_run
+    assert fake.rpc_counts["torrent-verify"] == (0 if dry_run else 1)
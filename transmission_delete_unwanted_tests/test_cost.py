@@ -0,0 +1,64 @@
+import pytest
+from transmission_delete_unwanted import cost
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+
+@pytest.fixture(name="fake_clock")
+def _fixture_fake_clock():
+    return _FakeClock()
+
+
+def test_estimate():
+    cost_model = cost.CostModel(hash_rate=1000)
+    assert cost_model.estimate_seconds(0) == cost.TORRENT_OVERHEAD_SECONDS
+    assert cost_model.estimate_seconds(5000) == cost.TORRENT_OVERHEAD_SECONDS + 5
+
+
+def test_reclaim_ratio():
+    cost_model = cost.CostModel(hash_rate=1000)
+    verify_size = 90 * 1000
+    unwanted_bytes = verify_size + cost.TORRENT_OVERHEAD_SECONDS * 1000
+    assert cost_model.reclaim_ratio(unwanted_bytes, verify_size) == pytest.approx(1)
+    assert cost_model.reclaim_ratio(unwanted_bytes / 100, verify_size) == pytest.approx(
+        0.01
+    )
+
+
+def test_value():
+    cost_model = cost.CostModel(hash_rate=1000)
+    assert cost_model.value(
+        1000, 1000 * 1000 - cost.TORRENT_OVERHEAD_SECONDS * 1000
+    ) == pytest.approx(1)
+    assert cost_model.value(1000, 0) > cost_model.value(1000, 1000)
+
+
+def test_measured_hash_rate():
+    cost_model = cost.CostModel()
+    assert cost_model.hash_rate == cost.DEFAULT_HASH_RATE
+    cost_model.observe(1024 * 1024, 1)
+    # Not enough data to go on yet.
+    assert cost_model.hash_rate == cost.DEFAULT_HASH_RATE
+    cost_model.observe(2 * 1024 * 1024 * 1024 - 1024 * 1024, 7)
+    assert cost_model.hash_rate == pytest.approx(2 * 1024 * 1024 * 1024 / 8)
+
+
+def test_configured_hash_rate():
+    cost_model = cost.CostModel(hash_rate=1000)
+    cost_model.observe(2 * 1024 * 1024 * 1024, 1)
+    assert cost_model.hash_rate == 1000
+
+
+def test_time_budget(fake_clock):
+    assert cost.CostModel().remaining_seconds() is None
+    assert not cost.CostModel().has_time_budget
+    cost_model = cost.CostModel(time_budget=60, clock=fake_clock.clock)
+    assert cost_model.has_time_budget
+    fake_clock.now += 15
+    assert cost_model.remaining_seconds() == 45
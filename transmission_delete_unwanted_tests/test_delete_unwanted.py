@@ -1,6 +1,8 @@
+import collections
 import enum
 import pathlib
 import random
+import re
 import os
 import pytest
 import transmission_rpc
@@ -346,6 +348,98 @@ def test_delete_aligned(
     )
 
 
+def test_delete_missing(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+            "test2.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    # Transmission still thinks the file is there, but it's not anymore.
+    (torrent.path / "test1.txt").unlink()
+    run_with_torrent(torrent)
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test2.txt": test2contents},
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_delete_hardlink(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    tmp_path,
+    capsys,
+    dry_run,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test1contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(test1contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert_torrent_status(torrent.torf.infohash)
+    link_path = tmp_path / "link.txt"
+    os.link(torrent.path / "test1.txt", link_path)
+    run_with_torrent(torrent, *(["--dry-run"] if dry_run else []))
+    assert link_path.read_bytes() == test1contents
+    stderr = capsys.readouterr().err
+    assert "test1.txt has 1 other hard links" in stderr
+    assert "freed: 0 Bytes; 1 hardlinked files" in stderr
+
+
+def test_delete_throttled(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+            "test2.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(
+        torrent, "--delete-throttle-rate", "1", "--delete-throttle-step", "1"
+    )
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test2.txt": test2contents},
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+
 def test_delete_dryrun(
     run_with_torrent,
     setup_torrent,
@@ -442,6 +536,110 @@ def test_trim_beginaligned(
     )
 
 
+def test_trim_throttled(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE + 1)
+    test1contents = random.randbytes(1)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents, wanted=False),
+            "test1.txt": TorrentFile(test1contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert torrent.torf.pieces == 2
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(torrent, "--trim-throttle-rate", "1", "--idle-io-priority")
+    _check_file_tree(
+        torrent.path,
+        {
+            "test0.txt.part": b"\x00" * _MIN_PIECE_SIZE + test0contents[-1:],
+            "test1.txt": test1contents,
+        },
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[False, True],
+    )
+
+
+def test_trim_durable(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE + 1)
+    test1contents = random.randbytes(2)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE + 1)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents, wanted=False),
+            "test1.txt": TorrentFile(test1contents),
+            "test2.txt": TorrentFile(test2contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(torrent, "--durable")
+    _check_file_tree(
+        torrent.path,
+        {
+            "test0.txt.part": b"\x00" * _MIN_PIECE_SIZE + test0contents[-1:],
+            "test1.txt": test1contents,
+            "test2.txt.part": test2contents[: _MIN_PIECE_SIZE - 3],
+        },
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[False, True, False],
+    )
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"], ["--durable"]])
+def test_trim_prestage(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    extra_args,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE + 1)
+    test1contents = random.randbytes(2)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE + 1)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents, wanted=False),
+            "test1.txt": TorrentFile(test1contents),
+            "test2.txt": TorrentFile(test2contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(torrent, "--prestage", *extra_args)
+    _check_file_tree(
+        torrent.path,
+        {
+            "test0.txt.part": b"\x00" * _MIN_PIECE_SIZE + test0contents[-1:],
+            "test1.txt": test1contents,
+            "test2.txt.part": test2contents[: _MIN_PIECE_SIZE - 3],
+        },
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[False, True, False],
+    )
+
+
 def test_trim_dryrun(
     run_with_torrent,
     setup_torrent,
@@ -707,6 +905,112 @@ def test_delete_directories(
     )
 
 
+def test_trim_symlinked_directory(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    tmp_path,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE - 1)
+    test1contents = random.randbytes(_MIN_PIECE_SIZE + 2)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE - 1)
+    target_path = tmp_path / "subdir"
+
+    def before_add(path):
+        (path / "subdir").rename(target_path)
+        (path / "subdir").symlink_to(target_path, target_is_directory=True)
+
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "subdir/test1.txt": TorrentFile(test1contents, wanted=False),
+            "test2.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+        before_add=before_add,
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(torrent)
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test2.txt": test2contents},
+    )
+    _check_file_tree(
+        target_path,
+        {
+            "test1.txt.part": (
+                test1contents[:1] + bytes(_MIN_PIECE_SIZE - 1) + test1contents[-2:]
+            )
+        },
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+
+def test_scan_files_symlinks(tmp_path):
+    (tmp_path / "target").mkdir()
+    (tmp_path / "target" / "file").touch()
+    (tmp_path / "test").mkdir()
+    (tmp_path / "test" / "subdir").symlink_to(
+        tmp_path / "target", target_is_directory=True
+    )
+    # Loops must not send us into infinite recursion.
+    (tmp_path / "target" / "loop").symlink_to(
+        tmp_path / "test", target_is_directory=True
+    )
+    # pylint: disable-next=protected-access
+    present_file_names = transmission_delete_unwanted.delete_unwanted._scan_files(
+        tmp_path, ["test/subdir/file"]
+    )
+    assert "test/subdir/file" in present_file_names
+    assert "test/subdir" not in present_file_names
+
+
+def test_delete_padding(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    transmission_client,
+):
+    padding_contents = bytes(_MIN_PIECE_SIZE - 1)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE)
+    # Note the file names are chosen to get the files in the right order.
+    torrent = setup_torrent(
+        files={
+            "A.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE + 1), wanted=False),
+            "_____padding_file_0_": TorrentFile(padding_contents),
+            "b.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+        file_attributes={"_____padding_file_0_": "p"},
+    )
+    assert torrent.torf.pieces == 3
+    assert_torrent_status(torrent.torf.infohash)
+    run_with_torrent(torrent)
+    # The file is removed entirely instead of being trimmed, as the piece it shares
+    # with the pad file is not worth keeping.
+    _check_file_tree(
+        torrent.path,
+        {"_____padding_file_0_": padding_contents, "b.txt": test2contents},
+    )
+    assert transmission_client.get_torrent(
+        torrent.torf.infohash, arguments=["wanted"]
+    ).wanted == [False, False, True]
+    verify_torrent(torrent.torf.infohash)
+    # Transmission does not consider the torrent incomplete, which means it won't
+    # attempt to download the piece shared with the pad file again.
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[False, False, True],
+    )
+
+
 def test_delete_part(
     run_with_torrent,
     setup_torrent,
@@ -919,6 +1223,93 @@ def test_verify_on_error(
     ) == [True, False]
 
 
+@pytest.mark.parametrize("extra_args", [[], ["--batch"]])
+def test_local_verify(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    extra_args,
+):
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE)),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    run_with_torrent(
+        torrent, "--local-verify", "--local-verify-threads", "2", *extra_args
+    )
+    assert_torrent_status(torrent.torf.infohash, expect_pieces=[True, False])
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"]])
+def test_local_verify_corrupt(
+    run_with_torrent,
+    setup_torrent,
+    transmission_client,
+    verify_torrent,
+    extra_args,
+):
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE)),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+
+    def corrupt():
+        with open(torrent.path / "test0.txt", "r+b") as file:
+            file.write(b"corrupt")
+
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.CorruptTorrentException
+    ):
+        run_with_torrent(
+            torrent, "--local-verify", *extra_args, run_before_check=corrupt
+        )
+    # Transmission should have been told to verify the torrent regardless.
+    verify_torrent(torrent.torf.infohash, request=False)
+    transmission_info = transmission_client.get_torrent(
+        torrent.torf.infohash, arguments=["status", "pieces"]
+    )
+    assert transmission_info.status == transmission_rpc.Status.STOPPED
+    assert transmission_delete_unwanted.pieces.to_array(
+        transmission_info.pieces, piece_count=2
+    ) == [False, False]
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"], ["--local-verify"]])
+def test_metainfo_layout(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    extra_args,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+            "test2.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    run_with_torrent(torrent, "--metainfo-layout", *extra_args)
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test2.txt": test2contents},
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+
 def test_multiple_torrents(
     run,
     setup_torrent,
@@ -1026,3 +1417,346 @@ def test_all_torrents(
     verify_torrent(torrent0.torf.infohash)
     verify_torrent(torrent1.torf.infohash)
     verify_torrent(torrent2.torf.infohash)
+
+
+@pytest.mark.parametrize("schedule", ["shortest-first", "longest-first", "given"])
+def test_batch(
+    run,
+    setup_torrent,
+    assert_torrent_status,
+    transmission_client,
+    verify_torrent,
+    schedule,
+):
+    test00contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent0 = setup_torrent(
+        files={
+            "test00.txt": TorrentFile(test00contents),
+            "test01.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    test11contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent1 = setup_torrent(
+        files={
+            "test10.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+            "test11.txt": TorrentFile(test11contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    test20contents = random.randbytes(_MIN_PIECE_SIZE)
+    test21contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent2 = setup_torrent(
+        files={
+            "test20.txt": TorrentFile(test20contents),
+            "test21.txt": TorrentFile(test21contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert_torrent_status(torrent0.torf.infohash)
+    assert_torrent_status(torrent1.torf.infohash)
+    assert_torrent_status(torrent2.torf.infohash)
+
+    transmission_client.stop_torrent(torrent1.torf.infohash)
+
+    def get_status(torrent):
+        return transmission_client.get_torrent(
+            torrent.torf.infohash, arguments=["status"]
+        ).status
+
+    poll_until(lambda: get_status(torrent1) == transmission_rpc.Status.STOPPED)
+
+    def check_stopped():
+        assert get_status(torrent0) == transmission_rpc.Status.STOPPED
+        assert get_status(torrent1) == transmission_rpc.Status.STOPPED
+        assert get_status(torrent2) != transmission_rpc.Status.STOPPED
+
+    run("--batch", "--schedule", schedule, run_before_check=check_stopped)
+    _check_file_tree(
+        torrent0.path,
+        {"test00.txt": test00contents},
+    )
+    _check_file_tree(
+        torrent1.path,
+        {"test11.txt": test11contents},
+    )
+    _check_file_tree(
+        torrent2.path,
+        {"test20.txt": test20contents, "test21.txt": test21contents},
+    )
+    assert get_status(torrent0) != transmission_rpc.Status.STOPPED
+    assert get_status(torrent1) == transmission_rpc.Status.STOPPED
+    verify_torrent(torrent0.torf.infohash)
+    verify_torrent(torrent1.torf.infohash)
+    verify_torrent(torrent2.torf.infohash)
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"]])
+def test_journal_resume(
+    run_with_torrent,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    tmp_path,
+    extra_args,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test2contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(random.randbytes(_MIN_PIECE_SIZE), wanted=False),
+            "test2.txt": TorrentFile(test2contents),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert_torrent_status(torrent.torf.infohash)
+    journal_path = tmp_path / "journal"
+
+    class _Interrupted(Exception):
+        pass
+
+    def interrupt():
+        raise _Interrupted()
+
+    with pytest.raises(_Interrupted):
+        run_with_torrent(
+            torrent,
+            "--journal",
+            str(journal_path),
+            *extra_args,
+            run_before_check=interrupt,
+        )
+
+    # The torrent was left stopped by the interrupted run. Resuming should pick up
+    # where it left off and restart the torrent.
+    run_with_torrent(torrent, "--journal", str(journal_path), "--resume", *extra_args)
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test2.txt": test2contents},
+    )
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+    def fail():
+        assert False
+
+    # Nothing left to do.
+    run_with_torrent(
+        torrent,
+        "--journal",
+        str(journal_path),
+        "--resume",
+        *extra_args,
+        run_before_check=fail,
+    )
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(
+        torrent.torf.infohash,
+        expect_pieces=[True, False, True],
+    )
+
+
+def test_torrent_not_found(run):
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.DeleteUnwantedException
+    ):
+        run("--torrent-id", "0" * 40)
+
+
+@pytest.mark.parametrize(
+    "select_args",
+    [
+        lambda torrent: ["--name-regex", f"^{re.escape(torrent.torf.name)}$"],
+        lambda torrent: ["--download-dir-prefix", str(torrent.path.parent)],
+    ],
+)
+def test_select(
+    run,
+    setup_torrent,
+    assert_torrent_status,
+    verify_torrent,
+    select_args,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test1contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(test1contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    other_torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(test1contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    run(*select_args(torrent), "--min-size", "0.00001")
+    _check_file_tree(torrent.path, {"test0.txt": test0contents})
+    verify_torrent(torrent.torf.infohash)
+    assert_torrent_status(torrent.torf.infohash, expect_pieces=[True, False])
+    if select_args(torrent)[0] == "--name-regex":
+        _check_file_tree(
+            other_torrent.path,
+            {"test0.txt": test0contents, "test1.txt": test1contents},
+        )
+        assert_torrent_status(other_torrent.torf.infohash)
+
+
+def test_select_none(run, setup_torrent, assert_torrent_status):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test1contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(test1contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    run("--min-size", "1000000")
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test1.txt": test1contents},
+    )
+    assert_torrent_status(torrent.torf.infohash)
+
+
+def test_multiple_instances_dryrun(
+    run,
+    setup_torrent,
+    assert_torrent_status,
+    transmission_url,
+    capsys,
+):
+    test0contents = random.randbytes(_MIN_PIECE_SIZE)
+    test1contents = random.randbytes(_MIN_PIECE_SIZE)
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(test0contents),
+            "test1.txt": TorrentFile(test1contents, wanted=False),
+        },
+        piece_size=_MIN_PIECE_SIZE,
+    )
+    assert_torrent_status(torrent.torf.infohash)
+    # We only have one Transmission instance to play with, so just pretend it's two
+    # different ones. That's only safe in dry run mode, of course.
+    run("--transmission-url", transmission_url, "--dry-run")
+    _check_file_tree(
+        torrent.path,
+        {"test0.txt": test0contents, "test1.txt": test1contents},
+    )
+    assert_torrent_status(torrent.torf.infohash)
+    output_lines = capsys.readouterr().err.splitlines()
+    # Everything is prefixed with the instance it relates to, except for the overall
+    # summary.
+    assert all(line.startswith(f"[{transmission_url}] ") for line in output_lines[:-1])
+    assert (
+        sum(
+            line.startswith(
+                f"[{transmission_url}] >>> SUMMARY: 1 torrents examined; 1 with"
+                " unwanted pieces; 1 files would have been removed;"
+            )
+            for line in output_lines
+        )
+        == 2
+    )
+    assert output_lines[-1].startswith(
+        ">>> SUMMARY: 2 torrents examined; 2 with unwanted pieces; 2 files would have"
+        " been removed; 0 files would have been trimmed; present and not wanted:"
+        " 32.0 KiB;"
+    )
+
+
+class _FakeVerifyingClient:
+    # Plays back a sequence of torrent states, one per poll, advancing the clock by
+    # `poll_interval` seconds on each poll.
+    _TorrentState = collections.namedtuple(
+        "_TorrentState", ["info_hash", "status", "recheck_progress"]
+    )
+
+    def __init__(self, states, poll_interval):
+        self._states = list(states)
+        self._poll_interval = poll_interval
+        self.now = 0
+
+    def clock(self):
+        return self.now
+
+    def get_torrents(self, info_hashes, arguments):
+        assert arguments == ["infohash", "status", "recheckProgress"]
+        self.now += self._poll_interval
+        status, recheck_progress = self._states.pop(0)
+        return [
+            self._TorrentState(info_hash, status, recheck_progress)
+            for info_hash in info_hashes
+        ]
+
+
+def _make_verification_monitor(fake_client, timeout=None):
+    # pylint: disable=protected-access
+    messages = []
+    verification_monitor = (
+        transmission_delete_unwanted.delete_unwanted._VerificationMonitor(
+            fake_client,
+            {"a" * 40: 1000},
+            timeout=timeout,
+            log=messages.append,
+            clock=fake_client.clock,
+        )
+    )
+    return verification_monitor, messages
+
+
+def test_verification_monitor_progress():
+    fake_client = _FakeVerifyingClient(
+        [
+            (transmission_rpc.Status.CHECK_PENDING, 0.0),
+            (transmission_rpc.Status.CHECKING, 0.1),
+            (transmission_rpc.Status.CHECKING, 0.5),
+            (transmission_rpc.Status.STOPPED, 0.0),
+        ],
+        poll_interval=10,
+    )
+    verification_monitor, messages = _make_verification_monitor(fake_client)
+    assert verification_monitor.wait_for_any(["a" * 40]) == ["a" * 40]
+    assert messages == [
+        (
+            "Waiting for Transmission to start verification (other torrents may be"
+            " ahead in the queue)..."
+        ),
+        "Verification progress: 10% (100 Bytes of 1000 Bytes)",
+        (
+            "Verification progress: 50% (500 Bytes of 1000 Bytes) at 40 Bytes/s; ETA:"
+            " 12 seconds"
+        ),
+    ]
+
+
+def test_verification_monitor_report_interval():
+    fake_client = _FakeVerifyingClient(
+        [(transmission_rpc.Status.CHECKING, 0.1)] * 3
+        + [(transmission_rpc.Status.STOPPED, 0.0)],
+        poll_interval=4,
+    )
+    verification_monitor, messages = _make_verification_monitor(fake_client)
+    verification_monitor.wait_for_any(["a" * 40])
+    # Only the third poll is 10 seconds past the start.
+    assert messages == ["Verification progress: 10% (100 Bytes of 1000 Bytes)"]
+
+
+def test_verification_monitor_timeout():
+    fake_client = _FakeVerifyingClient(
+        [(transmission_rpc.Status.CHECKING, 0.1)] * 3, poll_interval=10
+    )
+    verification_monitor, _ = _make_verification_monitor(fake_client, timeout=25)
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.VerificationTimeoutException,
+        match="Timed out waiting for Transmission to verify torrents",
+    ):
+        verification_monitor.wait_for_any(["a" * 40])
+    assert fake_client.now == 30
@@ -0,0 +1,389 @@
+import io
+import itertools
+import pytest
+import transmission_rpc
+from transmission_delete_unwanted_tests import benchmark, fake_transmission
+import transmission_delete_unwanted.delete_unwanted
+import transmission_delete_unwanted.mark_unwanted
+import transmission_delete_unwanted.pieces
+import transmission_delete_unwanted.planning
+
+_PIECE_SIZE = 16384
+
+
+def _get_pieces(fake, torrent):
+    with transmission_rpc.from_url(fake.url) as transmission_client:
+        transmission_info = transmission_client.get_torrent(
+            torrent.info_hash, arguments=["pieces", "pieceCount", "status"]
+        )
+    assert transmission_info.status == transmission_rpc.Status.SEEDING
+    return transmission_delete_unwanted.pieces.to_array(
+        transmission_info.pieces, transmission_info.piece_count
+    )
+
+
+@pytest.mark.parametrize(
+    "extra_args", [[], ["--batch"], ["--metainfo-layout", "--local-verify"]]
+)
+def test_delete(fake, extra_args):
+    torrent = fake.add_torrent(
+        "test",
+        [_PIECE_SIZE, _PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[True, False, False, True],
+    )
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, *extra_args]
+    )
+    assert not (fake.download_dir / "test" / "file1").exists()
+    assert not (fake.download_dir / "test" / "file2").exists()
+    assert (fake.download_dir / "test" / "file0").exists()
+    assert (fake.download_dir / "test" / "file3").exists()
+    assert _get_pieces(fake, torrent) == [True, False, False, True]
+    assert fake.rpc_counts["torrent-verify"] == 1
+
+
+def _add_trimmed_torrent(fake):
+    # The unwanted file shares its first and last pieces with the wanted ones, so it
+    # gets trimmed down to those.
+    return fake.add_torrent(
+        "test",
+        [_PIECE_SIZE - 1, 2 * _PIECE_SIZE, _PIECE_SIZE + 1],
+        _PIECE_SIZE,
+        wanted=[True, False, True],
+        sparse=False,
+    )
+
+
+@pytest.mark.parametrize(
+    "extra_args", [[], ["--batch"], ["--metainfo-layout", "--local-verify"]]
+)
+def test_delete_trim(fake, extra_args):
+    torrent = _add_trimmed_torrent(fake)
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, *extra_args]
+    )
+    assert (fake.download_dir / "test" / "file1.part").exists()
+    assert _get_pieces(fake, torrent) == [True, False, True, True]
+
+
+def test_delete_trim_lost_data(fake, monkeypatch):
+    torrent = _add_trimmed_torrent(fake)
+
+    def copy_zeros(from_file, to_file, length, **_kwargs):
+        from_file.seek(length, 1)
+        to_file.seek(length, 1)
+        to_file.truncate(to_file.tell())
+
+    monkeypatch.setattr("transmission_delete_unwanted.file.copy_sparse", copy_zeros)
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.CorruptTorrentException
+    ):
+        transmission_delete_unwanted.delete_unwanted.run(
+            ["--transmission-url", fake.url]
+        )
+    assert torrent.present == bytearray([False, False, False, True])
+
+
+def test_verify_zeroed_piece(fake):
+    torrent = fake.add_torrent(
+        "test", [_PIECE_SIZE, _PIECE_SIZE + 1], _PIECE_SIZE, sparse=False
+    )
+    with open(fake.download_dir / "test" / "file1", "r+b") as torrent_file:
+        torrent_file.seek(_PIECE_SIZE)
+        torrent_file.write(b"\0")
+    torrent.verify()
+    assert torrent.present == bytearray([True, True, False])
+
+
+def test_mark_delete(fake, monkeypatch):
+    torrent = fake.add_torrent(
+        "test", [_PIECE_SIZE, _PIECE_SIZE, _PIECE_SIZE], _PIECE_SIZE
+    )
+    monkeypatch.setattr("sys.stdin", io.StringIO("test/file1\n"))
+    assert transmission_delete_unwanted.mark_unwanted.run(
+        ["--transmission-url", fake.url, "--delete"]
+    )
+    assert torrent.wanted == [True, False, True]
+    assert not (fake.download_dir / "test" / "file1").exists()
+    assert _get_pieces(fake, torrent) == [True, False, True]
+
+
+@pytest.mark.parametrize(
+    "command,command_args", [("delete", []), ("mark", ["--delete"])]
+)
+def test_benchmark(command, command_args, capsys):
+    benchmark.run(
+        [command, "--torrents", "3", "--pieces-per-torrent", "10", "--", *command_args]
+    )
+    output = capsys.readouterr().out
+    assert "Wall time:" in output
+    assert "torrent-verify: 3" in output
+    assert "Peak RSS:" in output
+
+
+def test_min_reclaim_ratio(fake, capsys):
+    # With a hash rate of 1 MB/s, the per-torrent overhead alone is worth 10 MB.
+    small_torrent = fake.add_torrent(
+        "small",
+        [_PIECE_SIZE, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[True, False],
+    )
+    large_torrent = fake.add_torrent(
+        "large", [_PIECE_SIZE, 1024 * _PIECE_SIZE], _PIECE_SIZE, wanted=[True, False]
+    )
+    transmission_delete_unwanted.delete_unwanted.run([
+        "--transmission-url",
+        fake.url,
+        "--hash-rate",
+        "1",
+        "--min-reclaim-ratio",
+        "0.1",
+    ])
+    assert (fake.download_dir / "small" / "file1").exists()
+    assert not (fake.download_dir / "large" / "file1").exists()
+    assert _get_pieces(fake, small_torrent) == [True, True]
+    assert _get_pieces(fake, large_torrent) == [True] + [False] * 1024
+    assert fake.rpc_counts["torrent-verify"] == 1
+    assert (
+        "; 1 torrents skipped (16.0 KiB not wanted)"
+        in capsys.readouterr().err.splitlines()[-1]
+    )
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"]])
+def test_time_budget(fake, extra_args, capsys, monkeypatch):
+    # At 1 MB/s, there is only enough time for one torrent. The second one frees more
+    # space for the same verification cost, so that's the one that gets picked.
+    for name, unwanted_size in (("less", _PIECE_SIZE), ("more", 64 * _PIECE_SIZE)):
+        fake.add_torrent(
+            name,
+            [64 * _PIECE_SIZE, unwanted_size],
+            _PIECE_SIZE,
+            wanted=[True, False],
+        )
+    # The choice is made without planning every torrent.
+    planned_torrent_names = []
+    plan_torrent = transmission_delete_unwanted.planning.plan_torrent
+
+    def record_plan_torrent(file_names, *args, **kwargs):
+        planned_torrent_names.append(file_names[0].split("/")[0])
+        return plan_torrent(file_names, *args, **kwargs)
+
+    monkeypatch.setattr(
+        "transmission_delete_unwanted.planning.plan_torrent", record_plan_torrent
+    )
+    transmission_delete_unwanted.delete_unwanted.run([
+        "--transmission-url",
+        fake.url,
+        "--hash-rate",
+        "1",
+        "--time-budget",
+        "15",
+        *extra_args,
+    ])
+    assert (fake.download_dir / "less" / "file1").exists()
+    assert not (fake.download_dir / "more" / "file1").exists()
+    assert fake.rpc_counts["torrent-verify"] == 1
+    assert planned_torrent_names == ["more"]
+    assert any(
+        line.startswith('Skipping "less"')
+        for line in capsys.readouterr().err.splitlines()
+    )
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--batch"]])
+def test_journal_resume_interrupted_stop(fake, tmp_path, monkeypatch, extra_args):
+    torrent = fake.add_torrent(
+        "test", [_PIECE_SIZE, _PIECE_SIZE, _PIECE_SIZE], _PIECE_SIZE
+    )
+    torrent.wanted = [True, False, True]
+    args = ["--transmission-url", fake.url, "--journal", str(tmp_path / "journal")]
+
+    class _Interrupted(Exception):
+        pass
+
+    def interrupt(*_args, **_kwargs):
+        raise _Interrupted()
+
+    # Transmission got the request to stop the torrent, but we didn't stick around to
+    # see it through.
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            "transmission_delete_unwanted.delete_unwanted._wait_for_status", interrupt
+        )
+        with pytest.raises(_Interrupted):
+            transmission_delete_unwanted.delete_unwanted.run([*args, *extra_args])
+    assert torrent.status == fake_transmission.STATUS_STOPPED
+    assert (fake.download_dir / "test" / "file1").exists()
+
+    transmission_delete_unwanted.delete_unwanted.run([*args, "--resume", *extra_args])
+    assert not (fake.download_dir / "test" / "file1").exists()
+    assert _get_pieces(fake, torrent) == [True, False, True]
+
+
+@pytest.mark.parametrize(
+    "extra_args",
+    [[], ["--batch"], ["--dry-run"], ["--metainfo-layout", "--local-verify"]],
+)
+def test_padding(fake, extra_args):
+    torrent = fake.add_torrent(
+        "test",
+        [_PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[False, True, True],
+        file_names=["file0", f".pad/{_PIECE_SIZE - 1}", "file2"],
+        padding=[False, True, False],
+    )
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, *extra_args]
+    )
+    dry_run = "--dry-run" in extra_args
+    # The file is removed, not trimmed, and Transmission is told not to download
+    # the piece it shared with the pad file again.
+    assert (fake.download_dir / "test" / "file0").exists() == dry_run
+    assert not (fake.download_dir / "test" / "file0.part").exists()
+    assert torrent.wanted == ([False, True, True] if dry_run else [False, False, True])
+
+
+@pytest.mark.parametrize("extra_args", [[], ["--metainfo-layout"]])
+def test_padding_name_only(fake, extra_args):
+    # Without the metainfo flagging it as a pad file, the file is treated as payload,
+    # even though it is named like one.
+    torrent = fake.add_torrent(
+        "test",
+        [_PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[False, True, True],
+        file_names=["file0", f".pad/{_PIECE_SIZE - 1}", "file2"],
+        sparse=False,
+    )
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, *extra_args]
+    )
+    assert (fake.download_dir / "test" / "file0.part").exists()
+    assert torrent.wanted == [False, True, True]
+    assert _get_pieces(fake, torrent) == [False, True, True]
+
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize(
+    "schedule_args,torrent_ids,expected_order",
+    [
+        (["--schedule", "shortest-first"], None, ["small", "medium", "large"]),
+        (["--schedule", "longest-first"], None, ["large", "medium", "small"]),
+        (["--schedule", "given"], None, ["large", "small", "medium"]),
+        (
+            ["--schedule", "given"],
+            ["medium", "large", "small"],
+            ["medium", "large", "small"],
+        ),
+        ([], None, ["small", "medium", "large"]),
+    ],
+)
+def test_schedule(fake, batch, schedule_args, torrent_ids, expected_order):
+    torrents = {
+        name: fake.add_torrent(
+            name,
+            [_PIECE_SIZE] * (wanted_piece_count + 1),
+            _PIECE_SIZE,
+            wanted=[True] * wanted_piece_count + [False],
+        )
+        for name, wanted_piece_count in (("large", 3), ("small", 1), ("medium", 2))
+    }
+    transmission_delete_unwanted.delete_unwanted.run([
+        "--transmission-url",
+        fake.url,
+        *schedule_args,
+        *(["--batch"] if batch else []),
+        *itertools.chain.from_iterable(
+            ("--torrent-id", torrents[name].info_hash) for name in torrent_ids or []
+        ),
+    ])
+    verify_order = [torrents[name].info_hash for name in expected_order]
+    assert fake.verify_requests == (
+        [verify_order] if batch else [[info_hash] for info_hash in verify_order]
+    )
+
+
+def test_multiple_instances(fake, tmp_path, capsys):
+    (tmp_path / "other").mkdir()
+    with fake_transmission.FakeTransmission(tmp_path / "other") as other_fake:
+        fakes = [fake, other_fake]
+        for each_fake in fakes:
+            each_fake.add_torrent(
+                "test", [_PIECE_SIZE, _PIECE_SIZE], _PIECE_SIZE, wanted=[True, False]
+            )
+        transmission_delete_unwanted.delete_unwanted.run([
+            "--transmission-url",
+            fake.url,
+            "--transmission-url",
+            other_fake.url,
+        ])
+    for each_fake in fakes:
+        assert (each_fake.download_dir / "test" / "file0").exists()
+        assert not (each_fake.download_dir / "test" / "file1").exists()
+        assert each_fake.rpc_counts["torrent-verify"] == 1
+    output_lines = capsys.readouterr().err.splitlines()
+    # Everything is prefixed with the instance it relates to, except for the overall
+    # summary.
+    for line in output_lines[:-1]:
+        assert line.startswith((f"[{fake.url}] ", f"[{other_fake.url}] "))
+    for each_fake in fakes:
+        assert any(
+            line.startswith(
+                f"[{each_fake.url}] >>> SUMMARY: 1 torrents examined; 1 with unwanted"
+                " pieces; 1 files removed;"
+            )
+            for line in output_lines
+        )
+    assert output_lines[-1].startswith(
+        ">>> SUMMARY: 2 torrents examined; 2 with unwanted pieces; 2 files removed; 0"
+        " files trimmed; present and not wanted: 32.0 KiB;"
+    )
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize(
+    "stdin",
+    [
+        "test/file0\rtest/file2\r",
+        "test/file0\r\ntest/file2\r\n",
+        "test/file0\ntest/file2\r",
+        "test/file0\r\ntest/file2",
+    ],
+)
+def test_mark_line_endings(fake, monkeypatch, binary, stdin):
+    torrent = fake.add_torrent(
+        "test", [_PIECE_SIZE, _PIECE_SIZE, _PIECE_SIZE], _PIECE_SIZE
+    )
+    monkeypatch.setattr(
+        "sys.stdin",
+        (
+            io.TextIOWrapper(io.BytesIO(stdin.encode()), encoding="utf-8")
+            if binary
+            else io.StringIO(stdin)
+        ),
+    )
+    assert transmission_delete_unwanted.mark_unwanted.run(
+        ["--transmission-url", fake.url]
+    )
+    assert torrent.wanted == [False, True, False]
+
+
+def test_mark_null_carriage_return(fake, monkeypatch):
+    torrent = fake.add_torrent(
+        "test",
+        [_PIECE_SIZE, _PIECE_SIZE],
+        _PIECE_SIZE,
+        file_names=["file\r", "file"],
+    )
+    monkeypatch.setattr(
+        "sys.stdin",
+        io.TextIOWrapper(io.BytesIO(b"test/file\r\0"), encoding="utf-8"),
+    )
+    assert transmission_delete_unwanted.mark_unwanted.run(
+        ["--transmission-url", fake.url, "--null"]
+    )
+    assert torrent.wanted == [False, True]
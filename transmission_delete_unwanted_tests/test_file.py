@@ -1,11 +1,27 @@
+import functools
+import os
 import random
 import pytest
 from transmission_delete_unwanted import file
 
 
+@pytest.fixture(
+    name="copy_function",
+    params=[
+        file.copy,
+        functools.partial(file.copy, use_mmap=True),
+        file.copy_sparse,
+        functools.partial(file.copy_sparse, use_mmap=True),
+    ],
+    ids=["copy", "copy_mmap", "copy_sparse", "copy_sparse_mmap"],
+)
+def _fixture_copy_function(request):
+    return request.param
+
+
 @pytest.fixture(name="copy", params=[1, 2, 100])
-def _fixture_copy(request):
-    return lambda *kargs, **kwargs: file.copy(
+def _fixture_copy(request, copy_function):
+    return lambda *kargs, **kwargs: copy_function(
         *kargs, **kwargs, buffer_size=request.param
     )
 
@@ -92,3 +108,197 @@ def test_copy_combined(tmp_path, from_offset, to_offset, copy_length, copy):
             == b"\x00" * to_offset
             + test_contents[from_offset : from_offset + copy_length]
         )
+
+
+class _RecordingRateLimiter:
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self.consumed = []
+
+    def consume(self, amount):
+        self.consumed.append((amount, self._file_path.stat().st_size))
+
+
+@pytest.mark.parametrize("step_size", [1, 3, 10, 100])
+def test_truncate_gradually(tmp_path, step_size):
+    file_path = tmp_path / "file.txt"
+    with open(file_path, "wb") as file_to_truncate:
+        file_to_truncate.write(b"0123456789")
+    rate_limiter = _RecordingRateLimiter(file_path)
+    file.truncate_gradually(file_path, step_size, rate_limiter)
+    assert sum(amount for amount, _ in rate_limiter.consumed) == 10
+    assert all(amount <= step_size for amount, _ in rate_limiter.consumed)
+    # Each wait must happen before the corresponding truncation.
+    assert [size for _, size in rate_limiter.consumed] == list(range(10, 0, -step_size))
+    assert file_path.stat().st_size == 10 - sum(
+        amount for amount, _ in rate_limiter.consumed[:-1]
+    )
+
+
+def test_truncate_gradually_hardlink(tmp_path):
+    file_path = tmp_path / "file.txt"
+    with open(file_path, "wb") as file_to_truncate:
+        file_to_truncate.write(b"0123456789")
+    os.link(file_path, tmp_path / "link.txt")
+    file.truncate_gradually(file_path, 1, _RecordingRateLimiter(file_path))
+    with open(tmp_path / "link.txt", "rb") as link_file:
+        assert link_file.read() == b"0123456789"
+
+
+def test_truncate_gradually_read_only(tmp_path, monkeypatch):
+    file_path = tmp_path / "file.txt"
+    with open(file_path, "wb") as file_to_truncate:
+        file_to_truncate.write(b"0123456789")
+    file_path.chmod(0o444)
+    if os.geteuid() == 0:
+        # Permissions don't apply to root, so pretend they do.
+        def open_read_only(path, mode):
+            assert "+" in mode
+            raise PermissionError(path)
+
+        monkeypatch.setattr(file, "open", open_read_only, raising=False)
+    rate_limiter = _RecordingRateLimiter(file_path)
+    file.truncate_gradually(file_path, 1, rate_limiter)
+    assert rate_limiter.consumed == [(10, 10)]
+    file_path.unlink()
+
+
+def test_copy_rate_limited(tmp_path, copy):
+    test_contents = b"test contents"
+    with open(tmp_path / "from.txt", "wb") as from_file:
+        from_file.write(test_contents)
+    rate_limiter = _RecordingRateLimiter(tmp_path / "from.txt")
+    with (
+        open(tmp_path / "from.txt", "rb") as from_file,
+        open(tmp_path / "to.txt", "wb") as to_file,
+    ):
+        copy(from_file, to_file, len(test_contents), rate_limiter=rate_limiter)
+    with open(tmp_path / "to.txt", "rb") as to_file:
+        assert to_file.read() == test_contents
+    assert sum(amount for amount, _ in rate_limiter.consumed) == len(test_contents)
+
+
+def test_sync(tmp_path):
+    (tmp_path / "subdir").mkdir()
+    file_paths = [tmp_path / "file0.txt", tmp_path / "subdir" / "file1.txt"]
+    for file_path in file_paths:
+        with open(file_path, "wb") as file_to_sync:
+            file_to_sync.write(b"test contents")
+    file.sync(file_paths)
+    file.sync([])
+
+
+def test_sync_directory(tmp_path):
+    file.sync_directory(tmp_path)
+
+
+def test_allocated_size(tmp_path):
+    file_path = tmp_path / "test.txt"
+    with open(file_path, "wb") as test_file:
+        test_file.write(random.randbytes(1024 * 1024))
+        test_file.flush()
+        os.fsync(test_file.fileno())
+    file_stat = file_path.stat()
+    assert file.allocated_size(file_stat) >= 1024 * 1024
+    assert not file.is_sparse(file_stat)
+
+
+def test_allocated_size_sparse(tmp_path):
+    file_path = tmp_path / "test.txt"
+    with open(file_path, "wb") as test_file:
+        test_file.truncate(1024 * 1024)
+    file_stat = file_path.stat()
+    assert file.allocated_size(file_stat) < 1024 * 1024
+    assert file.is_sparse(file_stat)
+
+
+def _write_sparse_file(file_path, extents, size):
+    with open(file_path, "wb") as sparse_file:
+        for extent_offset, extent_contents in extents:
+            sparse_file.seek(extent_offset)
+            sparse_file.write(extent_contents)
+        sparse_file.truncate(size)
+
+
+def test_data_extents(tmp_path):
+    block_size = 1024 * 1024
+    file_path = tmp_path / "test.bin"
+    _write_sparse_file(file_path, [(block_size, b"x" * block_size)], 4 * block_size)
+    with open(file_path, "rb") as test_file:
+        if not file.is_sparse(os.fstat(test_file.fileno())):
+            pytest.skip("filesystem does not support sparse files")
+        test_file.seek(42)
+        extents = file.data_extents(test_file, 0, 4 * block_size)
+        assert test_file.tell() == 42
+    # The filesystem is allowed to report more data than there actually is.
+    assert sum(extent_length for _, extent_length in extents) < 4 * block_size
+    assert any(
+        extent_offset <= block_size and extent_offset + extent_length >= 2 * block_size
+        for extent_offset, extent_length in extents
+    )
+    with open(file_path, "rb") as test_file:
+        assert len(file.data_extents(test_file, 3 * block_size, block_size)) == 0
+        assert len(file.data_extents(test_file, 0, 0)) == 0
+
+
+@pytest.mark.parametrize("buffer_size", [1000, 1024 * 1024])
+def test_copy_sparse(tmp_path, buffer_size):
+    block_size = 1024 * 1024
+    test_contents = random.randbytes(block_size)
+    from_path = tmp_path / "from.bin"
+    to_path = tmp_path / "to.bin"
+    _write_sparse_file(
+        from_path,
+        [(block_size, test_contents), (4 * block_size, test_contents)],
+        8 * block_size,
+    )
+    with (
+        open(from_path, "rb") as from_file,
+        open(to_path, "wb") as to_file,
+    ):
+        from_file.seek(block_size // 2)
+        to_file.seek(1)
+        file.copy_sparse(from_file, to_file, 7 * block_size, buffer_size=buffer_size)
+        assert from_file.tell() == block_size // 2 + 7 * block_size
+        assert to_file.tell() == 1 + 7 * block_size
+    with open(from_path, "rb") as from_file, open(to_path, "rb") as to_file:
+        from_file.seek(block_size // 2)
+        assert to_file.read() == b"\x00" + from_file.read(7 * block_size)
+    if file.is_sparse(from_path.stat()):
+        assert file.allocated_size(to_path.stat()) < 4 * block_size
+
+
+def test_copy_sparse_outofbounds(tmp_path):
+    from_path = tmp_path / "from.bin"
+    _write_sparse_file(from_path, [], 100)
+    with (
+        open(from_path, "rb") as from_file,
+        open(tmp_path / "to.bin", "wb") as to_file,
+    ):
+        from_file.seek(50)
+        with pytest.raises(file.EOFException):
+            file.copy_sparse(from_file, to_file, 51)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_copy_large_offset(tmp_path, use_mmap):
+    # Exercises mmap offset alignment, as well as reusing the copy buffer across
+    # differently sized copies.
+    test_contents = random.randbytes(3 * 65536 + 1234)
+    with open(tmp_path / "from.bin", "wb") as from_file:
+        from_file.write(test_contents)
+    for offset, length in [(70000, 100000), (1, 10), (65536, 2 * 65536 + 1234)]:
+        with (
+            open(tmp_path / "from.bin", "rb") as from_file,
+            open(tmp_path / "to.bin", "wb") as to_file,
+        ):
+            from_file.seek(offset)
+            file.copy(from_file, to_file, length, use_mmap=use_mmap)
+            assert from_file.tell() == offset + length
+            assert (
+                from_file.read(1)
+                == test_contents[offset + length : offset + length + 1]
+            )
+        assert (tmp_path / "to.bin").read_bytes() == test_contents[
+            offset : offset + length
+        ]
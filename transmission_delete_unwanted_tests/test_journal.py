@@ -0,0 +1,86 @@
+import pytest
+from transmission_delete_unwanted import journal
+
+_URL = "http://127.0.0.1:9091"
+
+
+def _record(test_journal, info_hash, phase, files_wanted=(True, False)):
+    test_journal.record(
+        _URL, info_hash, phase, files_wanted=files_wanted, initially_stopped=False
+    )
+
+
+def test_fingerprint():
+    assert journal.fingerprint([True, False]) == journal.fingerprint([1, 0])
+    assert journal.fingerprint([True, False]) != journal.fingerprint([False, True])
+
+
+def test_resume(tmp_path):
+    path = tmp_path / "journal"
+    test_journal = journal.Journal(path, resume=False, read_only=False)
+    _record(test_journal, "a", journal.PLANNED)
+    _record(test_journal, "a", journal.STOPPED)
+    _record(test_journal, "b", journal.RESTARTED)
+    test_journal.close()
+
+    test_journal = journal.Journal(path, resume=True, read_only=False)
+    assert test_journal.get(_URL, "a")["phase"] == journal.STOPPED
+    assert test_journal.get(_URL, "a")["wanted"] == journal.fingerprint([True, False])
+    assert not test_journal.get(_URL, "a")["initially_stopped"]
+    assert test_journal.get(_URL, "b")["phase"] == journal.RESTARTED
+    assert test_journal.get(_URL, "c") is None
+    assert test_journal.get("http://other", "a") is None
+    _record(test_journal, "a", journal.FILES_DONE)
+    test_journal.close()
+
+    test_journal = journal.Journal(path, resume=True, read_only=True)
+    assert test_journal.get(_URL, "a")["phase"] == journal.FILES_DONE
+
+
+def test_no_resume(tmp_path):
+    path = tmp_path / "journal"
+    test_journal = journal.Journal(path, resume=False, read_only=False)
+    _record(test_journal, "a", journal.STOPPED)
+    test_journal.close()
+
+    test_journal = journal.Journal(path, resume=False, read_only=False)
+    assert test_journal.get(_URL, "a") is None
+    test_journal.close()
+    assert path.read_text() == ""
+
+
+def test_resume_missing(tmp_path):
+    test_journal = journal.Journal(tmp_path / "journal", resume=True, read_only=True)
+    assert test_journal.get(_URL, "a") is None
+
+
+def test_read_only(tmp_path):
+    path = tmp_path / "journal"
+    test_journal = journal.Journal(path, resume=True, read_only=True)
+    _record(test_journal, "a", journal.STOPPED)
+    assert test_journal.get(_URL, "a")["phase"] == journal.STOPPED
+    assert not path.exists()
+
+
+def test_partial_line(tmp_path):
+    path = tmp_path / "journal"
+    test_journal = journal.Journal(path, resume=False, read_only=False)
+    _record(test_journal, "a", journal.STOPPED)
+    test_journal.close()
+    with open(path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"url": "http')
+
+    test_journal = journal.Journal(path, resume=True, read_only=False)
+    assert test_journal.get(_URL, "a")["phase"] == journal.STOPPED
+    _record(test_journal, "a", journal.FILES_DONE)
+    test_journal.close()
+
+    test_journal = journal.Journal(path, resume=True, read_only=True)
+    assert test_journal.get(_URL, "a")["phase"] == journal.FILES_DONE
+
+
+def test_corrupt(tmp_path):
+    path = tmp_path / "journal"
+    path.write_text("not json\n")
+    with pytest.raises(journal.JournalException):
+        journal.Journal(path, resume=True, read_only=True)
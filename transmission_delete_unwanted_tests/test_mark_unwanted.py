@@ -115,3 +115,101 @@ def test_missing(run, setup_torrent, get_files_wanted):
         "test0.txt": True,
         "test1.txt": False,
     }
+
+
+def test_unmark_duplicates(run, setup_torrent, get_files_wanted):
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(4)),
+            "test1.txt": TorrentFile(random.randbytes(4)),
+        }
+    )
+    assert run(stdin=f"{torrent.torf.name}/test1.txt\r\n" * 3)
+    assert get_files_wanted(torrent.torf.infohash) == {
+        "test0.txt": True,
+        "test1.txt": False,
+    }
+
+
+def test_unmark_null(run, setup_torrent, get_files_wanted):
+    torrent = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(4)),
+            "test1.txt": TorrentFile(random.randbytes(4)),
+            "test2.txt": TorrentFile(random.randbytes(4)),
+        }
+    )
+    assert run(
+        "--null",
+        stdin=f"{torrent.torf.name}/test0.txt\0{torrent.torf.name}/test2.txt\0",
+    )
+    assert get_files_wanted(torrent.torf.infohash) == {
+        "test0.txt": False,
+        "test1.txt": True,
+        "test2.txt": False,
+    }
+
+
+@pytest.mark.parametrize("max_concurrent_requests", [1, 2])
+def test_unmark_chunked(run, setup_torrent, get_files_wanted, max_concurrent_requests):
+    torrent1 = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(4)),
+            "test1.txt": TorrentFile(random.randbytes(4)),
+            "test2.txt": TorrentFile(random.randbytes(4)),
+        }
+    )
+    torrent2 = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(4)),
+            "test1.txt": TorrentFile(random.randbytes(4)),
+        }
+    )
+    assert run(
+        "--files-per-request=1",
+        f"--max-concurrent-requests={max_concurrent_requests}",
+        stdin=(
+            f"{torrent1.torf.name}/test0.txt\n{torrent1.torf.name}/test2.txt\n"
+            f"{torrent2.torf.name}/test1.txt"
+        ),
+    )
+    assert get_files_wanted(torrent1.torf.infohash) == {
+        "test0.txt": False,
+        "test1.txt": True,
+        "test2.txt": False,
+    }
+    assert get_files_wanted(torrent2.torf.infohash) == {
+        "test0.txt": True,
+        "test1.txt": False,
+    }
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_unmark_delete(run, setup_torrent, get_files_wanted, dry_run):
+    torrent1 = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(16384)),
+            "test1.txt": TorrentFile(random.randbytes(16384)),
+        },
+        piece_size=16384,
+    )
+    torrent2 = setup_torrent(
+        files={
+            "test0.txt": TorrentFile(random.randbytes(16384)),
+            "test1.txt": TorrentFile(random.randbytes(16384), wanted=False),
+        },
+        piece_size=16384,
+    )
+    assert run(
+        "--delete",
+        *(["--dry-run"] if dry_run else []),
+        stdin=f"{torrent1.torf.name}/test1.txt",
+    )
+    assert get_files_wanted(torrent1.torf.infohash) == {
+        "test0.txt": True,
+        "test1.txt": dry_run,
+    }
+    assert (torrent1.path / "test0.txt").exists()
+    assert (torrent1.path / "test1.txt").exists() == dry_run
+    # Only the torrents that were just modified are processed.
+    assert (torrent2.path / "test1.txt").exists()
@@ -0,0 +1,109 @@
+import random
+import pytest
+import torf
+from transmission_delete_unwanted import metainfo
+
+
+def test_decode():
+    assert metainfo.decode(b"i42e") == 42
+    assert metainfo.decode(b"i-3e") == -3
+    assert metainfo.decode(b"4:test") == b"test"
+    assert metainfo.decode(b"0:") == b""
+    assert metainfo.decode(b"li1e2:abe") == [1, b"ab"]
+    assert metainfo.decode(b"d1:ai1e1:bli2eee") == {b"a": 1, b"b": [2]}
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"i42", b"5:test", b"l", b"d1:ai1e", b"di1ei2ee", b"i1ei2e", b"x"]
+)
+def test_decode_invalid(data):
+    with pytest.raises(metainfo.MetainfoException):
+        metainfo.decode(data)
+
+
+@pytest.mark.parametrize("file_count", [1, 3])
+def test_read(tmp_path, file_count):
+    content_path = tmp_path / "content"
+    content_path.mkdir()
+    for file_index in range(file_count):
+        (content_path / f"test{file_index}.txt").write_bytes(
+            random.randbytes(random.randrange(1, 3 * 16384))
+        )
+    torf_torrent = torf.Torrent(
+        path=content_path if file_count > 1 else content_path / "test0.txt",
+        piece_size=16384,
+    )
+    torf_torrent.generate()
+    torf_torrent.write(tmp_path / "test.torrent")
+
+    torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+    assert torrent_metainfo.info_hash == torf_torrent.infohash
+    assert torrent_metainfo.piece_size == 16384
+    assert torrent_metainfo.piece_hashes == b"".join(torf_torrent.hashes)
+    assert torrent_metainfo.file_names == [
+        str(torrent_file) for torrent_file in torf_torrent.files
+    ]
+    assert list(torrent_metainfo.file_lengths) == [
+        torrent_file.size for torrent_file in torf_torrent.files
+    ]
+
+
+def test_read_missing_pieces(tmp_path):
+    (tmp_path / "test.torrent").write_bytes(
+        b"d4:infod6:lengthi1e4:name4:test12:piece lengthi16384eee"
+    )
+    torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+    assert torrent_metainfo.piece_hashes is None
+    assert torrent_metainfo.file_names == ["test"]
+
+
+def test_read_utf8(tmp_path):
+    (tmp_path / "test.torrent").write_bytes(
+        b"d4:infod5:filesld6:lengthi1e4:pathl1:xe10:path.utf-8l1:yeee4:name1:a"
+        b"10:name.utf-81:b12:piece lengthi16384eee"
+    )
+    assert metainfo.read(tmp_path / "test.torrent").file_names == ["b/y"]
+
+
+def test_read_extra_keys(tmp_path):
+    (tmp_path / "test.torrent").write_bytes(
+        b"d4:infod5:filesld4:attr1:x6:lengthi2e6:md5sum0:4:pathl1:x1:yeed6:lengthi3e"
+        b"4:pathl1:zeee4:name4:test12:piece lengthi16384ee7:comment0:e"
+    )
+    torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+    assert torrent_metainfo.file_names == ["test/x/y", "test/z"]
+    assert list(torrent_metainfo.file_lengths) == [2, 3]
+    assert torrent_metainfo.file_padding == [False, False]
+
+
+def test_read_padding(tmp_path):
+    (tmp_path / "test.torrent").write_bytes(
+        b"d4:infod5:filesld6:lengthi2e4:pathl1:xeed4:attr2:xp6:lengthi16382e"
+        b"4:pathl4:.pad5:16382eed6:lengthi3e4:pathl1:zeee4:name4:test"
+        b"12:piece lengthi16384eee"
+    )
+    torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+    assert torrent_metainfo.file_names == ["test/x", "test/.pad/16382", "test/z"]
+    assert torrent_metainfo.file_padding == [False, True, False]
+
+
+@pytest.mark.parametrize(
+    "path", [b"l2:..e", b"l0:e", b"le", b"l3:a/be", b"l1:\xffe", b"li1ee"]
+)
+def test_read_unsafe_path(tmp_path, path):
+    (tmp_path / "test.torrent").write_bytes(
+        b"d4:infod5:filesld6:lengthi1e4:path"
+        + path
+        + b"ee4:name4:test12:piece lengthi16384eee"
+    )
+    try:
+        torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+    except metainfo.MetainfoException:
+        return
+    assert torrent_metainfo.file_names is None
+
+
+def test_read_missing_info(tmp_path):
+    (tmp_path / "test.torrent").write_bytes(b"d8:announce0:e")
+    with pytest.raises(metainfo.MetainfoException):
+        metainfo.read(tmp_path / "test.torrent")
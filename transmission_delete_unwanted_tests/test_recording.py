@@ -0,0 +1,170 @@
+import io
+import json
+import pytest
+import transmission_delete_unwanted.delete_unwanted
+import transmission_delete_unwanted.mark_unwanted
+
+_PIECE_SIZE = 16384
+
+
+@pytest.fixture(name="fake")
+def _fixture_fake(fake):
+    fake.add_torrent(
+        "test",
+        [_PIECE_SIZE, _PIECE_SIZE + 1, _PIECE_SIZE - 1, _PIECE_SIZE],
+        _PIECE_SIZE,
+        wanted=[True, False, False, True],
+    )
+    return fake
+
+
+@pytest.fixture(name="recording_path")
+def _fixture_recording_path(tmp_path):
+    return tmp_path / "recording.jsonl"
+
+
+@pytest.fixture(name="run_mark")
+def _fixture_run_mark(monkeypatch):
+    def run_mark(*args, stdin=""):
+        with monkeypatch.context() as patch:
+            patch.setattr("sys.stdin", io.StringIO(stdin))
+            return transmission_delete_unwanted.mark_unwanted.run(list(args))
+
+    return run_mark
+
+
+def _read_recording(recording_path):
+    with open(recording_path, "r", encoding="utf-8") as recording_file:
+        return [json.loads(line) for line in recording_file]
+
+
+def _get_output_lines(capsys):
+    return capsys.readouterr().err.splitlines()
+
+
+def test_record_replay(fake, recording_path, capsys):
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, "--dry-run", "--record", str(recording_path)]
+    )
+    recorded_output = _get_output_lines(capsys)
+    rpc_count = sum(fake.rpc_counts.values())
+    recording = _read_recording(recording_path)
+    assert len(recording) == 1 + rpc_count
+    assert {entry["request"]["method"] for entry in recording[1:]} == {
+        "session-get",
+        "torrent-get",
+    }
+
+    transmission_delete_unwanted.delete_unwanted.run(["--replay", str(recording_path)])
+    assert _get_output_lines(capsys) == recorded_output
+    assert sum(fake.rpc_counts.values()) == rpc_count
+    assert (fake.download_dir / "test" / "file1").exists()
+
+
+def test_record_replay_anonymize(fake, recording_path, capsys):
+    transmission_delete_unwanted.delete_unwanted.run([
+        "--transmission-url",
+        fake.url,
+        "--record",
+        str(recording_path),
+        "--record-anonymize",
+    ])
+    _get_output_lines(capsys)
+    torrent = fake.get_torrent(1)
+    recording_contents = recording_path.read_text(encoding="utf-8")
+    for sensitive_string in (
+        "test/file",
+        torrent.info_hash,
+        str(fake.download_dir),
+        fake.url.partition("://")[2],
+    ):
+        assert sensitive_string not in recording_contents
+
+    transmission_delete_unwanted.delete_unwanted.run(["--replay", str(recording_path)])
+    output = _get_output_lines(capsys)
+    # The files don't exist under their anonymized names.
+    assert sum(line.startswith("WARNING: could not find") for line in output) == 2
+    assert output[-1].startswith(">>> SUMMARY: 1 torrents examined; 1 with")
+
+
+def test_record_no_credentials(fake, recording_path):
+    transmission_delete_unwanted.delete_unwanted.run([
+        "--transmission-url",
+        fake.url.replace("://", "://user:secret@"),
+        "--dry-run",
+        "--record",
+        str(recording_path),
+    ])
+    assert "secret" not in recording_path.read_text(encoding="utf-8")
+
+
+def test_replay_mismatch(fake, recording_path):
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, "--dry-run", "--record", str(recording_path)]
+    )
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.DeleteUnwantedException,
+        match="Request not found in recording",
+    ):
+        transmission_delete_unwanted.delete_unwanted.run(
+            ["--replay", str(recording_path), "--metainfo-layout"]
+        )
+
+
+def test_replay_invalid(tmp_path):
+    invalid_recording_path = tmp_path / "invalid.jsonl"
+    invalid_recording_path.write_text("{}\n", encoding="utf-8")
+    with pytest.raises(
+        transmission_delete_unwanted.delete_unwanted.DeleteUnwantedException,
+        match="Unable to read recording",
+    ):
+        transmission_delete_unwanted.delete_unwanted.run(
+            ["--replay", str(invalid_recording_path)]
+        )
+
+
+def test_replay_transmission_url(recording_path):
+    with pytest.raises(SystemExit):
+        transmission_delete_unwanted.delete_unwanted.run([
+            "--replay",
+            str(recording_path),
+            "--transmission-url",
+            "http://127.0.0.1:9091",
+        ])
+
+
+@pytest.mark.parametrize("anonymize", [False, True])
+def test_record_replay_mark(fake, recording_path, run_mark, capsys, anonymize):
+    assert run_mark(
+        "--transmission-url",
+        fake.url,
+        "--delete",
+        "--dry-run",
+        "--record",
+        str(recording_path),
+        *(["--record-anonymize"] if anonymize else []),
+        stdin="test/file0\n",
+    )
+    recorded_output = _get_output_lines(capsys)
+    assert (fake.download_dir / "test" / "file0").exists()
+    assert fake.get_torrent(1).wanted == [True, False, False, True]
+
+    # The file names come from the recording, not standard input.
+    assert run_mark("--replay", str(recording_path), "--delete")
+    if not anonymize:
+        assert _get_output_lines(capsys) == recorded_output
+
+
+def test_replay_fields_order(fake, recording_path):
+    transmission_delete_unwanted.delete_unwanted.run(
+        ["--transmission-url", fake.url, "--dry-run", "--record", str(recording_path)]
+    )
+    # The order of fields is not stable across processes, as transmission_rpc builds
+    # the list from a set.
+    recording = _read_recording(recording_path)
+    for entry in recording[1:]:
+        entry["request"]["arguments"].get("fields", []).reverse()
+    recording_path.write_text(
+        "".join(json.dumps(entry) + "\n" for entry in recording), encoding="utf-8"
+    )
+    transmission_delete_unwanted.delete_unwanted.run(["--replay", str(recording_path)])
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+import pytest
+
+# Heavy dependencies that are only needed once we actually talk to Transmission, and
+# should therefore not be imported on startup.
+_LAZY_MODULES = ["transmission_rpc", "requests", "humanize", "backoff"]
+
+_ENTRY_MODULES = [
+    "transmission_delete_unwanted.delete_unwanted",
+    "transmission_delete_unwanted.mark_unwanted",
+]
+
+# Generous upper bound on the cumulative time it takes to import the entry modules.
+# Eagerly importing transmission_rpc alone typically takes well over this.
+_MAX_IMPORT_TIME_US = 100000
+
+
+def _import_entry_modules(*python_args):
+    return subprocess.run(
+        [
+            sys.executable,
+            *python_args,
+            "-c",
+            (
+                f"import sys, {', '.join(_ENTRY_MODULES)};"
+                f" print(' '.join(m for m in {_LAZY_MODULES!r} if m in sys.modules))"
+            ),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_startup_does_not_import_lazy_modules():
+    assert _import_entry_modules().stdout.split() == []
+
+
+def test_startup_import_time():
+    # Run once to make sure bytecode is cached, so that we don't measure compilation.
+    _import_entry_modules()
+    import_times = {}
+    for line in _import_entry_modules("-X", "importtime").stderr.splitlines():
+        _, cumulative_us, module = line.split("|")
+        module = module.strip()
+        if module in _ENTRY_MODULES:
+            import_times[module] = int(cumulative_us)
+    assert import_times.keys() == set(_ENTRY_MODULES)
+    assert sum(import_times.values()) < _MAX_IMPORT_TIME_US, import_times
+
+
+@pytest.mark.parametrize("module", _ENTRY_MODULES)
+def test_help(module):
+    result = subprocess.run(
+        [sys.executable, "-c", f"import {module}; {module}.main()", "--help"],
+        check=False,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert "usage:" in result.stdout
@@ -0,0 +1,63 @@
+import pytest
+from transmission_delete_unwanted import throttle
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.sleeps.append(duration)
+        self.now += duration
+
+
+@pytest.fixture(name="fake_clock")
+def _fixture_fake_clock():
+    return _FakeClock()
+
+
+def _token_bucket(fake_clock, rate, capacity):
+    return throttle.TokenBucket(
+        rate=rate, capacity=capacity, clock=fake_clock.clock, sleep=fake_clock.sleep
+    )
+
+
+def test_within_capacity(fake_clock):
+    token_bucket = _token_bucket(fake_clock, rate=10, capacity=100)
+    token_bucket.consume(50)
+    token_bucket.consume(50)
+    assert not fake_clock.sleeps
+
+
+def test_over_capacity(fake_clock):
+    token_bucket = _token_bucket(fake_clock, rate=10, capacity=100)
+    token_bucket.consume(100)
+    token_bucket.consume(20)
+    assert fake_clock.sleeps == [pytest.approx(2)]
+
+
+def test_debt(fake_clock):
+    token_bucket = _token_bucket(fake_clock, rate=10, capacity=0)
+    token_bucket.consume(100)
+    assert fake_clock.sleeps == [pytest.approx(10)]
+    token_bucket.consume(10)
+    assert fake_clock.sleeps == [pytest.approx(10), pytest.approx(1)]
+
+
+def test_refill(fake_clock):
+    token_bucket = _token_bucket(fake_clock, rate=10, capacity=100)
+    token_bucket.consume(100)
+    fake_clock.now += 5
+    token_bucket.consume(50)
+    assert not fake_clock.sleeps
+
+
+def test_refill_capped(fake_clock):
+    token_bucket = _token_bucket(fake_clock, rate=10, capacity=100)
+    fake_clock.now += 1000
+    token_bucket.consume(150)
+    assert fake_clock.sleeps == [pytest.approx(5)]
@@ -0,0 +1,98 @@
+import random
+import pytest
+import torf
+from transmission_delete_unwanted import metainfo, verify
+
+_PIECE_SIZE = 16384
+
+
+@pytest.fixture(name="setup_torrent")
+def _fixture_setup_torrent(tmp_path):
+    def setup_torrent(files, files_padding=None):
+        content_path = tmp_path / "content"
+        content_path.mkdir()
+        for file_name, contents in files.items():
+            (content_path / file_name).write_bytes(contents)
+        torf_torrent = torf.Torrent(path=content_path, piece_size=_PIECE_SIZE)
+        torf_torrent.generate()
+        torf_torrent.write(tmp_path / "test.torrent")
+        torrent_metainfo = metainfo.read(tmp_path / "test.torrent")
+        files = [
+            (str(torrent_file), torrent_file.size)
+            for torrent_file in torf_torrent.files
+        ]
+        return lambda piece_indices, thread_count=2: verify.find_lost_pieces(
+            tmp_path,
+            files,
+            piece_size=torrent_metainfo.piece_size,
+            piece_hashes=torrent_metainfo.piece_hashes,
+            piece_indices=piece_indices,
+            thread_count=thread_count,
+            files_padding=files_padding,
+        )
+
+    return setup_torrent
+
+
+def test_verify(setup_torrent):
+    find_lost_pieces = setup_torrent({
+        "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+        "test1.txt": random.randbytes(100),
+        "test2.txt": random.randbytes(2 * _PIECE_SIZE),
+    })
+    assert find_lost_pieces(range(4)) == []
+    assert find_lost_pieces(range(4), thread_count=1) == []
+    assert find_lost_pieces([]) == []
+
+
+def test_verify_corrupt(tmp_path, setup_torrent):
+    find_lost_pieces = setup_torrent({
+        "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+        "test1.txt": random.randbytes(2 * _PIECE_SIZE),
+    })
+    with open(tmp_path / "content" / "test1.txt", "r+b") as test_file:
+        test_file.seek(_PIECE_SIZE)
+        test_file.write(b"corrupt")
+    assert find_lost_pieces(range(4)) == [2]
+    assert find_lost_pieces([0, 1]) == []
+
+
+def test_verify_missing(tmp_path, setup_torrent):
+    find_lost_pieces = setup_torrent({
+        "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+        "test1.txt": random.randbytes(2 * _PIECE_SIZE),
+    })
+    (tmp_path / "content" / "test0.txt").unlink()
+    assert find_lost_pieces(range(4)) == [0, 1]
+
+
+def test_verify_part(tmp_path, setup_torrent):
+    find_lost_pieces = setup_torrent({
+        "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+        "test1.txt": random.randbytes(2 * _PIECE_SIZE),
+    })
+    (tmp_path / "content" / "test0.txt").rename(tmp_path / "content" / "test0.txt.part")
+    assert find_lost_pieces(range(4)) == []
+
+
+def test_verify_truncated(tmp_path, setup_torrent):
+    find_lost_pieces = setup_torrent({
+        "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+        "test1.txt": random.randbytes(2 * _PIECE_SIZE),
+    })
+    with open(tmp_path / "content" / "test1.txt", "r+b") as test_file:
+        test_file.truncate(_PIECE_SIZE)
+    assert find_lost_pieces(range(4)) == [2, 3]
+
+
+def test_verify_padding(tmp_path, setup_torrent):
+    find_lost_pieces = setup_torrent(
+        {
+            "test0.txt": random.randbytes(_PIECE_SIZE + 100),
+            "test1.pad": bytes(_PIECE_SIZE - 100),
+            "test2.txt": random.randbytes(_PIECE_SIZE),
+        },
+        files_padding=[False, True, False],
+    )
+    (tmp_path / "content" / "test1.pad").unlink()
+    assert find_lost_pieces(range(3)) == []